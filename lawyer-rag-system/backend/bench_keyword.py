@@ -0,0 +1,175 @@
+"""关键词索引（keyword_index.KeywordIndex）的基准
+
+在合成语料（按Zipf分布由常用汉字组词、再按词频抽词成文，夹杂标点和条文编号）上测量：
+- 建立索引：分词并建立主段、写快照、从快照加载（内存映射）、增量写入和并入主段的耗时
+- 查询延迟（p50/p95/p99）：剪枝检索（当前实现：按影响分顺序读取并提前结束，必要时改用MaxScore）
+  与对全部倒排逐条累加的全量打分对比，并核对两者前k名的得分完全一致；另测增量段中有10%新块时和按文档范围过滤时的延迟
+
+用法：
+    python bench_keyword.py --chunks 200000 --queries 200
+"""
+import argparse
+import math
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from keyword_index import BM25_B, BM25_K1, KeywordIndex, tokenize
+
+# 字表、词表大小和Zipf指数：先按字频组成词，文本再按词频由词拼成，词之间随机插入标点
+CHARACTERS = 3500
+WORDS = 40000
+ZIPF_EXPONENT = 1.0
+WORD_LENGTHS = (1, 2, 3, 4)
+WORD_LENGTH_WEIGHTS = (0.2, 0.5, 0.2, 0.1)
+PUNCTUATION = "，。；：、"
+PUNCTUATION_RATE = 0.12
+
+
+def _zipf(count: int) -> np.ndarray:
+    weights = 1.0 / np.arange(1, count + 1) ** ZIPF_EXPONENT
+    return weights / weights.sum()
+
+
+class SyntheticCorpus:
+    """按Zipf分布生成中文文本块（固定随机种子，结果可复现）"""
+
+    def __init__(self, seed: int = 0):
+        self.rng = np.random.default_rng(seed)
+        characters = [chr(0x4E00 + code) for code in self.rng.permutation(0x9FA5 - 0x4E00)[:CHARACTERS]]
+        lengths = self.rng.choice(WORD_LENGTHS, size=WORDS, p=WORD_LENGTH_WEIGHTS)
+        picks = self.rng.choice(CHARACTERS, size=int(lengths.sum()), p=_zipf(CHARACTERS))
+        ends = np.cumsum(lengths)
+        self.words = np.array(["".join(characters[i] for i in picks[end - length:end])
+                               for end, length in zip(ends, lengths)], dtype=object)
+        self.word_cdf = np.cumsum(_zipf(WORDS))
+        self.marks = np.array(list(PUNCTUATION) + [""] * int(len(PUNCTUATION) / PUNCTUATION_RATE - len(PUNCTUATION)),
+                              dtype=object)
+
+    def text(self, length: int) -> str:
+        """约length个字的文本"""
+        count = length // 2
+        words = self.words[np.minimum(np.searchsorted(self.word_cdf, self.rng.random(count)), WORDS - 1)]
+        marks = self.marks[self.rng.integers(0, len(self.marks), size=count)]
+        return "".join((words + marks).tolist())[:length]
+
+    def chunks(self, count: int, length: int):
+        """生成 (文本, 文档ID)，每个文档100块，每块带一个条文编号，模拟“第X条”之类的精确匹配"""
+        for i in range(count):
+            yield f"第{self.rng.integers(1, 1200)}条 {self.text(length)}", f"doc{i // 100}"
+
+
+def _percentiles(samples: list) -> str:
+    values = np.array(samples) * 1000
+    return (f"{np.percentile(values, 50):>9.2f}{np.percentile(values, 95):>9.2f}"
+            f"{np.percentile(values, 99):>9.2f}{values.max():>9.2f}")
+
+
+def exhaustive_search(index: KeywordIndex, query: str, k: int) -> list:
+    """全量打分：对查询词的全部倒排逐条累加BM25得分（只适用于全部块都在主段、没有删除的索引）"""
+    base = index.base
+    count = len(index.chunk_ids)
+    lengths = index.doc_lengths.values
+    scores = np.zeros(count)
+    for term in set(tokenize(query)):
+        start, end = base.span(term)
+        if start == end:
+            continue
+        df = end - start
+        idf = math.log(1 + (count - df + 0.5) / (df + 0.5))
+        ids, tfs = base.ids[start:end], base.tfs[start:end].astype(np.float64)
+        norm = 1 - BM25_B + BM25_B * lengths[ids] / index.average_length
+        scores[ids] += idf * tfs * (BM25_K1 + 1) / (tfs + BM25_K1 * norm)
+    top = np.argsort(-scores)[:k]
+    return [float(scores[i]) for i in top if scores[i] > 0]
+
+
+def timed_queries(search, queries: list) -> list:
+    samples = []
+    for query in queries:
+        start = time.perf_counter()
+        search(query)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="关键词索引基准")
+    parser.add_argument("--chunks", type=int, default=200000, help="文本块数")
+    parser.add_argument("--chunk-chars", type=int, default=500, help="每块字数")
+    parser.add_argument("--queries", type=int, default=200, help="查询数")
+    parser.add_argument("--k", type=int, default=20, help="每次查询返回的块数")
+    args = parser.parse_args()
+
+    corpus = SyntheticCorpus()
+    samples = []
+
+    def chunks():
+        for i, (text, document_id) in enumerate(corpus.chunks(args.chunks, args.chunk_chars)):
+            if i % max(args.chunks // args.queries, 1) == 0:
+                samples.append(text)
+            yield f"{document_id}:{i}", document_id, text
+
+    start = time.perf_counter()
+    index = KeywordIndex.build(chunks(), auto_merge=False)
+    build_seconds = time.perf_counter() - start
+
+    # 查询：一半是块中的片段（条文编号、短语），一半是随机生成的较长问题
+    rng = np.random.default_rng(1)
+    queries = []
+    for text in samples[:args.queries // 2]:
+        offset = int(rng.integers(0, len(text) - 12))
+        queries.append(text[offset:offset + int(rng.integers(4, 12))])
+    queries += [corpus.text(int(rng.integers(8, 24))) for _ in range(args.queries - len(queries))]
+
+    with tempfile.TemporaryDirectory(prefix="bench_keyword_") as directory:
+        path = Path(directory) / "keyword_index.bin"
+        start = time.perf_counter()
+        index.save(path)
+        save_seconds = time.perf_counter() - start
+        size_mb = path.stat().st_size / 1024 / 1024
+        del index
+
+        start = time.perf_counter()
+        index = KeywordIndex.load(path, auto_merge=False)
+        load_seconds = time.perf_counter() - start
+
+        print(f"块数 {len(index)}，倒排 {len(index.base)} 条，词 {len(index.base.terms)} 个，快照 {size_mb:.0f}MB")
+        print(f"分词并建立主段 {build_seconds:.1f}s，写快照 {save_seconds:.1f}s，加载快照 {load_seconds:.2f}s")
+
+        mismatches = 0
+        for query in queries:
+            expected = exhaustive_search(index, query, args.k)
+            actual = [score for _, score in index.search(query, args.k)]
+            if len(expected) != len(actual) or not np.allclose(expected, actual, rtol=1e-9):
+                mismatches += 1
+        print(f"剪枝检索与全量打分的前{args.k}名得分不一致的查询：{mismatches}/{len(queries)}")
+
+        print(f"{'查询方式':<20}{'p50(ms)':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+        timed_queries(lambda query: index.search(query, args.k), queries)
+        print(f"{'剪枝检索':<20}{_percentiles(timed_queries(lambda q: index.search(q, args.k), queries))}")
+        print(f"{'全量打分':<20}{_percentiles(timed_queries(lambda q: exhaustive_search(index, q, args.k), queries))}")
+
+        documents = sorted(index.by_document)
+        for label, scope in (("剪枝检索（1%文档）", documents[::100]), ("剪枝检索（33%文档）", documents[::3])):
+            print(f"{label:<20}{_percentiles(timed_queries(lambda q: index.search(q, args.k, scope), queries))}")
+
+        # 增量写入：合并前增量段最多约为主段的MERGE_RATIO（10%）
+        added = args.chunks // 10
+        start = time.perf_counter()
+        for i, (text, document_id) in enumerate(corpus.chunks(added, args.chunk_chars)):
+            index.add(f"new-{document_id}:{i}", f"new-{document_id}", text)
+        add_seconds = time.perf_counter() - start
+        print(f"{'剪枝检索（+10%增量段）':<20}{_percentiles(timed_queries(lambda q: index.search(q, args.k), queries))}")
+
+        start = time.perf_counter()
+        index.merge()
+        merge_seconds = time.perf_counter() - start
+        print(f"增量写入 {added} 块 {add_seconds:.1f}s（{added / add_seconds:.0f} 块/s），并入主段 {merge_seconds:.1f}s")
+        del index
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""文档库SQLite访问层的微基准
+
+对比两种连接方式下的写入和列表吞吐：
+- fresh：每次调用新建连接、默认回滚日志（连接池改造之前的方式）
+- pooled：线程本地连接 + WAL + busy_timeout（当前实现）
+
+用法：
+    python bench_sqlite.py --documents 2000 --threads 4
+"""
+import argparse
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from sql_file import DocumentManager
+
+
+class FreshConnections:
+    """改造前的访问方式：每次调用新建连接，使用默认的回滚日志和5秒锁等待"""
+
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        conn = sqlite3.connect(db_path)
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.close()
+
+    @contextmanager
+    def connect(self):
+        with sqlite3.connect(self.db_path) as conn:
+            conn.row_factory = sqlite3.Row
+            yield conn
+
+    def close_all(self):
+        pass
+
+
+def _run_threads(threads: int, target) -> float:
+    workers = [threading.Thread(target=target, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - start
+
+
+def bench(mode: str, documents: int, threads: int, pages: int) -> dict:
+    # 临时目录在基准结束后连同数据库文件一起删除
+    with tempfile.TemporaryDirectory(prefix=f"bench_{mode}_") as directory:
+        manager = DocumentManager(Path(directory) / "documents.db")
+        if mode == "fresh":
+            manager.pool.close_all()
+            manager.pool = FreshConnections(manager.db_path)
+
+        errors = [0]
+        base = datetime(2024, 1, 1)
+
+        # 写入：每个线程登记文档并更新状态，模拟并发上传
+        def insert(worker: int):
+            for i in range(documents // threads):
+                document_id = str(uuid.uuid4())
+                ok = manager.save_document(
+                    document_id=document_id,
+                    filename=f"{worker}-{i}.pdf",
+                    category=("contract", "law", "case")[i % 3],
+                    upload_time=(base + timedelta(seconds=worker * documents + i)).isoformat(),
+                    status="processing"
+                )
+                ok = manager.update_status(document_id, "completed") and ok
+                if not ok:
+                    errors[0] += 1
+
+        insert_seconds = _run_threads(threads, insert)
+        insert_errors = errors[0]
+
+        # 列表：每个线程按游标翻页（翻到底后从头开始），同时有一个线程持续写入
+        errors[0] = 0
+        stop = threading.Event()
+
+        def writer():
+            i = 0
+            while not stop.is_set():
+                if not manager.save_document(str(uuid.uuid4()), f"w{i}.pdf", "law",
+                                             datetime.now().isoformat(), "completed"):
+                    errors[0] += 1
+                i += 1
+
+        def list_pages(worker: int):
+            after = None
+            for _ in range(pages):
+                try:
+                    _, after = manager.list_documents(100, after, category=("contract", "law", "case")[worker % 3])
+                except sqlite3.Error:
+                    errors[0] += 1
+
+        writer_thread = threading.Thread(target=writer)
+        writer_thread.start()
+        list_seconds = _run_threads(threads, list_pages)
+        stop.set()
+        writer_thread.join()
+        manager.close()
+
+    return {
+        "mode": mode,
+        "insert_per_s": documents / insert_seconds,
+        "insert_errors": insert_errors,
+        "list_pages_per_s": threads * pages / list_seconds,
+        "list_errors": errors[0]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="文档库SQLite访问层微基准")
+    parser.add_argument("--documents", type=int, default=2000, help="写入的文档数")
+    parser.add_argument("--threads", type=int, default=4, help="并发线程数")
+    parser.add_argument("--pages", type=int, default=500, help="每个线程读取的列表页数")
+    args = parser.parse_args()
+
+    print(f"{'模式':<8}{'写入/s':>10}{'写入失败':>10}{'列表页/s':>12}{'列表失败':>10}")
+    for mode in ("fresh", "pooled"):
+        result = bench(mode, args.documents, args.threads, args.pages)
+        print(f"{result['mode']:<8}{result['insert_per_s']:>10.0f}{result['insert_errors']:>10}"
+              f"{result['list_pages_per_s']:>12.0f}{result['list_errors']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""批量导入目录中的法律文档
+
+用法:
+    python bulk_ingest.py /path/to/archive --category contract
+
+解析 → 分块+向量化 → 写入向量库 三个阶段流水线并行，阶段之间用有界队列衔接。
+导入状态记录在DocumentManager中：已完成的文件按内容哈希跳过，
+中断时处于processing状态的文件在下次运行时沿用原document_id重新导入，因此可以随时中断后续跑。
+"""
+import argparse
+import hashlib
+import multiprocessing
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+from config import PDF_PARSE_WORKERS, UPLOAD_CHUNK_SIZE
+from document_loader import load_document
+from rag_service import SimpleRAGService, chunk_records
+from preview_store import compress_pages
+from sql_file import DocumentManager
+from timing import timed, format_timings
+
+SUPPORTED_SUFFIXES = ('.pdf', '.docx')
+
+# 队列结束标记
+_DONE = object()
+
+
+def file_sha256(file_path: Path) -> str:
+    """分块计算文件的SHA-256"""
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def _parse_file(file_path: str):
+    """在解析进程中串行加载单个文件（文件级并行已由进程池提供）"""
+    return load_document(file_path, parallel=False)
+
+
+class IngestProgress:
+    """导入进度与吞吐统计"""
+
+    def __init__(self, total_files: int):
+        self.total_files = total_files
+        self.files_done = 0
+        self.files_failed = 0
+        self.files_skipped = 0
+        self.chunks_done = 0
+        self.timings: Dict[str, float] = {}
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, files_done: int = 0, files_failed: int = 0, files_skipped: int = 0, chunks_done: int = 0):
+        with self._lock:
+            self.files_done += files_done
+            self.files_failed += files_failed
+            self.files_skipped += files_skipped
+            self.chunks_done += chunks_done
+
+    def add_timings(self, timings: Dict[str, float]):
+        with self._lock:
+            for stage, seconds in timings.items():
+                self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+    def report(self) -> str:
+        with self._lock:
+            elapsed = time.perf_counter() - self.started
+            processed = self.files_done + self.files_failed + self.files_skipped
+            return (
+                f"[{processed}/{self.total_files}] 完成 {self.files_done}，失败 {self.files_failed}，"
+                f"跳过 {self.files_skipped}，{self.chunks_done} 块，耗时 {elapsed:.1f}s，"
+                f"{self.files_done / elapsed if elapsed else 0:.2f} 文件/s，"
+                f"{self.chunks_done / elapsed if elapsed else 0:.1f} 块/s"
+            )
+
+
+class BulkIngester:
+    """目录批量导入流水线，复用SimpleRAGService的分块、向量化和入库逻辑"""
+
+    def __init__(self, rag_service: SimpleRAGService, document_manager: DocumentManager,
+                 parse_workers: int = PDF_PARSE_WORKERS, queue_size: int = 8):
+        self.rag_service = rag_service
+        self.document_manager = document_manager
+        self.parse_workers = max(1, parse_workers)
+        self.queue_size = queue_size
+
+        self.parsed_queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self.embedded_queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+
+    def _plan(self, file_path: Path, category: str, progress: IngestProgress) -> Optional[Dict]:
+        """确定文件的导入任务：已完成或内容重复的跳过，中断过的沿用原document_id"""
+        content_hash = file_sha256(file_path)
+        existing = self.document_manager.find_by_content_hash(content_hash)
+
+        if existing is not None and existing['status'] == "completed":
+            progress.add(files_skipped=1)
+            return None
+        if existing is not None and existing['file_path'] != str(file_path):
+            # 同一内容正在以其他路径导入
+            progress.add(files_skipped=1)
+            return None
+
+        document_id = existing['document_id'] if existing else str(uuid.uuid4())
+        self.document_manager.save_document(
+            document_id=document_id,
+            filename=file_path.name,
+            category=category,
+            upload_time=datetime.now().isoformat(),
+            status="processing",
+            file_path=str(file_path),
+            content_hash=content_hash,
+            file_size=file_path.stat().st_size
+        )
+        return {"document_id": document_id, "file_path": file_path, "filename": file_path.name,
+                "category": category, "timings": {}}
+
+    def _fail(self, job: Dict, error: Exception, progress: IngestProgress):
+        print(f"❌ 导入失败：{job['file_path']}: {error}")
+        self.document_manager.update_status(job['document_id'], "failed", error=str(error))
+        progress.add(files_failed=1)
+
+    def _parse_stage(self, files, category: str, progress: IngestProgress):
+        """阶段1：提交解析任务，队列满时阻塞，最多queue_size个文件同时在解析或等待下游"""
+        with ProcessPoolExecutor(max_workers=self.parse_workers,
+                                 mp_context=multiprocessing.get_context("spawn")) as pool:
+            for file_path in files:
+                try:
+                    job = self._plan(file_path, category, progress)
+                except Exception as e:
+                    print(f"❌ 读取文件失败：{file_path}: {e}")
+                    progress.add(files_failed=1)
+                    continue
+                if job is None:
+                    continue
+                job["started"] = time.perf_counter()
+                job["future"] = pool.submit(_parse_file, str(file_path))
+                self.parsed_queue.put(job)
+            self.parsed_queue.put(_DONE)
+
+    def _embed_stage(self, progress: IngestProgress):
+        """阶段2：分块并向量化"""
+        while True:
+            job = self.parsed_queue.get()
+            if job is _DONE:
+                self.embedded_queue.put(_DONE)
+                return
+            try:
+                documents = job.pop("future").result()
+                job["timings"]["load"] = time.perf_counter() - job.pop("started")
+                with timed(job["timings"], "split"):
+                    job["texts"], job["articles"] = self.rag_service.split_documents(
+                        documents, job["document_id"], job["filename"], job["category"])
+                with timed(job["timings"], "embed"):
+                    job["embeddings"] = self.rag_service.embed_model.embed_documents(
+                        [text.page_content for text in job["texts"]])
+                # 队列中只保留压缩后的页面文本，入库阶段写入预览存储
+                job["pages"] = compress_pages(documents)
+            except Exception as e:
+                self._fail(job, e, progress)
+                continue
+            self.embedded_queue.put(job)
+
+    def _store_stage(self, progress: IngestProgress):
+        """阶段3：写入向量库并标记完成"""
+        while True:
+            job = self.embedded_queue.get()
+            if job is _DONE:
+                return
+            try:
+                with timed(job["timings"], "store"):
+                    self.rag_service.add_chunks(job["document_id"], job["texts"], job["embeddings"])
+                with timed(job["timings"], "sqlite"):
+                    self.document_manager.save_chunks(job["document_id"], chunk_records(job["texts"]))
+                    self.document_manager.save_articles(job["document_id"], job["articles"])
+                    self.document_manager.save_pages(job["document_id"], job.pop("pages"))
+                    self.rag_service.preview_store.invalidate(job["document_id"])
+                saved = self.document_manager.save_document(
+                    document_id=job["document_id"],
+                    filename=job["filename"],
+                    category=job["category"],
+                    status="completed",
+                    chunk_count=len(job["texts"]),
+                    timings=job["timings"]
+                )
+                # 完成状态没有写入时计为失败，而不是完成
+                if not saved:
+                    raise Exception("保存文档到数据库失败")
+                progress.add(files_done=1, chunks_done=len(job["texts"]))
+                progress.add_timings(job["timings"])
+            except Exception as e:
+                self._fail(job, e, progress)
+
+    def run(self, directory: Path, category: str = "general", report_interval: float = 10.0) -> IngestProgress:
+        files = sorted(p for p in directory.rglob("*")
+                       if p.is_file() and p.suffix.lower() in SUPPORTED_SUFFIXES)
+        progress = IngestProgress(len(files))
+        print(f"共发现 {len(files)} 个文件")
+
+        stages = [
+            threading.Thread(target=self._parse_stage, args=(files, category, progress), name="parse"),
+            threading.Thread(target=self._embed_stage, args=(progress,), name="embed"),
+            threading.Thread(target=self._store_stage, args=(progress,), name="store"),
+        ]
+        for stage in stages:
+            stage.start()
+
+        # 定期打印进度，直到最后一个阶段结束
+        while stages[-1].is_alive():
+            stages[-1].join(timeout=report_interval)
+            print(progress.report())
+        for stage in stages:
+            stage.join()
+
+        print(f"各阶段累计耗时: {format_timings(progress.timings)}")
+        return progress
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量导入目录中的PDF/DOCX法律文档")
+    parser.add_argument("directory", type=Path, help="待导入的目录（递归查找）")
+    parser.add_argument("--category", default="general", help="文档类别")
+    parser.add_argument("--parse-workers", type=int, default=PDF_PARSE_WORKERS, help="解析进程数")
+    parser.add_argument("--queue-size", type=int, default=8, help="阶段间队列长度")
+    parser.add_argument("--report-interval", type=float, default=10.0, help="进度打印间隔（秒）")
+    args = parser.parse_args()
+
+    document_manager = DocumentManager()
+    rag_service = SimpleRAGService(reset_vector_db=False, document_manager=document_manager)
+    ingester = BulkIngester(rag_service, document_manager,
+                            parse_workers=args.parse_workers, queue_size=args.queue_size)
+    ingester.run(args.directory.resolve(), args.category, args.report_interval)
+
+
+if __name__ == "__main__":
+    main()
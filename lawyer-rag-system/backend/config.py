@@ -0,0 +1,126 @@
+import os
+from pathlib import Path
+
+# 后端运行配置，统一从环境变量读取，未设置时使用默认值
+
+BASE_DIR = Path(__file__).parent
+
+# 上传文件存储目录
+UPLOADS_DIR = Path(os.getenv("UPLOADS_DIR", BASE_DIR / "uploads"))
+
+# Chroma向量数据库目录与集合名
+CHROMA_DIR = Path(os.getenv("CHROMA_DIR", BASE_DIR / "chroma_db"))
+CHROMA_COLLECTION = os.getenv("CHROMA_COLLECTION", "lawyer_documents")
+
+# 启动时清空向量数据库（仅用于测试），默认持久化并在启动时与文档库对账
+CHROMA_RESET = os.getenv("CHROMA_RESET", "0") == "1"
+
+# 后台文档入库的并发工作线程数
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+
+# 多个uvicorn worker之间协调用的文件锁目录：启动对账只由一个worker执行，同一文档的入库不会并行；
+# 文档入库锁按document_id分到固定数量的锁文件上
+LOCK_DIR = Path(os.getenv("LOCK_DIR", BASE_DIR / "db_file/locks"))
+INGEST_LOCK_STRIPES = int(os.getenv("INGEST_LOCK_STRIPES", "64"))
+
+# 分块读取文件（计算内容哈希）时的块大小（字节）
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+
+# 下载文件时每次读取并发送的块大小（字节）
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", str(1024 * 1024)))
+
+# 文档预览：单次请求最多返回的页数；内存中缓存的热门文档页文本上限（MB）
+PREVIEW_MAX_PAGES = int(os.getenv("PREVIEW_MAX_PAGES", "20"))
+PREVIEW_CACHE_MB = int(os.getenv("PREVIEW_CACHE_MB", "64"))
+
+# 单个上传文件的大小上限（MB）
+MAX_UPLOAD_MB = int(os.getenv("MAX_UPLOAD_MB", "500"))
+MAX_UPLOAD_BYTES = MAX_UPLOAD_MB * 1024 * 1024
+
+# 向量化模型
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "BAAI/bge-small-zh-v1.5")
+
+# 向量化后端：huggingface（本地sentence-transformers模型）、hash（确定性的本地替身模型，用于测试）
+# 或 remote（通过Unix socket调用独立的向量化服务进程 embedding_server.py，多个uvicorn worker共用一份模型）
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "huggingface")
+
+# 独立向量化服务：监听的Unix socket、服务进程自身使用的后端、微批的最大文本数和最长等待时间（毫秒）
+EMBEDDING_SOCKET_PATH = os.getenv("EMBEDDING_SOCKET_PATH", "/tmp/lawyer-rag-embedding.sock")
+EMBEDDING_SERVER_BACKEND = os.getenv("EMBEDDING_SERVER_BACKEND", "huggingface")
+EMBEDDING_SERVER_MAX_BATCH = int(os.getenv("EMBEDDING_SERVER_MAX_BATCH", "64"))
+EMBEDDING_SERVER_MAX_WAIT_MS = float(os.getenv("EMBEDDING_SERVER_MAX_WAIT_MS", "5"))
+# API进程启动时等待向量化服务就绪的最长时间（秒）
+EMBEDDING_SERVER_CONNECT_TIMEOUT = float(os.getenv("EMBEDDING_SERVER_CONNECT_TIMEOUT", "60"))
+# 每次向量化请求等待服务响应的最长时间（秒），超时的请求失败而不是一直阻塞
+EMBEDDING_SERVER_TIMEOUT = float(os.getenv("EMBEDDING_SERVER_TIMEOUT", "30"))
+
+# 运行设备：auto 时按 cuda > mps > cpu 自动检测
+EMBEDDING_DEVICE = os.getenv("EMBEDDING_DEVICE", "auto")
+
+# 每批向量化的文本数
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+
+# CPU向量化的进程数，大于1时启用多进程池（每个进程只加载一次模型）
+EMBEDDING_WORKERS = int(os.getenv("EMBEDDING_WORKERS", "1"))
+
+# 分块向量缓存（SQLite持久化，按模型名+文本哈希索引，超出上限按LRU淘汰）
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "1") == "1"
+EMBEDDING_CACHE_PATH = Path(os.getenv("EMBEDDING_CACHE_PATH", BASE_DIR / "db_file/embedding_cache.db"))
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+
+# 大PDF按页段并行解析的进程数（<=1时使用串行PyPDFLoader）
+PDF_PARSE_WORKERS = int(os.getenv("PDF_PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# 每个解析任务负责的页数，页数不超过该值的PDF直接串行解析
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "50"))
+
+# 混合检索：语义检索 + BM25关键词检索，倒数排名融合
+HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "1") == "1"
+
+# 语义检索结果的相关性阈值（问题与块的余弦相似度），低于阈值的块不参与融合；全部低于阈值时仍取最相近的块。
+# bge-small-zh-v1.5上直接相关的块通常在0.55以上，更换模型时需要重新设定
+RETRIEVAL_SCORE_THRESHOLD = float(os.getenv("RETRIEVAL_SCORE_THRESHOLD", "0.5"))
+
+# 倒数排名融合常数
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+# 关键词索引快照文件（与向量库放在一起，CHROMA_RESET时一并清除），启动时就绪后在后台加载
+KEYWORD_INDEX_PATH = Path(os.getenv("KEYWORD_INDEX_PATH", CHROMA_DIR / "keyword_index.bin"))
+
+# 压缩索引时语料变更日志保留的条数；快照落后超过这些变更时在后台从向量库重建关键词索引
+CORPUS_LOG_KEEP = int(os.getenv("CORPUS_LOG_KEEP", "100000"))
+
+# 问答语义缓存：相似度阈值、过期时间（秒）和容量
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "1") == "1"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "2000"))
+
+# 同时进行的llm调用上限（异步问答和流式问答共用），超出的请求排队等待
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+
+# prompt上下文（检索到的依据文本）的token预算
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2000"))
+
+# 重排：none（不重排）、cross-encoder（CPU上的cross-encoder模型）或 overlap（确定性的本地替身模型，用于测试）
+RERANKER_BACKEND = os.getenv("RERANKER_BACKEND", "none")
+RERANKER_MODEL_NAME = os.getenv("RERANKER_MODEL_NAME", "BAAI/bge-reranker-base")
+
+# 送入重排的候选块数（混合检索召回的前N块），重排后保留前k块
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))
+
+# 每批送入cross-encoder的 (问题, 文本块) 对数
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "16"))
+
+# (问题, 文本块) 重排得分的内存缓存容量，超出后按LRU淘汰
+RERANK_CACHE_MAX_ENTRIES = int(os.getenv("RERANK_CACHE_MAX_ENTRIES", "10000"))
+
+# 文档列表每页默认条数和上限
+DOCUMENT_PAGE_SIZE = int(os.getenv("DOCUMENT_PAGE_SIZE", "100"))
+DOCUMENT_PAGE_MAX = int(os.getenv("DOCUMENT_PAGE_MAX", "1000"))
+
+# 文档库SQLite：等待写锁的超时（毫秒）、页缓存和内存映射大小（MB）、异步接口使用的线程（连接）数
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_MB = int(os.getenv("SQLITE_CACHE_MB", "16"))
+SQLITE_MMAP_MB = int(os.getenv("SQLITE_MMAP_MB", "128"))
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "4"))
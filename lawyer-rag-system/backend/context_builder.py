@@ -0,0 +1,123 @@
+import math
+import re
+from typing import Dict, List
+
+from langchain_core.documents import Document
+
+from config import CONTEXT_TOKEN_BUDGET
+
+_CJK = re.compile(r"[一-鿿㐀-䶿　-〿＀-￯]")
+
+# token数估算：DeepSeek文档给出的经验值，1个中文字符约0.6个token，1个英文字符约0.3个token
+CJK_TOKENS_PER_CHAR = 0.6
+OTHER_TOKENS_PER_CHAR = 0.3
+
+# 认定为块间重叠的最短公共文本长度，避免把偶然相同的标点当作重叠
+MIN_OVERLAP_CHARS = 4
+
+# 同一文档中不相邻的片段之间的分隔
+GAP_MARKER = "\n……\n"
+
+
+def estimate_tokens(text: str) -> int:
+    """估算文本的token数"""
+    cjk = len(_CJK.findall(text))
+    return math.ceil(cjk * CJK_TOKENS_PER_CHAR + (len(text) - cjk) * OTHER_TOKENS_PER_CHAR)
+
+
+def overlap_length(previous: str, following: str, max_overlap: int) -> int:
+    """previous的结尾与following的开头重复的字符数（分块时的chunk_overlap）"""
+    for size in range(min(max_overlap, len(previous), len(following)), MIN_OVERLAP_CHARS - 1, -1):
+        if previous.endswith(following[:size]):
+            return size
+    return 0
+
+
+def _position(document: Document):
+    """块在文档中的位置：普通块按chunk_index，条文按条号"""
+    metadata = document.metadata
+    return metadata.get("chunk_index", metadata.get("article", 0))
+
+
+def _is_adjacent(previous: Document, following: Document) -> bool:
+    previous_index = previous.metadata.get("chunk_index")
+    following_index = following.metadata.get("chunk_index")
+    return previous_index is not None and following_index == previous_index + 1
+
+
+class PackedContext:
+    """打包好的上下文：prompt中的依据文本、实际放入的文本块（按检索排名）和估算的token数"""
+
+    def __init__(self, text: str = "", documents: List[Document] = None, tokens: int = 0):
+        self.text = text
+        self.documents = documents or []
+        self.tokens = tokens
+
+
+class ContextBuilder:
+    """按token预算把检索到的文本块打包成prompt上下文
+
+    - 按检索排名依次放入文本块，超出预算的块跳过（排名靠后但更短的块可能还放得下）
+    - 同一文档的块放在一起，文档之间按最相关块的排名排序，文档内按块位置排序
+    - 相邻的块合并成一段，并去掉分块时重叠的文本
+    """
+
+    def __init__(self, token_budget: int = CONTEXT_TOKEN_BUDGET, max_overlap: int = 50):
+        self.token_budget = token_budget
+        self.max_overlap = max_overlap
+
+    def build(self, documents: List[Document]) -> PackedContext:
+        packed = PackedContext()
+        selected: List[Document] = []
+        seen = set()
+        for document in documents:
+            key = (document.metadata.get("document_id"), _position(document))
+            if key in seen:
+                continue
+            candidate = self._pack(selected + [document])
+            if candidate.tokens > self.token_budget:
+                continue
+            seen.add(key)
+            selected.append(document)
+            packed = candidate
+
+        if not selected and documents:
+            # 连最相关的一块都放不下时截断它，保证至少有一块依据
+            packed = self._truncate(documents[0])
+        return packed
+
+    def _pack(self, documents: List[Document]) -> PackedContext:
+        # 按文档分组（dict保持首次出现的顺序，即按最相关块的排名）
+        groups: Dict[str, List[Document]] = {}
+        for document in documents:
+            groups.setdefault(document.metadata.get("document_id"), []).append(document)
+
+        sections = []
+        for group in groups.values():
+            segments: List[str] = []
+            previous = None
+            for document in sorted(group, key=_position):
+                text = document.page_content.strip()
+                if previous is not None and _is_adjacent(previous, document):
+                    overlap = overlap_length(segments[-1], text, self.max_overlap)
+                    segments[-1] += text[overlap:] if overlap else "\n" + text
+                else:
+                    segments.append(text)
+                previous = document
+            filename = group[0].metadata.get("filename", "未知文档")
+            sections.append(f"《{filename}》\n" + GAP_MARKER.join(segments))
+
+        text = "\n\n".join(sections)
+        return PackedContext(text, list(documents), estimate_tokens(text))
+
+    def _truncate(self, document: Document) -> PackedContext:
+        text = document.page_content
+        while text:
+            truncated = Document(page_content=text, metadata=document.metadata)
+            packed = self._pack([truncated])
+            if packed.tokens <= self.token_budget:
+                packed.documents = [document]
+                return packed
+            # 按超出比例缩短，至少缩短一个字符
+            text = text[:min(len(text) - 1, int(len(text) * self.token_budget / packed.tokens))]
+        return PackedContext()
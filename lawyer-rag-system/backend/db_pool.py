@@ -0,0 +1,99 @@
+import sqlite3
+import threading
+import weakref
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List
+
+from config import SQLITE_BUSY_TIMEOUT_MS, SQLITE_CACHE_MB, SQLITE_MMAP_MB
+
+# 每个连接缓存的预编译语句数（相同SQL文本复用同一条prepared statement）
+CACHED_STATEMENTS = 256
+
+
+class _ConnectionHolder:
+    """线程本地保存的连接包装，线程退出时被回收，借助weakref.finalize关闭连接"""
+    __slots__ = ("conn", "__weakref__")
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+
+class SQLitePool:
+    """线程本地的SQLite连接池
+
+    每个线程复用自己的一条连接（sqlite3连接不能跨线程并发使用），
+    连接建立时统一设置WAL日志、busy_timeout等参数；连接在线程存活期间持续存在，
+    sqlite3按SQL文本缓存的预编译语句也随之复用。线程退出时连接随之关闭
+    （线程池会回收空闲线程再新建，连接不会随线程更替累积）。
+    """
+
+    def __init__(self, db_path: Path, busy_timeout_ms: int = SQLITE_BUSY_TIMEOUT_MS):
+        self.db_path = Path(db_path)
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: List[sqlite3.Connection] = []
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout_ms / 1000,
+            cached_statements=CACHED_STATEMENTS,
+            # 连接只在所属线程中使用，关闭时可能在其他线程
+            check_same_thread=False
+        )
+        conn.row_factory = sqlite3.Row
+        # WAL：读写互不阻塞，写入只追加日志；NORMAL同步级别在WAL下不会损坏数据库
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={self.busy_timeout_ms}")
+        conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_MB * 1024}")
+        conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_MB * 1024 * 1024}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    @staticmethod
+    def _release(connections: List[sqlite3.Connection], lock: threading.Lock, conn: sqlite3.Connection):
+        """线程退出（线程本地数据被回收）时关闭该线程的连接"""
+        with lock:
+            if conn in connections:
+                connections.remove(conn)
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def connection(self) -> sqlite3.Connection:
+        """当前线程的连接，首次使用时建立"""
+        holder = getattr(self._local, "holder", None)
+        if holder is None:
+            holder = self._local.holder = _ConnectionHolder(self._open())
+            # 只引用连接列表和锁，不引用连接池本身
+            weakref.finalize(holder, self._release, self._connections, self._lock, holder.conn)
+        return holder.conn
+
+    @contextmanager
+    def connect(self):
+        """与 `with sqlite3.connect(...) as conn` 相同的语义：正常退出时提交，异常时回滚，但不关闭连接"""
+        conn = self.connection()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def close_all(self):
+        """关闭所有线程的连接（服务停止时调用）"""
+        with self._lock:
+            connections = list(self._connections)
+            self._connections.clear()
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
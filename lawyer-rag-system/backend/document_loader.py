@@ -0,0 +1,103 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import List, Tuple, Dict, Any
+
+from langchain_core.documents import Document
+from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader
+
+from config import PDF_PARSE_WORKERS, PDF_PAGES_PER_TASK
+
+# 页段解析进程池，首次需要时创建，所有入库线程共用
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # 服务进程内有多个线程，使用spawn避免fork带来的锁状态问题
+            _pool = ProcessPoolExecutor(
+                max_workers=PDF_PARSE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+
+def _pdf_metadata(reader, file_path: str) -> Dict[str, Any]:
+    """与PyPDFLoader一致的文档级元数据（键名去掉前缀/并转小写，日期转ISO格式）"""
+    metadata = {"producer": "PyPDF", "creator": "PyPDF", "creationdate": ""}
+    for key, value in (reader.metadata or {}).items():
+        if type(value) not in (str, int):
+            value = str(value)
+        key = (key[1:] if key.startswith("/") else key).lower()
+        if key in ("creationdate", "moddate"):
+            try:
+                value = datetime.strptime(value.replace("'", ""), "D:%Y%m%d%H%M%S%z").isoformat("T")
+            except ValueError:
+                pass
+        metadata[key] = value
+    metadata["source"] = file_path
+    metadata["total_pages"] = len(reader.pages)
+    return metadata
+
+
+def _extract_page_range(file_path: str, start: int, end: int) -> List[Tuple[str, Dict[str, Any]]]:
+    """在工作进程中提取[start, end)页的文本，返回(文本, 元数据)列表"""
+    from pypdf import PdfReader
+
+    reader = PdfReader(file_path)
+    base_metadata = _pdf_metadata(reader, file_path)
+    labels = reader.page_labels
+
+    pages = []
+    for page_number in range(start, end):
+        # 与PyPDFLoader一致：去掉页面文本首尾的空白
+        text = reader.pages[page_number].extract_text(extraction_mode="plain").strip()
+        metadata = {
+            **base_metadata,
+            "page": page_number,
+            "page_label": labels[page_number] if page_number < len(labels) else str(page_number + 1)
+        }
+        pages.append((text, metadata))
+    return pages
+
+
+def load_pdf(file_path: str, parallel: bool = True) -> List[Document]:
+    """加载PDF：小文件直接用PyPDFLoader，大文件按页段并行提取后按页码顺序拼回"""
+    from pypdf import PdfReader
+
+    if not parallel or PDF_PARSE_WORKERS <= 1:
+        return PyPDFLoader(file_path).load()
+
+    total_pages = len(PdfReader(file_path).pages)
+    if total_pages <= PDF_PAGES_PER_TASK:
+        return PyPDFLoader(file_path).load()
+
+    ranges = [(start, min(start + PDF_PAGES_PER_TASK, total_pages))
+              for start in range(0, total_pages, PDF_PAGES_PER_TASK)]
+    pool = _get_pool()
+    futures = [pool.submit(_extract_page_range, file_path, start, end) for start, end in ranges]
+
+    # 按提交顺序收集结果，保证页码顺序与串行加载一致
+    documents = []
+    for future in futures:
+        for text, metadata in future.result():
+            documents.append(Document(page_content=text, metadata=metadata))
+    return documents
+
+
+def load_document(file_path: str, parallel: bool = True) -> List[Document]:
+    """根据文件类型加载文档，每页（DOCX为整篇）对应一个Document
+
+    parallel=False 时始终串行解析，供已在工作进程中运行的调用方使用。
+    """
+    file_path = str(file_path)
+    if file_path.endswith('.pdf'):
+        return load_pdf(file_path, parallel)
+    elif file_path.endswith('.docx'):
+        return Docx2txtLoader(file_path).load()
+    else:
+        raise ValueError("不支持的文件格式")
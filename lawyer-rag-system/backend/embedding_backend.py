@@ -0,0 +1,147 @@
+import hashlib
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+from config import (
+    EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND, EMBEDDING_DEVICE,
+    EMBEDDING_BATCH_SIZE, EMBEDDING_WORKERS
+)
+
+
+def detect_device(preferred: str = EMBEDDING_DEVICE) -> str:
+    """检测可用的运行设备，未安装torch或无GPU时回退到cpu"""
+    if preferred != "auto":
+        return preferred
+    try:
+        import torch
+    except ImportError:
+        return "cpu"
+    if torch.cuda.is_available():
+        return "cuda"
+    if getattr(torch.backends, "mps", None) is not None and torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+class HashEmbeddings(Embeddings):
+    """确定性的本地替身模型
+
+    将字符一元组和二元组哈希到固定维度并做L2归一化，不依赖torch和模型文件，
+    相同文本总是得到相同向量，供测试和无模型环境使用。
+    """
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+
+    def _embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.dim
+        grams = list(text) + [text[i:i + 2] for i in range(len(text) - 1)]
+        for gram in grams:
+            digest = hashlib.blake2b(gram.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dim
+            sign = 1.0 if digest[4] & 1 else -1.0
+            vector[bucket] += sign
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+# 每个工作进程内加载一次的模型
+_worker_model = None
+_worker_batch_size = EMBEDDING_BATCH_SIZE
+
+
+def _init_worker(model_name: str, batch_size: int, threads: int):
+    """工作进程初始化：限制torch线程数，避免多进程间CPU超额订阅，并加载模型"""
+    global _worker_model, _worker_batch_size
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    torch.set_num_threads(threads)
+    _worker_model = SentenceTransformer(model_name, device="cpu")
+    _worker_batch_size = batch_size
+
+
+def _embed_in_worker(texts: List[str]) -> List[List[float]]:
+    vectors = _worker_model.encode(texts, batch_size=_worker_batch_size, show_progress_bar=False,
+                                   normalize_embeddings=True)
+    return vectors.tolist()
+
+
+class ProcessPoolEmbeddings(Embeddings):
+    """多进程CPU向量化：把一次embed_documents调用切分到多个进程并行计算，结果保持原顺序"""
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL_NAME,
+                 num_workers: int = EMBEDDING_WORKERS,
+                 batch_size: int = EMBEDDING_BATCH_SIZE):
+        self.num_workers = num_workers
+        self.batch_size = batch_size
+        threads = max(1, (os.cpu_count() or 1) // num_workers)
+        # torch在fork出的子进程中不安全，使用spawn启动
+        self.executor = ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(model_name, batch_size, threads)
+        )
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        # 每个分片至少一个batch，尽量让所有进程都有活干
+        shard_size = max(self.batch_size, math.ceil(len(texts) / self.num_workers))
+        shards = [texts[i:i + shard_size] for i in range(0, len(texts), shard_size)]
+
+        vectors = []
+        for shard_vectors in self.executor.map(_embed_in_worker, shards):
+            vectors.extend(shard_vectors)
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.executor.submit(_embed_in_worker, [text]).result()[0]
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+def build_embeddings(backend: str = EMBEDDING_BACKEND) -> Tuple[Embeddings, str]:
+    """按配置构建向量化后端，返回(模型, 模型标识)，模型标识用作向量缓存键的一部分"""
+    if backend == "hash":
+        model = HashEmbeddings()
+        return model, f"hash-{model.dim}"
+
+    if backend == "remote":
+        from embedding_server import RemoteEmbeddings
+        model = RemoteEmbeddings()
+        # 模型标识以服务端实际加载的模型为准，保证向量缓存键一致
+        info = model.wait_ready()
+        print(f"使用向量化服务 {model.socket_path}（{info['model_id']}）")
+        return model, info["model_id"]
+
+    if backend != "huggingface":
+        raise ValueError(f"不支持的向量化后端: {backend}")
+
+    device = detect_device()
+    print(f"向量化模型 {EMBEDDING_MODEL_NAME} 运行于 {device}，batch_size={EMBEDDING_BATCH_SIZE}")
+
+    if device == "cpu" and EMBEDDING_WORKERS > 1:
+        return ProcessPoolEmbeddings(), EMBEDDING_MODEL_NAME
+
+    from langchain_huggingface import HuggingFaceEmbeddings
+    model = HuggingFaceEmbeddings(
+        model_name=EMBEDDING_MODEL_NAME,
+        model_kwargs={'device': device},
+        # 归一化后向量库的距离可以直接换算成余弦相似度
+        encode_kwargs={'batch_size': EMBEDDING_BATCH_SIZE, 'normalize_embeddings': True}
+    )
+    return model, EMBEDDING_MODEL_NAME
@@ -0,0 +1,170 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from config import EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_ENTRIES
+
+# 单条SQL中IN查询的参数个数上限（SQLite默认限制为999）
+_SQL_BATCH = 500
+
+
+def normalize_text(text: str) -> str:
+    """文本归一化：全角转半角、合并空白，使排版差异不影响缓存命中"""
+    text = unicodedata.normalize("NFKC", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class EmbeddingCache:
+    """磁盘持久化的分块向量缓存
+
+    以 模型名 + 归一化文本的SHA-256 为键，向量以float32字节串存入SQLite，
+    条目数超过上限时按最近访问时间淘汰。
+    """
+
+    def __init__(self, db_path: str = None, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.db_path = Path(db_path) if db_path else EMBEDDING_CACHE_PATH
+        os.makedirs(self.db_path.parent, exist_ok=True)
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB,
+                last_access REAL
+            )
+        ''')
+        self.conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_last_access ON embeddings(last_access)
+        ''')
+        self.conn.commit()
+
+        self._entries = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def make_key(model_name: str, text: str) -> str:
+        """生成缓存键"""
+        payload = f"{model_name}\x00{normalize_text(text)}".encode("utf-8")
+        return hashlib.sha256(payload).hexdigest()
+
+    def get_many(self, keys: List[str]) -> List[Optional[List[float]]]:
+        """批量读取缓存，未命中的位置返回None"""
+        found: Dict[str, List[float]] = {}
+        unique_keys = list(dict.fromkeys(keys))
+        now = time.time()
+
+        with self._lock:
+            for start in range(0, len(unique_keys), _SQL_BATCH):
+                batch = unique_keys[start:start + _SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+
+            # 刷新命中条目的访问时间，供LRU淘汰使用
+            if found:
+                self.conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                self.conn.commit()
+
+            results = [found.get(key) for key in keys]
+            hit_count = sum(1 for vector in results if vector is not None)
+            self.hits += hit_count
+            self.misses += len(keys) - hit_count
+
+        return results
+
+    def put_many(self, items: Dict[str, List[float]]):
+        """批量写入缓存，超过容量时淘汰最久未访问的条目"""
+        if not items:
+            return
+        now = time.time()
+        rows = [(key, array("f", vector).tobytes(), now) for key, vector in items.items()]
+
+        with self._lock:
+            cursor = self.conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_access) VALUES (?, ?, ?)", rows
+            )
+            self._entries += max(cursor.rowcount, 0)
+            if self._entries > self.max_entries:
+                self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        """淘汰到容量的90%，避免每次写入都触发淘汰"""
+        target = int(self.max_entries * 0.9)
+        overflow = self._entries - target
+        cursor = self.conn.execute('''
+            DELETE FROM embeddings WHERE key IN (
+                SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?
+            )
+        ''', (overflow,))
+        self._entries -= max(cursor.rowcount, 0)
+
+    def stats(self) -> Dict:
+        """缓存命中统计"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": self._entries,
+                "max_entries": self.max_entries
+            }
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """为任意Embeddings加上分块向量缓存，只对未命中的文本调用底层模型"""
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache, model_name: str):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model_name = model_name
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self.cache.make_key(self.model_name, text) for text in texts]
+        vectors = self.cache.get_many(keys)
+
+        # 未命中的文本去重后一次性交给底层模型
+        missing: Dict[str, str] = {}
+        for key, text, vector in zip(keys, texts, vectors):
+            if vector is None and key not in missing:
+                missing[key] = text
+
+        if missing:
+            computed = self.embeddings.embed_documents(list(missing.values()))
+            new_items = dict(zip(missing.keys(), computed))
+            self.cache.put_many(new_items)
+            vectors = [vector if vector is not None else new_items[key]
+                       for key, vector in zip(keys, vectors)]
+
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
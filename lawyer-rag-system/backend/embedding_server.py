@@ -0,0 +1,320 @@
+"""独立的向量化服务进程
+
+多个uvicorn worker各自加载模型会让内存随worker数线性增长。本服务只加载一份模型，
+通过Unix socket为所有worker提供向量化，并把同一时间窗口内来自不同worker的请求
+合并成一批（微批）送入模型，批越大吞吐越高。
+
+用法：
+    python embedding_server.py                      # 监听 EMBEDDING_SOCKET_PATH
+    EMBEDDING_BACKEND=remote uvicorn main:app --workers 4
+
+协议：每个帧为4字节大端长度 + 内容。请求内容为JSON：
+    {"op": "embed", "texts": [...]}  → {"count": n, "dim": d}\\n + n*d个float32（小端）
+    {"op": "info"}                   → {"model_id": ..., "batches": ..., "texts": ...}\\n
+出错时返回 {"error": "..."}\\n；格式错误的请求同样返回错误，长度超过MAX_REQUEST_BYTES的帧返回错误后断开连接。
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import struct
+import threading
+import time
+import weakref
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from config import (
+    EMBEDDING_SOCKET_PATH, EMBEDDING_SERVER_BACKEND, EMBEDDING_SERVER_MAX_BATCH,
+    EMBEDDING_SERVER_MAX_WAIT_MS, EMBEDDING_SERVER_CONNECT_TIMEOUT, EMBEDDING_SERVER_TIMEOUT
+)
+
+_LENGTH = struct.Struct(">I")
+
+# 单个请求帧的长度上限（字节），超过时视为格式错误
+MAX_REQUEST_BYTES = 64 * 1024 * 1024
+
+
+def _encode_response(header: Dict[str, Any], body: bytes = b"") -> bytes:
+    return json.dumps(header).encode("utf-8") + b"\n" + body
+
+
+def _decode_response(payload: bytes) -> Tuple[Dict[str, Any], bytes]:
+    header, _, body = payload.partition(b"\n")
+    return json.loads(header), body
+
+
+class EmbeddingServer:
+    """在一个进程中托管向量化模型，按微批合并各连接的请求"""
+
+    def __init__(self, model: Embeddings, model_id: str,
+                 max_batch: int = EMBEDDING_SERVER_MAX_BATCH,
+                 max_wait_ms: float = EMBEDDING_SERVER_MAX_WAIT_MS):
+        self.model = model
+        self.model_id = model_id
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queue: "asyncio.Queue[Tuple[List[str], asyncio.Future]]" = None
+
+        self.batches = 0
+        self.texts = 0
+        self.requests = 0
+
+    async def _next_batch(self) -> List[Tuple[List[str], asyncio.Future]]:
+        """取出第一个请求后最多再等待max_wait，把期间到达的请求合并，直到凑满max_batch个文本"""
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        size = len(batch[0][0])
+        deadline = loop.time() + self.max_wait
+        while size < self.max_batch:
+            try:
+                item = self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            texts = [text for request_texts, _ in batch for text in request_texts]
+            try:
+                # 模型在线程中运行，期间到达的请求在队列中积累，下一批自然更大
+                vectors = await loop.run_in_executor(None, self.model.embed_documents, texts)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.texts += len(texts)
+            offset = 0
+            for request_texts, future in batch:
+                if not future.done():
+                    future.set_result(vectors[offset:offset + len(request_texts)])
+                offset += len(request_texts)
+
+    @staticmethod
+    def _parse_request(payload: bytes) -> Dict[str, Any]:
+        """解析请求内容，格式错误时抛出ValueError"""
+        try:
+            request = json.loads(payload)
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise ValueError(f"请求不是有效的JSON: {e}")
+        if not isinstance(request, dict):
+            raise ValueError("请求必须是JSON对象")
+        texts = request.get("texts")
+        if texts is not None and not (isinstance(texts, list) and all(isinstance(text, str) for text in texts)):
+            raise ValueError("texts必须是字符串列表")
+        return request
+
+    async def _respond(self, request: Dict[str, Any]) -> bytes:
+        op = request.get("op")
+        if op == "info":
+            return _encode_response({
+                "model_id": self.model_id,
+                "requests": self.requests,
+                "batches": self.batches,
+                "texts": self.texts,
+                "mean_batch_size": self.texts / self.batches if self.batches else 0.0
+            })
+        if op != "embed":
+            return _encode_response({"error": f"未知操作: {op}"})
+
+        texts = request.get("texts") or []
+        self.requests += 1
+        if not texts:
+            return _encode_response({"count": 0, "dim": 0})
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((texts, future))
+        try:
+            vectors = np.asarray(await future, dtype=np.float32)
+        except Exception as e:
+            return _encode_response({"error": f"向量化失败: {e}"})
+        return _encode_response({"count": vectors.shape[0], "dim": vectors.shape[1]},
+                                vectors.astype("<f4").tobytes())
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """一个连接上的请求依次处理；不同连接（worker/线程）的请求在队列中合批"""
+        try:
+            while True:
+                try:
+                    length = _LENGTH.unpack(await reader.readexactly(_LENGTH.size))[0]
+                    if length > MAX_REQUEST_BYTES:
+                        # 无法跳过这么长的内容重新对齐帧，返回错误后断开
+                        response = _encode_response({"error": f"请求长度 {length} 超过上限 {MAX_REQUEST_BYTES}"})
+                        writer.write(_LENGTH.pack(len(response)) + response)
+                        await writer.drain()
+                        break
+                    payload = await reader.readexactly(length)
+                except asyncio.IncompleteReadError:
+                    break
+                try:
+                    response = await self._respond(self._parse_request(payload))
+                except ValueError as e:
+                    # 格式错误的请求只影响本次请求，连接继续可用
+                    response = _encode_response({"error": str(e)})
+                writer.write(_LENGTH.pack(len(response)) + response)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, socket_path: str):
+        self.queue = asyncio.Queue()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = await asyncio.start_unix_server(self._handle, path=socket_path)
+        os.chmod(socket_path, 0o660)
+        batcher = asyncio.create_task(self._batch_loop())
+        print(f"向量化服务已启动：{self.model_id}，socket={socket_path}，"
+              f"微批上限 {self.max_batch} 条/{self.max_wait * 1000:g}ms")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+
+
+class _ConnectionHolder:
+    """线程本地保存的连接包装，线程退出时被回收，借助weakref.finalize关闭连接"""
+    __slots__ = ("conn", "__weakref__")
+
+    def __init__(self, conn: socket.socket):
+        self.conn = conn
+
+
+class RemoteEmbeddings(Embeddings):
+    """向量化服务的客户端（EMBEDDING_BACKEND=remote）
+
+    每个线程使用自己的连接，同一worker内的并发请求也能在服务端合批，线程退出时连接随之关闭；
+    服务重启导致连接断开时自动重连一次。等待响应超过timeout秒时放弃本次请求并断开连接
+    （不重试，避免服务卡住时调用方等待两倍时间）。
+    """
+
+    def __init__(self, socket_path: str = EMBEDDING_SOCKET_PATH, timeout: float = EMBEDDING_SERVER_TIMEOUT):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self) -> socket.socket:
+        holder = getattr(self._local, "holder", None)
+        if holder is None:
+            conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            conn.settimeout(self.timeout)
+            try:
+                conn.connect(self.socket_path)
+            except OSError:
+                conn.close()
+                raise
+            holder = self._local.holder = _ConnectionHolder(conn)
+            # 线程退出（线程本地数据被回收）时关闭连接
+            weakref.finalize(holder, conn.close)
+        return holder.conn
+
+    def _disconnect(self):
+        holder = getattr(self._local, "holder", None)
+        if holder is not None:
+            holder.conn.close()
+        self._local.holder = None
+
+    @staticmethod
+    def _recv_exactly(conn: socket.socket, size: int) -> bytes:
+        buffer = bytearray()
+        while len(buffer) < size:
+            chunk = conn.recv(size - len(buffer))
+            if not chunk:
+                raise ConnectionError("向量化服务断开了连接")
+            buffer.extend(chunk)
+        return bytes(buffer)
+
+    def _call(self, request: Dict[str, Any]) -> Tuple[Dict[str, Any], bytes]:
+        payload = json.dumps(request, ensure_ascii=False).encode("utf-8")
+        for attempt in range(2):
+            try:
+                conn = self._connection()
+                conn.sendall(_LENGTH.pack(len(payload)) + payload)
+                length = _LENGTH.unpack(self._recv_exactly(conn, _LENGTH.size))[0]
+                header, body = _decode_response(self._recv_exactly(conn, length))
+                break
+            except socket.timeout:
+                # 响应可能稍后才到，连接上的帧已无法对齐
+                self._disconnect()
+                raise TimeoutError(f"向量化服务在 {self.timeout:g} 秒内没有响应")
+            except OSError:
+                self._disconnect()
+                if attempt:
+                    raise
+        if "error" in header:
+            raise RuntimeError(header["error"])
+        return header, body
+
+    def info(self) -> Dict[str, Any]:
+        return self._call({"op": "info"})[0]
+
+    def wait_ready(self, timeout: float = EMBEDDING_SERVER_CONNECT_TIMEOUT) -> Dict[str, Any]:
+        """等待向量化服务就绪（服务可能与API同时启动），返回服务信息"""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return self.info()
+            except OSError:
+                if time.monotonic() >= deadline:
+                    raise RuntimeError(f"无法连接向量化服务：{self.socket_path}")
+                time.sleep(0.5)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        header, body = self._call({"op": "embed", "texts": list(texts)})
+        return np.frombuffer(body, dtype="<f4").reshape(header["count"], header["dim"]).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def main():
+    from embedding_backend import build_embeddings
+
+    parser = argparse.ArgumentParser(description="律师事务所RAG系统向量化服务")
+    parser.add_argument("--socket", default=EMBEDDING_SOCKET_PATH, help="监听的Unix socket路径")
+    parser.add_argument("--backend", default=EMBEDDING_SERVER_BACKEND, help="huggingface 或 hash")
+    parser.add_argument("--max-batch", type=int, default=EMBEDDING_SERVER_MAX_BATCH, help="每批最多合并的文本数")
+    parser.add_argument("--max-wait-ms", type=float, default=EMBEDDING_SERVER_MAX_WAIT_MS,
+                        help="凑批时最长等待的毫秒数")
+    args = parser.parse_args()
+
+    if args.backend == "remote":
+        parser.error("向量化服务自身不能使用remote后端")
+    model, model_id = build_embeddings(args.backend)
+    server = EmbeddingServer(model, model_id, args.max_batch, args.max_wait_ms)
+
+    async def run():
+        # SIGTERM时正常退出，删除socket文件
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        await server.serve(args.socket)
+
+    try:
+        asyncio.run(run())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""跨进程文件锁（fcntl.flock），用于多个uvicorn worker之间的协调
+
+锁文件放在LOCK_DIR下，进程退出（包括崩溃）时由操作系统自动释放。
+没有fcntl的平台（Windows）上只支持单进程部署，锁总是立即取得。
+"""
+import zlib
+from contextlib import contextmanager
+from typing import IO, Optional
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from config import LOCK_DIR, INGEST_LOCK_STRIPES
+
+
+def _open(name: str) -> IO:
+    LOCK_DIR.mkdir(parents=True, exist_ok=True)
+    return open(LOCK_DIR / f"{name}.lock", "a")
+
+
+def try_acquire(name: str) -> Optional[IO]:
+    """不等待地获取锁，成功时返回持有锁的文件对象（关闭即释放），已被其他进程持有时返回None"""
+    handle = _open(name)
+    if fcntl is None:
+        return handle
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return handle
+    except BlockingIOError:
+        handle.close()
+        return None
+
+
+@contextmanager
+def locked(name: str):
+    """获取锁（等待其他进程释放），退出时释放"""
+    with _open(name) as handle:
+        if fcntl is not None:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        yield
+
+
+def document_lock(document_id: str):
+    """文档入库锁：按document_id的哈希分到INGEST_LOCK_STRIPES个锁文件上，锁文件数量不随文档数增长"""
+    return locked(f"ingest-{zlib.crc32(document_id.encode()) % INGEST_LOCK_STRIPES}")
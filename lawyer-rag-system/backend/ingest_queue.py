@@ -0,0 +1,104 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from datetime import datetime
+from pathlib import Path
+from typing import Dict
+
+from config import INGEST_WORKERS
+from file_lock import document_lock
+from sql_file import DocumentManager
+
+
+class IngestionQueue:
+    """后台文档入库队列
+
+    上传接口只负责保存文件并登记任务，解析、分块、向量化、入库
+    由有界线程池在后台完成，任务状态通过DocumentManager持久化。
+    多个worker部署时，同一文档的处理通过文件锁串行化，取得锁后文档已不是processing状态
+    （已被其他worker处理完、失败或删除）则跳过，不会重复向量化。
+    """
+
+    def __init__(self, rag_service, document_manager: DocumentManager, max_workers: int = INGEST_WORKERS):
+        self.rag_service = rag_service
+        self.document_manager = document_manager
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+
+        # 正在排队或执行中的任务
+        self._futures: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, file_path, document_id: str, filename: str, category: str = "general",
+               content_hash: str = None, file_size: int = None) -> Future:
+        """登记文档为processing状态并提交后台处理"""
+        self.document_manager.save_document(
+            document_id=document_id,
+            filename=filename,
+            category=category,
+            upload_time=datetime.now().isoformat(),
+            status="processing",
+            file_path=str(file_path),
+            content_hash=content_hash,
+            file_size=file_size
+        )
+        return self._enqueue(file_path, document_id, filename, category)
+
+    def _enqueue(self, file_path, document_id: str, filename: str, category: str) -> Future:
+        future = self.executor.submit(self._run, file_path, document_id, filename, category)
+        with self._lock:
+            self._futures[document_id] = future
+        future.add_done_callback(lambda _: self._forget(document_id))
+        return future
+
+    def resubmit(self, document: Dict) -> bool:
+        """重新处理已登记的文档（如启动对账发现向量缺失），源文件不存在时标记为failed
+
+        文档已在本队列中排队或处理中时（如对账期间刚上传的文档），或状态已不是对账时看到的状态时
+        （已被其他worker处理完或删除），不重复提交，返回False。
+        """
+        with self._lock:
+            if document["document_id"] in self._futures:
+                return False
+        file_path = document.get("file_path")
+        if not file_path or not Path(file_path).exists():
+            self.document_manager.update_status(document["document_id"], "failed", error="源文件不存在，无法重建索引")
+            return False
+        # 只在状态仍是对账时看到的状态时提交：期间其他worker可能已处理完或删除了该文档
+        if not self.document_manager.claim_document(document["document_id"], document["status"]):
+            return False
+        self._enqueue(file_path, document["document_id"], document["filename"], document["category"])
+        return True
+
+    def _run(self, file_path, document_id: str, filename: str, category: str):
+        """在工作线程中执行文档处理，失败时记录错误信息"""
+        with document_lock(document_id):
+            document = self.document_manager.get_document(document_id)
+            if document is None or document["status"] != "processing":
+                print(f"跳过文档处理：{filename}（ID: {document_id}）已不是processing状态")
+                return
+            try:
+                self.rag_service.process_document(file_path, document_id, filename, category)
+                # 处理期间关联上来的重复上传记录一并标记完成
+                self.document_manager.update_status(document_id, "completed")
+            except Exception as e:
+                print(f"❌ 后台处理文档失败：{filename}（ID: {document_id}）: {e}")
+                self.document_manager.update_status(document_id, "failed", error=str(e))
+
+    def _forget(self, document_id: str):
+        with self._lock:
+            self._futures.pop(document_id, None)
+
+    def pending_count(self) -> int:
+        """排队或处理中的任务数"""
+        with self._lock:
+            return len(self._futures)
+
+    def shutdown(self, wait: bool = True, cancel_pending: bool = False) -> int:
+        """停止接收新任务，wait时等待执行中的任务结束
+
+        cancel_pending（或不等待）时取消尚未开始的任务：这些文档保持processing状态，
+        下次启动时由对账重新提交。返回取消的任务数。
+        """
+        with self._lock:
+            futures = list(self._futures.values())
+        self.executor.shutdown(wait=wait, cancel_futures=cancel_pending or not wait)
+        return sum(1 for future in futures if future.cancelled())
@@ -0,0 +1,842 @@
+import math
+import os
+import pickle
+import re
+import struct
+import threading
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import jieba
+    jieba.setLogLevel(60)
+except ImportError:  # jieba为可选依赖，未安装时使用字二元组分词
+    jieba = None
+
+# 中文字符连续片段 / 英文数字片段
+_CJK_RUN = re.compile(r"[一-鿿㐀-䶿]+")
+_WORD_RUN = re.compile(r"[0-9a-zA-Z]+(?:[.\-][0-9a-zA-Z]+)*")
+_TOKEN_CHAR = re.compile(r"[\w一-鿿]")
+
+# BM25参数
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# 增量段的倒排条数超过 max(MERGE_MIN_POSTINGS, MERGE_RATIO × 主段倒排条数) 时在后台并入主段
+MERGE_MIN_POSTINGS = 200_000
+MERGE_RATIO = 0.1
+
+# 已删除块超过该比例时在后台合并（去掉已删除块并重新编号）
+COMPACT_RATIO = 0.2
+
+# 过滤范围内的块不超过该比例时只为范围内的块打分，否则正常检索并跳过范围外的块
+SCOPED_SEARCH_RATIO = 0.1
+
+# 按影响分顺序读取倒排表：第一轮每个词读取的条数，之后每轮乘以DEPTH_GROWTH；
+# 可能进入前k名的块不超过 max(CONTENDERS, 4k) 个时停止读取，改为二分查找补齐得分；
+# 按影响分顺序（跳着）读取的条数将超过查询词倒排总长的ORDERED_READ_RATIO时改用MaxScore
+INITIAL_DEPTH = 1024
+DEPTH_GROWTH = 4
+CONTENDERS = 1024
+ORDERED_READ_RATIO = 0.02
+
+# 逐词记录块是否已读到的查询词数上限（位图宽度），词更多的查询直接用MaxScore
+TRACKED_TERMS = 64
+
+# 二分查找一个块的代价约为顺序读取一条倒排的倍数，用于选择补齐得分的方式
+LOOKUP_COST = 8
+
+# 查询用的累加数组按需复用，最多保留的份数（每份每块16字节）
+SCRATCH_BUFFERS = 4
+# 写过的位置超过块数的1/SCRATCH_RESET_RATIO时整体清零，否则只清零写过的位置
+SCRATCH_RESET_RATIO = 8
+
+# 合并时每批排序的倒排条数（限制临时数组占用的内存）
+SORT_BATCH_POSTINGS = 4_000_000
+
+# 快照文件：魔数 + 元数据的偏移和长度，之后是按SNAPSHOT_ALIGN对齐的原始数组，元数据（pickle）在文件末尾
+SNAPSHOT_MAGIC = b"KWINDEX1"
+SNAPSHOT_HEADER = struct.Struct("<QQ")
+SNAPSHOT_ALIGN = 64
+SNAPSHOT_WRITE_BLOCK = 1 << 22
+
+
+def tokenize(text: str) -> List[str]:
+    """中文分词：优先使用jieba搜索引擎模式，否则中文按字二元组、英文数字按整词切分"""
+    text = text.lower()
+    if jieba is not None:
+        return [token for token in jieba.lcut_for_search(text)
+                if token.strip() and _TOKEN_CHAR.search(token)]
+
+    tokens = _WORD_RUN.findall(text)
+    for run in _CJK_RUN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def _impacts(frequencies: np.ndarray, lengths: np.ndarray, average_length: float) -> np.ndarray:
+    """单个词的BM25得分中与idf无关的部分（影响分）：tf·(k1+1) / (tf + k1·(1 - b + b·dl/avgdl))"""
+    frequencies = frequencies.astype(np.float64)
+    return frequencies * (BM25_K1 + 1) / (
+        frequencies + BM25_K1 * (1 - BM25_B + BM25_B * lengths / average_length))
+
+
+def _lookup(ids: np.ndarray, targets: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """在升序的ids中二分查找targets，返回 (命中掩码, 命中的位置)"""
+    if len(ids) == 0:
+        return np.zeros(len(targets), dtype=bool), np.zeros(0, dtype=np.int64)
+    positions = np.searchsorted(ids, targets)
+    np.minimum(positions, len(ids) - 1, out=positions)
+    hit = ids[positions] == targets
+    return hit, positions[hit]
+
+
+def _top_k(ids: np.ndarray, scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """得分最高的k个，按得分降序（同分按编号升序）"""
+    if len(ids) > k:
+        keep = np.argpartition(-scores, k - 1)[:k]
+        ids, scores = ids[keep], scores[keep]
+    order = np.lexsort((ids, -scores))
+    return ids[order], scores[order]
+
+
+class _Column:
+    """可追加的一维numpy数组（容量按倍数扩充）"""
+
+    def __init__(self, dtype, values: np.ndarray = None):
+        values = np.zeros(0, dtype=dtype) if values is None else np.asarray(values, dtype=dtype)
+        self.size = len(values)
+        self.data = np.empty(max(self.size, 1024), dtype=dtype)
+        self.data[:self.size] = values
+
+    def append(self, value):
+        if self.size == len(self.data):
+            data = np.empty(2 * len(self.data), dtype=self.data.dtype)
+            data[:self.size] = self.data[:self.size]
+            self.data = data
+        self.data[self.size] = value
+        self.size += 1
+
+    @property
+    def values(self) -> np.ndarray:
+        return self.data[:self.size]
+
+
+class _Segment:
+    """不可变的主段：CSR布局的倒排表
+
+    第t个词的倒排位于 [offsets[t], offsets[t+1])：ids为升序的块编号（随机访问时二分查找），
+    tfs为对应的词频，order为区间内按影响分降序排列的下标（按影响分从高到低遍历）。
+    数组可以是快照文件的只读内存映射。
+    """
+
+    def __init__(self, terms: List[str], offsets: np.ndarray, ids: np.ndarray,
+                 tfs: np.ndarray, order: np.ndarray):
+        self.terms = terms
+        self.term_index = {term: i for i, term in enumerate(terms)}
+        self.offsets = offsets
+        self.ids = ids
+        self.tfs = tfs
+        self.order = order
+
+    @classmethod
+    def empty(cls) -> "_Segment":
+        return cls([], np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int32),
+                   np.zeros(0, dtype=np.uint16), np.zeros(0, dtype=np.int32))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def span(self, term: str) -> Tuple[int, int]:
+        index = self.term_index.get(term)
+        if index is None:
+            return 0, 0
+        return int(self.offsets[index]), int(self.offsets[index + 1])
+
+
+class _Scratch:
+    """查询用的累加数组：每块一个得分和一个位图；查询结束时只把读到过的位置清零，之后复用"""
+
+    def __init__(self, count: int):
+        self.scores = np.zeros(count)
+        self.seen = np.zeros(count, dtype=np.uint64)
+        # 本次查询写过的块编号（数组列表）
+        self.dirty: List[np.ndarray] = []
+
+    def reset(self):
+        if sum(len(ids) for ids in self.dirty) * SCRATCH_RESET_RATIO > len(self.scores):
+            # 写过的位置很多时整体清零更快
+            self.scores.fill(0)
+            self.seen.fill(0)
+        else:
+            for ids in self.dirty:
+                self.scores[ids] = 0
+                self.seen[ids] = 0
+        self.dirty = []
+
+
+def _build_segment(base: _Segment, new_terms: List[str], postings: Tuple[np.ndarray, np.ndarray, np.ndarray],
+                   deleted: np.ndarray, lengths: np.ndarray) -> Tuple[_Segment, float]:
+    """把主段和新增的倒排合并成新的主段，去掉已删除的块并按原顺序重新编号
+
+    postings为新增倒排的 (词序号, 块编号, 词频) 扁平数组，词序号指向 base.terms + new_terms，
+    同一个词的新增倒排按块编号升序，且编号都大于主段中的编号。
+    按词的区间分批处理（每批约SORT_BATCH_POSTINGS条），临时内存与批大小而不是倒排总数成正比。
+    返回 (新主段, 新的平均块长度)。
+    """
+    live = ~deleted
+    remap = (np.cumsum(live) - 1).astype(np.int32)
+    new_lengths = lengths[live]
+    average_length = float(new_lengths.mean()) if len(new_lengths) else 0.0
+    all_terms = base.terms + new_terms
+
+    # 新增倒排按词排序（稳定排序，同一个词内保持编号升序）
+    term_of, ids, tfs = postings
+    by_term = np.argsort(term_of, kind="stable")
+    term_of, ids, tfs = term_of[by_term], ids[by_term], tfs[by_term]
+    del by_term
+
+    # 每个词在主段和新增倒排中的区间
+    base_offsets = np.concatenate((base.offsets, np.full(len(new_terms), base.offsets[-1], dtype=np.int64)))
+    delta_offsets = np.searchsorted(term_of, np.arange(len(all_terms) + 1))
+    total_offsets = base_offsets + delta_offsets
+    kept = int(live[np.asarray(base.ids)].sum()) + int(live[ids].sum())
+
+    counts = np.zeros(len(all_terms), dtype=np.int64)
+    out_ids = np.empty(kept, dtype=np.int32)
+    out_tfs = np.empty(kept, dtype=np.uint16)
+    out_order = np.empty(kept, dtype=np.int32)
+    cursor, first = 0, 0
+    while first < len(all_terms):
+        last = int(np.searchsorted(total_offsets, total_offsets[first] + SORT_BATCH_POSTINGS, side="right")) - 1
+        last = min(max(last, first + 1), len(all_terms))
+
+        # 本批词的倒排：主段的在前、新增的在后，按词稳定排序后同一个词内编号仍然升序
+        base_last = min(last, len(base.terms))
+        batch_terms, batch_ids, batch_tfs = [], [], []
+        if first < base_last:
+            low, high = base_offsets[first], base_offsets[base_last]
+            batch_terms.append(np.repeat(np.arange(first, base_last, dtype=np.int32),
+                                         np.diff(base_offsets[first:base_last + 1])))
+            batch_ids.append(np.asarray(base.ids[low:high]))
+            batch_tfs.append(np.asarray(base.tfs[low:high]))
+        low, high = delta_offsets[first], delta_offsets[last]
+        batch_terms.append(term_of[low:high])
+        batch_ids.append(ids[low:high])
+        batch_tfs.append(tfs[low:high])
+        batch_terms, batch_ids, batch_tfs = (np.concatenate(batch_terms), np.concatenate(batch_ids),
+                                             np.concatenate(batch_tfs))
+        keep = live[batch_ids]
+        batch_terms, batch_ids, batch_tfs = batch_terms[keep], remap[batch_ids[keep]], batch_tfs[keep]
+        grouped = np.argsort(batch_terms, kind="stable")
+        batch_terms, batch_ids, batch_tfs = batch_terms[grouped], batch_ids[grouped], batch_tfs[grouped]
+        batch_counts = np.bincount(batch_terms - first, minlength=last - first)
+        counts[first:last] = batch_counts
+
+        # 每个词内按影响分降序的访问顺序：影响分在 (0, k1+1) 之间，量化为32位整数后取反序，与词序号拼成排序键
+        impacts = _impacts(batch_tfs, new_lengths[batch_ids], average_length)
+        local_term = (batch_terms - first).astype(np.int64)
+        quantized = ((BM25_K1 + 1 - impacts) * ((1 << 32) - 1) / (BM25_K1 + 1)).astype(np.int64)
+        sorted_positions = np.argsort((local_term << 32) | quantized)
+        term_starts = np.concatenate(([0], np.cumsum(batch_counts)[:-1]))
+
+        end = cursor + len(batch_ids)
+        out_ids[cursor:end] = batch_ids
+        out_tfs[cursor:end] = batch_tfs
+        out_order[cursor:end] = sorted_positions - term_starts[local_term[sorted_positions]]
+        cursor, first = end, last
+
+    # 去掉已没有倒排的词
+    present = counts > 0
+    offsets = np.zeros(int(present.sum()) + 1, dtype=np.int64)
+    np.cumsum(counts[present], out=offsets[1:])
+    terms = [all_terms[i] for i in np.flatnonzero(present).tolist()]
+    return _Segment(terms, offsets, out_ids, out_tfs, out_order), average_length
+
+
+def _flatten_delta(base: _Segment, delta: Dict[str, Tuple[array, array]]) -> Tuple[List[str], tuple]:
+    """把增量段转换为 (主段中没有的新词, (词序号, 块编号, 词频) 扁平数组)"""
+    new_terms = []
+    numbers = np.empty(len(delta), dtype=np.int32)
+    for i, term in enumerate(delta):
+        number = base.term_index.get(term)
+        if number is None:
+            number = len(base.terms) + len(new_terms)
+            new_terms.append(term)
+        numbers[i] = number
+    postings = list(delta.values())
+    ids = np.frombuffer(b"".join([term_ids for term_ids, _ in postings]), dtype=np.int32)
+    tfs = np.frombuffer(b"".join([term_tfs for _, term_tfs in postings]), dtype=np.uint16)
+    term_of = np.repeat(numbers, [len(term_ids) for term_ids, _ in postings])
+    return new_terms, (term_of, ids, tfs)
+
+
+class KeywordIndex:
+    """BM25倒排索引：不可变的主段 + 可追加的增量段
+
+    主段为CSR布局的numpy数组，可从快照文件按需内存映射，启动时不必重新分词。
+    每个词的倒排另存按影响分（单词BM25得分中与idf无关的部分）降序的访问顺序。查询时按影响分从高到低
+    分轮读取各词倒排的前缀，未读取部分可能取得的最高分之和不超过当前第k名的得分时提前结束，
+    常见词的长倒排通常只读很短的前缀；常见词多、提前结束不了时改用MaxScore，只完整读取必要词的倒排。
+
+    新加入的块追加到增量段，查询时对增量段全量打分；增量段足够大或已删除块过多时
+    在后台线程中与主段合并（合并期间查询和写入照常进行）。删除只做标记。
+    BM25的平均块长度在每次合并时确定，两次合并之间保持不变，主段的影响分顺序因此始终有效。
+    seq记录索引已应用到的语料变更序号（见DocumentManager.log_corpus_change），随快照一起保存。
+    """
+
+    def __init__(self, auto_merge: bool = True, snapshot_path: Path = None):
+        self.auto_merge = auto_merge
+        # 设置后每次合并完成时把索引写入该快照文件
+        self.snapshot_path = snapshot_path
+        self.seq = 0
+
+        self._lock = threading.RLock()
+        self._merge_lock = threading.Lock()
+        self._merge_pending = False
+        self._scratch: List[_Scratch] = []
+        self._scratch_lock = threading.Lock()
+
+        self.base = _Segment.empty()
+        self.average_length = 0.0
+        # 增量段：词 → (块编号, 词频)；合并进行中时正在并入主段的增量段保存在frozen中
+        self.delta: Dict[str, Tuple[array, array]] = {}
+        self.frozen: Dict[str, Tuple[array, array]] = {}
+        self.delta_postings = 0
+
+        self.chunk_ids: List[str] = []
+        self.chunk_document = _Column(np.int32)
+        self.doc_lengths = _Column(np.uint32)
+        self.deleted = _Column(bool)
+        self.documents: List[str] = []
+        self.document_ordinals: Dict[str, int] = {}
+        self.by_document: Dict[str, List[int]] = {}
+        self.live = 0
+        self.total_length = 0
+
+    def __len__(self) -> int:
+        return self.live
+
+    def _ordinal(self, document_id: str) -> int:
+        ordinal = self.document_ordinals.get(document_id)
+        if ordinal is None:
+            ordinal = self.document_ordinals[document_id] = len(self.documents)
+            self.documents.append(document_id)
+        return ordinal
+
+    def _insert(self, chunk_id: str, document_id: str, terms: Counter):
+        internal_id = len(self.chunk_ids)
+        self.chunk_ids.append(chunk_id)
+        self.chunk_document.append(self._ordinal(document_id))
+        length = sum(terms.values())
+        self.doc_lengths.append(length)
+        self.deleted.append(False)
+        self.live += 1
+        self.total_length += length
+        self.by_document.setdefault(document_id, []).append(internal_id)
+
+        for term, frequency in terms.items():
+            entry = self.delta.get(term)
+            if entry is None:
+                entry = self.delta[term] = (array("i"), array("H"))
+            entry[0].append(internal_id)
+            entry[1].append(min(frequency, 65535))
+        self.delta_postings += len(terms)
+
+    def _remove(self, document_id: str) -> int:
+        positions = self.by_document.pop(document_id, None)
+        if not positions:
+            return 0
+        positions = np.asarray(positions, dtype=np.int64)
+        self.deleted.data[positions] = True
+        self.live -= len(positions)
+        self.total_length -= int(self.doc_lengths.data[positions].sum())
+        return len(positions)
+
+    def add(self, chunk_id: str, document_id: str, text: str):
+        """加入一个文本块（同一文档重新入库时先remove_document，或直接使用replace_document）"""
+        terms = Counter(tokenize(text))
+        with self._lock:
+            self._insert(chunk_id, document_id, terms)
+            self._maybe_merge()
+
+    def add_many(self, chunks: Iterable[Tuple[str, str, str]]):
+        """批量加入 (chunk_id, document_id, text)"""
+        for chunk_id, document_id, text in chunks:
+            self.add(chunk_id, document_id, text)
+
+    def replace_document(self, document_id: str, chunks: Iterable[Tuple[str, str]]) -> int:
+        """用 (chunk_id, text) 替换一个文档的全部块（分词在加锁之前完成），返回加入的块数"""
+        prepared = [(chunk_id, Counter(tokenize(text))) for chunk_id, text in chunks]
+        with self._lock:
+            self._remove(document_id)
+            for chunk_id, terms in prepared:
+                self._insert(chunk_id, document_id, terms)
+            self._maybe_merge()
+        return len(prepared)
+
+    def remove_document(self, document_id: str) -> int:
+        """删除一个文档的所有块，返回删除的块数"""
+        with self._lock:
+            removed = self._remove(document_id)
+            self._maybe_merge()
+            return removed
+
+    def reassign_document(self, old_document_id: str, new_document_id: str):
+        """把块的归属改到另一个document_id"""
+        with self._lock:
+            positions = self.by_document.pop(old_document_id, None)
+            if not positions:
+                return
+            self.chunk_document.data[np.asarray(positions, dtype=np.int64)] = self._ordinal(new_document_id)
+            self.by_document.setdefault(new_document_id, []).extend(positions)
+
+    def _maybe_merge(self):
+        if not self.auto_merge or self._merge_pending:
+            return
+        dead = len(self.chunk_ids) - self.live
+        if self.delta_postings > max(MERGE_MIN_POSTINGS, MERGE_RATIO * len(self.base)) or \
+                dead > COMPACT_RATIO * max(len(self.chunk_ids), 1):
+            self._merge_pending = True
+            threading.Thread(target=self.merge, name="keyword-merge", daemon=True).start()
+
+    def merge(self):
+        """把增量段并入主段，同时去掉已删除的块并重新编号
+
+        合并在调用线程中进行，只在开始和结束时短暂持有索引锁：合并期间的查询仍使用旧的主段和增量段，
+        期间新加入的块进入新的增量段，期间的删除和归属变更在结束时按新编号保留。
+        """
+        with self._merge_lock:
+            with self._lock:
+                self._merge_pending = False
+                count = len(self.chunk_ids)
+                if not self.delta and self.live == count:
+                    return
+                self.frozen, self.delta = self.delta, {}
+                self.delta_postings = 0
+                base = self.base
+                deleted = self.deleted.values.copy()
+                lengths = self.doc_lengths.values.copy()
+
+            new_terms, postings = _flatten_delta(base, self.frozen)
+            segment, average_length = _build_segment(base, new_terms, postings, deleted, lengths)
+            del postings
+
+            with self._lock:
+                live = ~deleted
+                kept = np.flatnonzero(live)
+                # 合并期间加入的块（编号 ≥ count）整体前移
+                shift = len(kept) - count
+                self.chunk_ids = [self.chunk_ids[i] for i in kept.tolist()] + self.chunk_ids[count:]
+                for name in ("chunk_document", "doc_lengths", "deleted"):
+                    column = getattr(self, name)
+                    values = column.values
+                    setattr(self, name, _Column(values.dtype, np.concatenate((values[:count][live], values[count:]))))
+                if shift:
+                    for ids, _ in self.delta.values():
+                        view = np.frombuffer(ids, dtype=np.int32)
+                        view += shift
+                        del view
+                self.by_document = self._group_by_document()
+                self.base = segment
+                self.average_length = average_length
+                self.frozen = {}
+
+        if self.snapshot_path is not None:
+            self.save(self.snapshot_path)
+
+    @classmethod
+    def build(cls, chunks: Iterable[Tuple[str, str, str]], **kwargs) -> "KeywordIndex":
+        """从 (chunk_id, document_id, text) 一次性建立索引
+
+        倒排直接收集为扁平数组后生成主段，不经过按词分开存放的增量段（启动时从向量库重建用）。
+        """
+        index = cls(**kwargs)
+        term_index: Dict[str, int] = {}
+        term_of, tfs, term_counts = array("i"), array("I"), array("I")
+        for chunk_id, document_id, text in chunks:
+            terms = Counter(tokenize(text))
+            index.chunk_ids.append(chunk_id)
+            index.chunk_document.append(index._ordinal(document_id))
+            index.doc_lengths.append(sum(terms.values()))
+            index.deleted.append(False)
+            term_of.extend([term_index.setdefault(term, len(term_index)) for term in terms])
+            tfs.extend(terms.values())
+            term_counts.append(len(terms))
+
+        count = len(index.chunk_ids)
+        postings = (np.frombuffer(term_of, dtype=np.int32),
+                    np.repeat(np.arange(count, dtype=np.int32), np.frombuffer(term_counts, dtype=np.uint32)),
+                    np.minimum(np.frombuffer(tfs, dtype=np.uint32), 65535).astype(np.uint16))
+        index.base, index.average_length = _build_segment(
+            _Segment.empty(), list(term_index), postings, index.deleted.values, index.doc_lengths.values)
+        index.live = count
+        index.total_length = int(index.doc_lengths.values.sum())
+        index.by_document = index._group_by_document()
+        return index
+
+    def _group_by_document(self) -> Dict[str, List[int]]:
+        """按文档分组未删除的块编号"""
+        ids = np.flatnonzero(~self.deleted.values)
+        if len(ids) == 0:
+            return {}
+        ordinals = self.chunk_document.values[ids]
+        order = np.argsort(ordinals, kind="stable")
+        ids, ordinals = ids[order], ordinals[order]
+        boundaries = np.flatnonzero(np.diff(ordinals)) + 1
+        starts = np.concatenate(([0], boundaries)).tolist()
+        return {self.documents[ordinals[start]]: group.tolist()
+                for start, group in zip(starts, np.split(ids, boundaries))}
+
+    def _average_length(self) -> float:
+        if len(self.base):
+            return self.average_length
+        return self.total_length / self.live if self.live else 1.0
+
+    def search(self, query: str, k: int = 10, document_ids: Iterable[str] = None) -> List[Tuple[str, float]]:
+        """BM25检索，返回按得分降序的 (chunk_id, score)
+
+        指定document_ids时只在这些文档的块中检索：范围较小时直接为范围内的块打分，
+        查询代价与范围大小而不是整个索引成正比；范围较大时正常检索并跳过范围外的块。
+        只在取得索引快照时短暂持有锁，打分期间查询之间、查询与写入之间互不阻塞。
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            if not terms or self.live == 0:
+                return []
+            count = len(self.chunk_ids)
+            lengths = self.doc_lengths.values
+            average_length = self._average_length()
+
+            scope, allowed = None, None
+            if document_ids is not None:
+                positions = [self.by_document[document_id] for document_id in set(document_ids)
+                             if document_id in self.by_document]
+                scope_size = sum(len(group) for group in positions)
+                if scope_size == 0:
+                    return []
+                if scope_size <= SCOPED_SEARCH_RATIO * self.live:
+                    scope = np.sort(np.concatenate([np.asarray(group, dtype=np.int32) for group in positions]))
+                else:
+                    allowed = np.zeros(len(self.documents), dtype=bool)
+                    allowed[[self.document_ordinals[document_id] for document_id in set(document_ids)
+                             if document_id in self.by_document]] = True
+
+            # (idf, 主段区间起点, 终点, 增量段中的倒排)；文档频率包含尚未合并掉的已删除块，与块总数一致
+            entries = []
+            for term in terms:
+                start, end = self.base.span(term)
+                delta = [(np.frombuffer(segment[term][0], dtype=np.int32).copy(),
+                          np.frombuffer(segment[term][1], dtype=np.uint16).copy())
+                         for segment in (self.frozen, self.delta) if term in segment]
+                df = end - start + sum(len(ids) for ids, _ in delta)
+                if df:
+                    entries.append((math.log(1 + (count - df + 0.5) / (df + 0.5)), start, end, delta))
+            if not entries:
+                return []
+
+            # 快照：主段不可变，合并时整体替换；块列表和各列只在末尾追加（或在合并时整体替换），
+            # 编号小于count的部分在查询期间保持有效
+            base, chunk_ids = self.base, self.chunk_ids
+            deleted, chunk_document = self.deleted.values, self.chunk_document.values
+
+        if scope is not None:
+            scores = self._score(base, entries, scope, lengths, average_length)
+            matched = scores > 0
+            top_ids, top_scores = _top_k(scope[matched], scores[matched], k)
+        else:
+            def accept(ids: np.ndarray) -> np.ndarray:
+                # 跳过已删除和过滤范围外的块
+                mask = ~deleted[ids]
+                if allowed is not None:
+                    mask &= allowed[chunk_document[ids]]
+                return mask
+
+            top_ids, top_scores = self._search_delta(entries, k, accept, lengths, average_length)
+            top_ids, top_scores = self._search_base(base, count, entries, k, accept, lengths, average_length,
+                                                    top_ids, top_scores)
+        return [(chunk_ids[internal_id], score)
+                for internal_id, score in zip(top_ids.tolist(), top_scores.tolist())]
+
+    def _score(self, base: _Segment, entries: list, candidates: np.ndarray, lengths: np.ndarray,
+               average_length: float) -> np.ndarray:
+        """通过二分查找各词的倒排，为候选块（升序的编号）精确计算BM25得分"""
+        scores = np.zeros(len(candidates))
+        candidate_lengths = lengths[candidates]
+        for idf, start, end, delta in entries:
+            for ids, tfs in [(base.ids[start:end], base.tfs[start:end])] + delta:
+                hit, positions = _lookup(ids, candidates)
+                if len(positions):
+                    scores[hit] += idf * _impacts(tfs[positions], candidate_lengths[hit], average_length)
+        return scores
+
+    def _search_delta(self, entries: list, k: int, accept, lengths: np.ndarray,
+                      average_length: float) -> Tuple[np.ndarray, np.ndarray]:
+        """对增量段全量打分（一个块的倒排全部在同一段中，段内累加即为精确得分）"""
+        ids, scores = [], []
+        for idf, _, _, delta in entries:
+            for term_ids, tfs in delta:
+                ids.append(term_ids)
+                scores.append(idf * _impacts(tfs, lengths[term_ids], average_length))
+        if not ids:
+            return np.zeros(0, dtype=np.int32), np.zeros(0)
+        unique, inverse = np.unique(np.concatenate(ids), return_inverse=True)
+        totals = np.bincount(inverse, weights=np.concatenate(scores))
+        mask = accept(unique)
+        return _top_k(unique[mask], totals[mask], k)
+
+    def _acquire_scratch(self, count: int) -> _Scratch:
+        with self._scratch_lock:
+            while self._scratch:
+                scratch = self._scratch.pop()
+                if len(scratch.scores) >= count:
+                    return scratch
+        # 块数增长后按倍数扩充，避免每次新增块都重新分配
+        return _Scratch(max(count, 2 * len(self.chunk_ids)))
+
+    def _release_scratch(self, scratch: _Scratch):
+        scratch.reset()
+        with self._scratch_lock:
+            if len(self._scratch) < SCRATCH_BUFFERS:
+                self._scratch.append(scratch)
+
+    def _search_base(self, base: _Segment, count: int, entries: list, k: int, accept, lengths: np.ndarray,
+                     average_length: float, top_ids: np.ndarray,
+                     top_scores: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """在主段上检索前k名并与增量段的结果合并：先按影响分顺序读取各词倒排的前部并尝试提前结束，
+        读取量超过预算时改用MaxScore
+
+        每轮读取各词倒排按影响分排列的 [done, depth) 部分累加到得分数组，并记下每个块已从哪些词读到。
+        块的真实得分不低于已累加的部分，也不超过已累加的部分加上未读到的词第depth条影响分之和，
+        从未读到的块得分不超过各词第depth条影响分之和。后者不超过当前第k名的已累加得分时，
+        只有上界达到该得分的块还可能进入前k名，对它们二分查找补齐未读到的词后取前k名。
+        得分数组复用，候选块只从本次读到的块中收集，查询代价与读取的倒排条数而不是块总数成正比。
+        """
+        spans = [(idf, start, end - start) for idf, start, end, _ in entries if end > start]
+        if not spans:
+            return top_ids, top_scores
+        total = sum(df for _, _, df in spans)
+        threshold = -np.partition(-top_scores, k - 1)[k - 1] if len(top_scores) >= k else 0.0
+
+        scratch = self._acquire_scratch(count)
+        try:
+            # seen的第j位表示已从第j个词的倒排中读到该块；词太多时不逐词记录，直接用MaxScore
+            scores, seen = scratch.scores, scratch.seen
+            candidates = np.zeros(0, dtype=np.int32)
+            done, depth = 0, INITIAL_DEPTH
+            while len(spans) <= TRACKED_TERMS:
+                bounds = np.zeros(len(spans))
+                fresh = [candidates[:0]]
+                for j, (idf, start, df) in enumerate(spans):
+                    if done < df:
+                        positions = start + base.order[start + done:start + min(depth, df)]
+                        ids = base.ids[positions]
+                        flags = seen[ids]
+                        fresh.append(ids[flags == 0])
+                        scores[ids] += idf * _impacts(base.tfs[positions], lengths[ids], average_length)
+                        seen[ids] = flags | np.uint64(1 << j)
+                    if depth < df:
+                        position = start + int(base.order[start + depth])
+                        bounds[j] = idf * _impacts(base.tfs[position:position + 1],
+                                                   lengths[base.ids[position:position + 1]], average_length)[0]
+                remaining = float(bounds.sum())
+
+                # 本轮新读到的块加入候选
+                fresh = np.concatenate(fresh)
+                scratch.dirty.append(fresh)
+                candidates = np.concatenate((candidates, fresh[accept(fresh)]))
+                lower = scores[candidates]
+                known = np.concatenate((lower, top_scores))
+                threshold = -np.partition(-known, k - 1)[k - 1] if len(known) >= k else 0.0
+
+                # 影响分量化排序可能有极小的误差，比较时留出余量
+                if remaining * (1 + 1e-6) <= threshold:
+                    flags = seen[candidates]
+                    upper = lower.copy()
+                    for j, bound in enumerate(bounds):
+                        if bound:
+                            upper += bound * ((flags & np.uint64(1 << j)) == 0)
+                    contenders = np.flatnonzero(upper * (1 + 1e-6) >= threshold)
+                    if len(contenders) <= max(CONTENDERS, 4 * k):
+                        return self._complete(base, spans, bounds, candidates[contenders], lower[contenders],
+                                              flags[contenders], k, lengths, average_length, top_ids, top_scores)
+                done, depth = depth, depth * DEPTH_GROWTH
+                if sum(min(depth, df) for _, _, df in spans) > ORDERED_READ_RATIO * total:
+                    break
+            scratch.reset()
+            return self._max_score(base, spans, k, accept, lengths, average_length, threshold, scratch,
+                                   top_ids, top_scores)
+        finally:
+            self._release_scratch(scratch)
+
+    def _complete(self, base: _Segment, spans: list, bounds: np.ndarray, candidates: np.ndarray,
+                  lower: np.ndarray, flags: np.ndarray, k: int, lengths: np.ndarray, average_length: float,
+                  top_ids: np.ndarray, top_scores: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """二分查找补齐候选块在未读完的词中的得分，取前k名"""
+        exact = lower.copy()
+        for j, (idf, start, df) in enumerate(spans):
+            if not bounds[j]:
+                continue
+            missing = np.flatnonzero((flags & np.uint64(1 << j)) == 0)
+            hit, positions = _lookup(base.ids[start:start + df], candidates[missing])
+            if len(positions):
+                targets = missing[hit]
+                exact[targets] += idf * _impacts(base.tfs[start:start + df][positions],
+                                                 lengths[candidates[targets]], average_length)
+        return _top_k(np.concatenate((top_ids, candidates)), np.concatenate((top_scores, exact)), k)
+
+    def _max_score(self, base: _Segment, spans: list, k: int, accept, lengths: np.ndarray,
+                   average_length: float, threshold: float, scratch: _Scratch, top_ids: np.ndarray,
+                   top_scores: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """MaxScore：按单词最高得分从低到高，最高得分之和低于threshold（已知的第k名得分下界）的词为非必要词
+
+        只含非必要词的块不可能进入前k名，因此只需完整读取必要词的倒排得到候选块；
+        再按最高得分从高到低补齐非必要词的得分，每补一个词就剔除上界已低于第k名的候选块。
+        """
+        maxima = []
+        for idf, start, df in spans:
+            position = start + int(base.order[start])
+            maxima.append(idf * _impacts(base.tfs[position:position + 1],
+                                         lengths[base.ids[position:position + 1]], average_length)[0])
+        ranked = sorted(range(len(spans)), key=lambda j: maxima[j])
+        optional, rest = 0, 0.0
+        while optional < len(ranked) and (rest + maxima[ranked[optional]]) * (1 + 1e-6) < threshold:
+            rest += maxima[ranked[optional]]
+            optional += 1
+
+        # 得分仍为0的块是第一次读到
+        scores = scratch.scores
+        candidates = [np.zeros(0, dtype=np.int32)]
+        for j in ranked[optional:]:
+            idf, start, df = spans[j]
+            ids = base.ids[start:start + df]
+            previous = scores[ids]
+            candidates.append(ids[previous == 0])
+            scores[ids] = previous + idf * _impacts(base.tfs[start:start + df], lengths[ids], average_length)
+        candidates = np.concatenate(candidates)
+        scratch.dirty.append(candidates)
+        candidates = candidates[accept(candidates)]
+
+        for j in reversed(ranked[:optional]):
+            lower = scores[candidates]
+            known = np.concatenate((lower, top_scores))
+            if len(known) >= k:
+                threshold = max(threshold, -np.partition(-known, k - 1)[k - 1])
+            candidates = candidates[(lower + rest) * (1 + 1e-6) >= threshold]
+            idf, start, df = spans[j]
+            if len(candidates) * LOOKUP_COST >= df:
+                # 候选块较多时顺序读取整个倒排比逐个二分查找快
+                ids = base.ids[start:start + df]
+                scores[ids] += idf * _impacts(base.tfs[start:start + df], lengths[ids], average_length)
+                scratch.dirty.append(ids)
+            else:
+                hit, positions = _lookup(base.ids[start:start + df], candidates)
+                targets = candidates[hit]
+                scores[targets] += idf * _impacts(base.tfs[start:start + df][positions], lengths[targets],
+                                                  average_length)
+            rest -= maxima[j]
+        return _top_k(np.concatenate((top_ids, candidates)), np.concatenate((top_scores, scores[candidates])), k)
+
+    def save(self, path: Path):
+        """写入快照文件：先写临时文件再原子替换；主段数组原样写出，加载时按需内存映射"""
+        with self._lock:
+            base = self.base
+            delta = {}
+            for segment in (self.frozen, self.delta):
+                for term, (ids, tfs) in segment.items():
+                    saved_ids, saved_tfs = delta.get(term, (b"", b""))
+                    delta[term] = (saved_ids + ids.tobytes(), saved_tfs + tfs.tobytes())
+            meta = {
+                "seq": self.seq,
+                "average_length": self.average_length,
+                "terms": base.terms,
+                "chunk_ids": list(self.chunk_ids),
+                "documents": list(self.documents),
+                "delta": delta,
+            }
+            arrays = {
+                "offsets": base.offsets, "ids": base.ids, "tfs": base.tfs, "order": base.order,
+                "chunk_document": self.chunk_document.values.copy(),
+                "doc_lengths": self.doc_lengths.values.copy(),
+                "deleted": self.deleted.values.copy(),
+            }
+
+        path = Path(path)
+        # 临时文件名带上进程和线程，同时写同一快照（多个worker、后台合并与关闭时的保存）时互不干扰
+        temp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        layout = {}
+        with open(temp_path, "wb") as f:
+            f.write(b"\0" * SNAPSHOT_ALIGN)
+            for name, values in arrays.items():
+                offset = -f.tell() % SNAPSHOT_ALIGN + f.tell()
+                f.write(b"\0" * (offset - f.tell()))
+                for start in range(0, len(values), SNAPSHOT_WRITE_BLOCK):
+                    f.write(np.ascontiguousarray(values[start:start + SNAPSHOT_WRITE_BLOCK]).tobytes())
+                layout[name] = (values.dtype.str, len(values), offset)
+            meta["arrays"] = layout
+            meta_offset = f.tell()
+            pickle.dump(meta, f, protocol=pickle.HIGHEST_PROTOCOL)
+            meta_length = f.tell() - meta_offset
+            f.seek(0)
+            f.write(SNAPSHOT_MAGIC + SNAPSHOT_HEADER.pack(meta_offset, meta_length))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: Path, **kwargs) -> "KeywordIndex":
+        """从快照文件加载：主段数组以只读方式内存映射，只有查询实际访问到的部分才会读入内存"""
+        with open(path, "rb") as f:
+            header = f.read(len(SNAPSHOT_MAGIC) + SNAPSHOT_HEADER.size)
+            if header[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+                raise ValueError(f"{path} 不是关键词索引快照文件")
+            meta_offset, meta_length = SNAPSHOT_HEADER.unpack(header[len(SNAPSHOT_MAGIC):])
+            f.seek(meta_offset)
+            meta = pickle.loads(f.read(meta_length))
+
+        arrays = {}
+        for name, (dtype, length, offset) in meta["arrays"].items():
+            if length:
+                # 以普通ndarray视图使用，避免memmap子类在每次切片时的额外开销
+                arrays[name] = np.memmap(path, dtype=np.dtype(dtype), mode="r", offset=offset,
+                                         shape=(length,)).view(np.ndarray)
+            else:
+                arrays[name] = np.zeros(0, dtype=np.dtype(dtype))
+
+        index = cls(**kwargs)
+        index.seq = meta["seq"]
+        index.base = _Segment(meta["terms"], arrays["offsets"], arrays["ids"], arrays["tfs"], arrays["order"])
+        index.average_length = meta["average_length"]
+        for term, (ids, tfs) in meta["delta"].items():
+            entry = index.delta[term] = (array("i"), array("H"))
+            entry[0].frombytes(ids)
+            entry[1].frombytes(tfs)
+            index.delta_postings += len(entry[0])
+
+        index.chunk_ids = meta["chunk_ids"]
+        index.documents = meta["documents"]
+        index.document_ordinals = {document_id: i for i, document_id in enumerate(index.documents)}
+        index.chunk_document = _Column(np.int32, arrays["chunk_document"])
+        index.doc_lengths = _Column(np.uint32, arrays["doc_lengths"])
+        index.deleted = _Column(bool, arrays["deleted"])
+        live = ~index.deleted.values
+        index.live = int(live.sum())
+        index.total_length = int(index.doc_lengths.values[live].sum())
+        index.by_document = index._group_by_document()
+        return index
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """倒数排名融合：score = Σ 1 / (k + rank)"""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,178 @@
+import re
+from bisect import bisect_right
+from typing import Dict, List, Optional, Tuple, Any
+
+from langchain_core.documents import Document
+
+_NUMERAL = r"[零〇一二两三四五六七八九十百千\d]+"
+
+# 行首的 编/章/节/条 标题
+_HEADING = re.compile(rf"^[ \t　]*第[ \t　]*({_NUMERAL})[ \t　]*(编|章|节|条)", re.MULTILINE)
+
+# 问题中的条文引用，如“第一章第八条”“第一百零八条”
+_REFERENCE = re.compile(rf"(?:第\s*({_NUMERAL})\s*章\s*)?第\s*({_NUMERAL})\s*条")
+
+# 只询问条文内容的问题，可以直接用原文作答
+_BARE_LOOKUP = re.compile(
+    rf"^\s*(?:《[^》]+》|[一-鿿]{{0,12}}?)\s*(?:第\s*{_NUMERAL}\s*章\s*)?第\s*{_NUMERAL}\s*条\s*"
+    r"(?:是什么|是啥|的内容|内容|讲的是什么|规定了什么|怎么规定的?|说了什么)?\s*[？?。.!！]?\s*$"
+)
+
+_DIGITS = {"零": 0, "〇": 0, "一": 1, "二": 2, "两": 2, "三": 3, "四": 4,
+           "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+_UNITS = {"十": 10, "百": 100, "千": 1000}
+
+_LEVELS = {"编": "part", "章": "chapter", "节": "section", "条": "article"}
+
+
+def parse_chinese_number(text: str) -> Optional[int]:
+    """解析中文或阿拉伯数字，如 “一百零八” → 108，无法解析时返回None"""
+    if text.isdigit():
+        return int(text)
+    total, current = 0, 0
+    for char in text:
+        if char in _DIGITS:
+            current = _DIGITS[char]
+        elif char in _UNITS:
+            total += (current or 1) * _UNITS[char]
+            current = 0
+        else:
+            return None
+    return total + current
+
+
+def find_article_reference(query: str) -> Optional[Tuple[Optional[int], int]]:
+    """识别问题中的条文引用，返回 (章号或None, 条号)"""
+    match = _REFERENCE.search(query)
+    if match is None:
+        return None
+    article = parse_chinese_number(match.group(2))
+    if article is None:
+        return None
+    chapter = parse_chinese_number(match.group(1)) if match.group(1) else None
+    return chapter, article
+
+
+def is_bare_article_lookup(query: str) -> bool:
+    """问题是否只是查询某条的原文（如“第一章第八条是什么？”）"""
+    return _BARE_LOOKUP.match(query) is not None
+
+
+def locate_pieces(text: str, pieces: List[str]) -> List[int]:
+    """分割器输出的各块在原文中的起始位置
+
+    块按原文顺序输出，相邻块可能重叠，因此从上一块的起点之后继续查找。
+    """
+    positions, cursor = [], 0
+    for piece in pieces:
+        position = text.find(piece, cursor)
+        if position < 0:
+            position = cursor
+        positions.append(position)
+        cursor = position + 1
+    return positions
+
+
+class LegalTextSplitter:
+    """按 编/章/节/条 结构分块的法律文本分割器
+
+    每一条作为一个块，超过chunk_size的条再按款（段落）用fallback分割器细分；
+    第一条之前的内容（标题、序言等）和没有条文结构的文档直接使用fallback分割器。
+    同时返回完整的条文列表，用于建立 (文档, 章, 条) → 原文 的直接查找索引。
+
+    每个块的元数据中记录start_index：块在其起始页文本中的字符偏移。
+    """
+
+    def __init__(self, fallback_splitter, chunk_size: int = 500):
+        self.fallback_splitter = fallback_splitter
+        self.chunk_size = chunk_size
+
+    def split_documents(self, documents: List[Document]) -> Tuple[List[Document], List[Dict[str, Any]]]:
+        """返回 (文本块列表, 条文列表)"""
+        if not documents:
+            return [], []
+
+        # 拼接所有页面，记录每页起始偏移以便找回页面元数据
+        page_starts, parts, offset = [], [], 0
+        for document in documents:
+            page_starts.append(offset)
+            parts.append(document.page_content)
+            offset += len(document.page_content) + 1
+        full_text = "\n".join(parts)
+
+        headings = list(_HEADING.finditer(full_text))
+        if not any(match.group(2) == "条" for match in headings):
+            return self._split_pages(documents), []
+
+        def metadata_at(position: int) -> Dict[str, Any]:
+            page = bisect_right(page_starts, position) - 1
+            metadata = dict(documents[page].metadata)
+            metadata["start_index"] = position - page_starts[page]
+            return metadata
+
+        chunks: List[Document] = []
+        articles: List[Dict[str, Any]] = []
+        structure: Dict[str, Optional[int]] = {"part": None, "chapter": None, "section": None}
+
+        # 第一条之前的内容
+        first_article = next(match for match in headings if match.group(2) == "条")
+        raw_preamble = full_text[:first_article.start()]
+        preamble = raw_preamble.strip()
+        if preamble:
+            preamble_start = len(raw_preamble) - len(raw_preamble.lstrip())
+            pieces = self.fallback_splitter.split_text(preamble)
+            for piece, position in zip(pieces, locate_pieces(preamble, pieces)):
+                chunks.append(Document(page_content=piece, metadata=metadata_at(preamble_start + position)))
+
+        for index, match in enumerate(headings):
+            level = _LEVELS[match.group(2)]
+            number = parse_chinese_number(match.group(1))
+            if level != "article":
+                structure[level] = number
+                # 上级结构变化时清空下级结构
+                if level == "part":
+                    structure["chapter"] = structure["section"] = None
+                elif level == "chapter":
+                    structure["section"] = None
+                continue
+
+            end = headings[index + 1].start() if index + 1 < len(headings) else len(full_text)
+            raw_text = full_text[match.start():end]
+            text = raw_text.strip()
+            if not text or number is None:
+                continue
+
+            text_start = match.start() + len(raw_text) - len(raw_text.lstrip())
+            article_fields = {key: value for key, value in structure.items() if value is not None}
+            article_fields["article"] = number
+            metadata = {**metadata_at(text_start), **article_fields}
+
+            articles.append({
+                "part": structure["part"],
+                "chapter": structure["chapter"],
+                "section": structure["section"],
+                "article": number,
+                "page": metadata.get("page"),
+                "text": text
+            })
+
+            if len(text) <= self.chunk_size:
+                chunks.append(Document(page_content=text, metadata=metadata))
+            else:
+                # 超长的条按款细分
+                pieces = self.fallback_splitter.split_text(text)
+                for piece, position in zip(pieces, locate_pieces(text, pieces)):
+                    chunks.append(Document(page_content=piece,
+                                           metadata={**metadata_at(text_start + position), **article_fields}))
+
+        return chunks, articles
+
+    def _split_pages(self, documents: List[Document]) -> List[Document]:
+        """没有条文结构的文档：逐页用fallback分割器分块"""
+        chunks = []
+        for document in documents:
+            pieces = self.fallback_splitter.split_text(document.page_content)
+            for piece, position in zip(pieces, locate_pieces(document.page_content, pieces)):
+                chunks.append(Document(page_content=piece,
+                                       metadata={**document.metadata, "start_index": position}))
+        return chunks
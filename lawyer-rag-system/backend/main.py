@@ -1,21 +1,53 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
+from fastapi import FastAPI, HTTPException, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, Response, FileResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import ClientDisconnect
+import asyncio
+import base64
+import json
 import os
-import shutil
 import uuid
+from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import Optional
 
-from models import QueryRequest, QueryResponse, UploadResponse, DocumentInfo
-from rag_service import SimpleRAGService
-from sql_file import DocumentManager
+from models import (
+    QueryRequest, QueryResponse, UploadResponse, DocumentInfo, DocumentStatus, DedupStats, DocumentPreview
+)
+from sql_file import DocumentManager, AsyncDocumentManager
+from services import ServiceRegistry
+from query_filters import QueryFilters
+from upload_stream import MultipartUpload
+from metrics import QUERY_SECONDS, ERRORS, CONTENT_TYPE as METRICS_CONTENT_TYPE, render as render_metrics
+from config import (
+    UPLOADS_DIR, MAX_UPLOAD_BYTES, MAX_UPLOAD_MB, DOCUMENT_PAGE_SIZE, DOCUMENT_PAGE_MAX,
+    DOWNLOAD_CHUNK_SIZE, PREVIEW_MAX_PAGES
+)
 
 # os.environ['HTTP_PROXY'] = 'http://127.0.0.1:7890'
 # os.environ['HTTPS_PROXY'] = 'http://127.0.0.1:7890'
 
 # http://localhost:8000/docs
 
-app = FastAPI(title="律师事务所RAG系统", version="1.0.0")
+# 检查客户端是否已断开连接的间隔（秒）
+DISCONNECT_POLL_INTERVAL = 0.5
+
+# 客户端在回答生成完之前断开连接时记录的状态码（沿用nginx的约定）
+CLIENT_CLOSED_REQUEST = 499
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 后台加载模型并与向量库对账，不阻塞服务启动
+    services.start()
+    yield
+    services.shutdown()
+    documents_db.shutdown()
+    get_all_documents.close()
+
+
+app = FastAPI(title="律师事务所RAG系统", version="1.0.0", lifespan=lifespan)
 
 # 添加CORS中间件
 app.add_middleware(
@@ -24,109 +56,456 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # 文档列表的分页信息放在响应头中
+    expose_headers=["X-Next-Cursor", "X-Total-Count", "Content-Disposition", "Content-Range", "Accept-Ranges", "ETag"],
 )
 
-# 初始化RAG服务
-rag_service = SimpleRAGService()
-
-# 初始化文档管理器
+# 初始化文档管理器（全局共用一个实例）
 get_all_documents = DocumentManager()
 
+# 文档管理器的异步接口，接口处理函数中使用，不阻塞事件循环
+documents_db = AsyncDocumentManager(get_all_documents)
+
+# RAG服务和后台入库队列在启动后由后台线程加载
+services = ServiceRegistry(get_all_documents)
+
+
+def get_rag_service():
+    """获取RAG服务，模型尚未加载完成时返回503"""
+    if not services.ready.is_set():
+        raise HTTPException(status_code=503, detail="服务正在启动，模型尚未加载完成")
+    return services.rag_service
+
+
+def get_ingest_queue():
+    """获取后台入库队列，模型尚未加载完成时返回503"""
+    get_rag_service()
+    return services.ingest_queue
+
+
+class UploadSizeLimitMiddleware:
+    """限制上传请求体的大小
+
+    声明了Content-Length的请求在读取请求体之前直接拒绝；没有Content-Length（分块传输）的请求
+    在receive中累计已读取的字节数，超过MAX_UPLOAD_BYTES时立即返回413，之后的receive对应用表现为
+    客户端断开，应用自己的响应被丢弃，剩余的请求体不再读取。
+    使用纯ASGI中间件而不是@app.middleware("http")：后者会包装receive，
+    导致问答接口无法检测到客户端断开。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    @staticmethod
+    async def _reject(scope, receive, send):
+        response = JSONResponse(status_code=413, content={"detail": f"文件大小超过限制（{MAX_UPLOAD_MB}MB）"})
+        await response(scope, receive, send)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != "/api/upload":
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length", b"").decode()
+        if content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES:
+            await self._reject(scope, receive, send)
+            return
+
+        received = 0
+        rejected = False
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received, rejected
+            if rejected:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > MAX_UPLOAD_BYTES:
+                    rejected = True
+                    if not response_started:
+                        await self._reject(scope, receive, send)
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            nonlocal response_started
+            if rejected:
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        await self.app(scope, limited_receive, guarded_send)
+
+
+app.add_middleware(UploadSizeLimitMiddleware)
+
+# 上传接口直接读取请求流（见upload_stream），请求体格式在这里声明给OpenAPI文档
+UPLOAD_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {
+                        "file": {"type": "string", "format": "binary"},
+                        "category": {"type": "string", "default": "general"}
+                    }
+                }
+            }
+        }
+    }
+}
+
+
+def sse_event(event: str, data) -> str:
+    """按Server-Sent Events格式编码一条事件"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def cancel_on_disconnect(request: Request, task: asyncio.Task):
+    """轮询客户端连接，断开时取消task（连同上游llm请求），不再为没人读的回答付费"""
+    while not task.done():
+        if await request.is_disconnected():
+            print(f"客户端已断开，取消查询：{request.url.path}")
+            task.cancel()
+            return
+        await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+
+
+def encode_cursor(key: tuple) -> str:
+    """把分页键 (upload_time, document_id) 编码成不透明的游标"""
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """解析游标，格式无效时返回400"""
+    try:
+        upload_time, document_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        if not isinstance(upload_time, str) or not isinstance(document_id, str):
+            raise ValueError
+        return upload_time, document_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="无效的分页游标")
+
+
+def parse_filters(filters) -> QueryFilters:
+    """解析问答过滤条件，条件无效时返回400"""
+    try:
+        return QueryFilters.parse(filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 
 @app.get("/", tags=["首页"], summary="首页", description="这是律师事务所RAG系统API的首页")
 async def root():
     return {"message": "律师事务所RAG系统API"}
 
+@app.get("/healthz", tags=["健康检查"], summary="存活检查")
+async def healthz():
+    return {"status": "ok"}
+
+@app.get("/readyz", tags=["健康检查"], summary="就绪检查（模型已加载）")
+async def readyz():
+    status = services.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
 @app.post("/api/login", tags=["用户管理"], summary="用户登录")
 async def login(): 
     pass
 
-@app.post("/api/upload", tags=["文档上传"], response_model=UploadResponse)
-async def upload_document(
-    file: UploadFile = File(...),
-    category: str = Form("general")
-    ):
-    """上传文档"""
+@app.post("/api/upload", tags=["文档上传"], response_model=UploadResponse, openapi_extra=UPLOAD_REQUEST_BODY)
+async def upload_document(request: Request):
+    """上传文档（multipart/form-data：file、category）
+
+    文件数据边接收边写入上传目录并计算SHA-256，不经过临时文件。
+    """
     try:
-        # 验证文件类型
-        if not file.filename.endswith(('.pdf', '.docx')):
-            raise HTTPException(status_code=400, detail="只支持PDF和DOCX文件")
-        
+        ingest_queue = get_ingest_queue()
+
         document_id = str(uuid.uuid4())
+        UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
 
-        suffix = Path(file.filename).suffix
-        saved_name = f"{document_id}{suffix}"
-
-        uploads_dir = Path(__file__).parent / "uploads"
-        uploads_dir.mkdir(parents=True, exist_ok=True)
-        
-        file_path = Path(uploads_dir) / saved_name
-        file_path.parent.mkdir(parents=True, exist_ok=True)
-        
-        # print("Saved file exists? ", file_path, file_path.exists())
+        def target(filename: str) -> Path:
+            # 验证文件类型（文件数据到达之前）
+            if not filename.endswith(('.pdf', '.docx')):
+                raise HTTPException(status_code=400, detail="只支持PDF和DOCX文件")
+            return UPLOADS_DIR / f"{document_id}{Path(filename).suffix}"
 
         try:
-            with open(file_path, 'wb') as f:
-                content = await file.read()
-                f.write(content)
-            print(f"文件保存成功: {file_path.exists()}")
+            upload = await MultipartUpload(request.headers.get("content-type", ""), "file", target) \
+                .parse(request.stream())
+        except (HTTPException, ClientDisconnect):
+            raise
         except Exception as e:
             print(f"保存文件时出错: {e}")
             raise HTTPException(status_code=500, detail=f"Failed to save file: {str(e)}")
+        file = upload.file
+        file_path, file_size, content_hash = file.file_path, file.size, file.content_hash
+        category = upload.fields.get("category") or "general"
+        print(f"文件保存成功: {file_path}（{file_size} 字节, sha256={content_hash}）")
+
+        # 内容相同的文档已入库时，直接关联已有向量，不再重复向量化
+        canonical = await documents_db.find_by_content_hash(content_hash)
+        if canonical is not None:
+            file_path.unlink(missing_ok=True)
+            await documents_db.link_duplicate(document_id, file.filename, category, canonical, file_size)
+            # 同一内容被再次上传，之前引用它的缓存回答失效（同时记入语料变更日志，通知其他worker）
+            await asyncio.to_thread(get_rag_service().invalidate_answers, [canonical['document_id']])
+            return UploadResponse(
+                filename=file.filename,
+                document_id=document_id,
+                message=f"文档内容与已有文档重复，已关联到 {canonical['document_id']}",
+                status=canonical['status']
+            )
 
-        # 处理文档
-        rag_service.process_document(file_path, document_id, file.filename, category)
+        # 提交后台处理，接口立即返回（登记文档状态是同步的SQLite写入，放到线程中执行）
+        await asyncio.to_thread(ingest_queue.submit, file_path, document_id, file.filename, category,
+                                content_hash, file_size)
         
         return UploadResponse(
             filename=file.filename,
             document_id=document_id,
-            message="文档上传成功",
-            status="completed"
+            message="文档上传成功，正在后台处理",
+            status="processing"
         )
         
+    except HTTPException:
+        raise
+    except ClientDisconnect:
+        # 客户端中途断开，或请求体超限已由UploadSizeLimitMiddleware返回413
+        return Response(status_code=CLIENT_CLOSED_REQUEST)
     except Exception as e:
+        ERRORS.inc(stage="upload")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/query", response_model=QueryResponse, tags=["文档对话"])
-async def query_documents(request: QueryRequest):
+async def query_documents(request: QueryRequest, http_request: Request):
     """文档对话"""
+    rag_service = get_rag_service()
+    filters = parse_filters(request.filters)
+    task = asyncio.create_task(rag_service.aquery_documents(request.query, filters=filters))
+    watcher = asyncio.create_task(cancel_on_disconnect(http_request, task))
     try:
-        result = rag_service.query_documents(request.query)
+        with QUERY_SECONDS.time(endpoint="query"):
+            result = await task
         print("Query result: ", result)
         return QueryResponse(**result)
-        
+
+    except asyncio.CancelledError:
+        if task.cancelled() and watcher.done():
+            return Response(status_code=CLIENT_CLOSED_REQUEST)
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        watcher.cancel()
+        task.cancel()
+
+
+@app.post("/api/query/stream", tags=["文档对话"])
+async def stream_query_documents(request: QueryRequest, http_request: Request):
+    """流式文档对话（SSE）：检索完成后立即返回sources事件，随后逐段返回token事件，最后返回done事件"""
+    rag_service = get_rag_service()
+    filters = parse_filters(request.filters)
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def produce():
+        try:
+            with QUERY_SECONDS.time(endpoint="stream"):
+                async for event, data in rag_service.stream_query(request.query, filters=filters):
+                    if event == "token":
+                        data = {"text": data}
+                    queue.put_nowait(sse_event(event, data))
+        except Exception as e:
+            ERRORS.inc(stage="query")
+            queue.put_nowait(sse_event("error", {"detail": f"查询失败: {str(e)}"}))
+        finally:
+            queue.put_nowait(None)
+
+    async def events():
+        # 生成在单独的task中进行，客户端断开时取消该task，上游llm流随之关闭
+        producer = asyncio.create_task(produce())
+        watcher = asyncio.create_task(cancel_on_disconnect(http_request, producer))
+        try:
+            while (item := await queue.get()) is not None:
+                yield item
+        finally:
+            watcher.cancel()
+            producer.cancel()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # 禁止代理缓冲，保证每个token及时送达
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 @app.get("/api/documents", response_model=list[DocumentInfo], tags=["获取所有文档"])
-async def get_documents():
-    """获取所有文档"""
+async def get_documents(
+    response: Response,
+    limit: int = Query(DOCUMENT_PAGE_SIZE, ge=1, le=DOCUMENT_PAGE_MAX, description="每页条数"),
+    cursor: Optional[str] = Query(None, description="上一页响应头X-Next-Cursor中的游标"),
+    category: Optional[str] = None,
+    status: Optional[str] = None,
+    include_total: bool = Query(False, description="是否在X-Total-Count响应头中返回总数")
+    ):
+    """分页获取文档（按上传时间降序），还有下一页时在X-Next-Cursor响应头中返回游标"""
+    after = decode_cursor(cursor) if cursor else None
     try:
-        documents = get_all_documents.get_all_documents()
+        documents, next_key = await documents_db.list_documents(limit, after, category, status)
+        if next_key is not None:
+            response.headers["X-Next-Cursor"] = encode_cursor(next_key)
+        if include_total:
+            total = await documents_db.count_documents(category, status)
+            response.headers["X-Total-Count"] = str(total)
         return [DocumentInfo(**doc) for doc in documents]
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-@app.get("/api/documents/{document_id}/download", tags=["文档下载"])
-async def download_document(document_id: str):
-    pass
 
-@app.get("/api/documents/{document_id}/preview", tags=["文档预览"])
-async def preview_document(document_id: str):
-    pass
+@app.get("/api/documents/{document_id}/status", response_model=DocumentStatus, tags=["文档上传"])
+async def get_document_status(document_id: str):
+    """查询文档处理状态"""
+    document = await documents_db.get_document(document_id)
+    if document is None:
+        raise HTTPException(status_code=404, detail="文档不存在")
+    return DocumentStatus(**document)
+
+@app.get("/metrics", tags=["监控"])
+async def get_metrics():
+    """Prometheus文本格式的指标：入库和问答各阶段耗时直方图、文本块/token/错误计数"""
+    return Response(content=render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
+@app.get("/api/stats/dedup", response_model=DedupStats, tags=["获取所有文档"])
+async def get_dedup_stats():
+    """内容去重统计：重复上传数、节省的向量数和存储字节数"""
+    return DedupStats(**await documents_db.get_dedup_stats())
+
+@app.get("/api/stats/embedding-cache", tags=["获取所有文档"])
+async def get_embedding_cache_stats():
+    """向量缓存命中统计"""
+    return get_rag_service().embedding_cache_stats()
+
+@app.get("/api/stats/semantic-cache", tags=["文档对话"])
+async def get_semantic_cache_stats():
+    """问答语义缓存命中统计"""
+    return get_rag_service().answer_cache_stats()
+
+@app.get("/api/stats/rerank", tags=["文档对话"])
+async def get_rerank_stats():
+    """重排统计：调用次数、得分缓存命中率和耗时p50/p95"""
+    return get_rag_service().rerank_stats()
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match是否匹配（弱比较：忽略W/前缀，支持逗号分隔的多个值和*）"""
+    candidates = [value.strip() for value in if_none_match.split(",")]
+    return "*" in candidates or etag in (value[2:] if value.startswith("W/") else value for value in candidates)
+
+@app.api_route("/api/documents/{document_id}/download", methods=["GET", "HEAD"], tags=["文档下载"])
+async def download_document(document_id: str, request: Request, inline: bool = False):
+    """下载原始文件
+
+    文件按块流式发送，不整体读入内存；支持Range分段下载（206）、If-Range，
+    ETag取文件内容哈希，If-None-Match匹配时返回304。inline=true时在浏览器中直接打开。
+    """
+    document = await documents_db.get_document(document_id)
+    if document is None:
+        raise HTTPException(status_code=404, detail="文档不存在")
+    file_path = document.get("file_path")
+    try:
+        stat_result = await run_in_threadpool(os.stat, file_path) if file_path else None
+    except OSError:
+        stat_result = None
+    if stat_result is None:
+        raise HTTPException(status_code=404, detail="文档文件不存在")
+
+    headers = {"Cache-Control": "private, no-cache"}
+    if document.get("content_hash"):
+        # 同一文档的内容不会改变，内容哈希即强ETag（重复上传共享文件，ETag也相同）
+        headers["ETag"] = f'"{document["content_hash"]}"'
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and etag_matches(if_none_match, headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+
+    response = FileResponse(
+        file_path,
+        headers=headers,
+        filename=document.get("filename") or Path(file_path).name,
+        stat_result=stat_result,
+        content_disposition_type="inline" if inline else "attachment"
+    )
+    response.chunk_size = DOWNLOAD_CHUNK_SIZE
+    return response
+
+@app.get("/api/documents/{document_id}/preview", response_model=DocumentPreview, tags=["文档预览"])
+async def preview_document(
+    document_id: str,
+    start: int = Query(0, ge=0, description="起始页序号（从0开始）"),
+    limit: int = Query(PREVIEW_MAX_PAGES, ge=1, le=PREVIEW_MAX_PAGES, description="返回的页数")
+):
+    """按页预览文档文本（入库时保存的页面文本，不重新解析文件）"""
+    document = await documents_db.get_document(document_id)
+    if document is None:
+        raise HTTPException(status_code=404, detail="文档不存在")
+    if document["status"] == "processing":
+        raise HTTPException(status_code=409, detail="文档正在处理中，请稍后再预览")
+    if document["status"] != "completed":
+        raise HTTPException(status_code=409, detail=f"文档处理失败，无法预览：{document.get('error') or ''}")
+
+    preview_store = get_rag_service().preview_store
+    # 重复上传的页面文本保存在原始文档下
+    owner_id = document.get("canonical_id") or document_id
+    page_count, pages = await run_in_threadpool(preview_store.get_pages, owner_id, start, limit)
+    if page_count == 0 and document.get("file_path") and os.path.exists(document["file_path"]):
+        # 本功能上线前入库的文档：解析一次文件并补存页面文本
+        await run_in_threadpool(preview_store.rebuild, owner_id, document["file_path"])
+        page_count, pages = await run_in_threadpool(preview_store.get_pages, owner_id, start, limit)
+
+    return DocumentPreview(
+        document_id=document_id,
+        filename=document["filename"],
+        page_count=page_count,
+        start=start,
+        pages=pages
+    )
+
+@app.get("/api/stats/preview-cache", tags=["文档预览"])
+async def get_preview_cache_stats():
+    """预览页面缓存命中统计"""
+    return get_rag_service().preview_store.stats()
 
 
 @app.delete("/api/documents/{document_id}", tags=["文档删除"])
 async def delete_document(document_id: str):
-    """删除文档"""
+    """删除文档（同时删除向量和上传文件）"""
+    rag_service = get_rag_service()
     try:
-        success = get_all_documents.delete_document(document_id)
-        if success:
-            return {"message": "文档删除成功"}
+        report = await run_in_threadpool(rag_service.delete_document, document_id)
+        if report is not None:
+            return {"message": "文档删除成功", **report}
         else:
             raise HTTPException(status_code=404, detail="文档不存在")
             
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/admin/compact", tags=["文档删除"], summary="压缩索引")
+async def compact_index():
+    """清理孤立向量和无主文件，VACUUM数据库，返回压缩前后大小"""
+    rag_service = get_rag_service()
+    try:
+        return await run_in_threadpool(rag_service.compact_index)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
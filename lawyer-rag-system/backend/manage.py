@@ -0,0 +1,40 @@
+"""后端维护命令（必须在API服务停止时运行，避免多个进程同时打开向量库）
+
+用法:
+    python manage.py compact     # 清理孤立向量和无主文件，合并关键词索引，VACUUM数据库，报告前后大小
+"""
+import argparse
+import json
+import sys
+
+import file_lock
+from rag_service import SimpleRAGService
+from sql_file import DocumentManager
+
+
+def compact():
+    # API服务运行期间持有对账锁（LOCK_DIR），此时清理可能删掉服务刚写入、尚未登记的上传文件
+    lock = file_lock.try_acquire("reconcile")
+    if lock is None:
+        sys.exit("API服务正在运行（对账锁已被占用），请先停止服务再运行compact，或使用 POST /api/admin/compact")
+    try:
+        rag_service = SimpleRAGService(reset_vector_db=False, document_manager=DocumentManager())
+        # 加载关键词索引，压缩时才能合并掉已删除的块并写入快照
+        rag_service.load_keyword_index()
+        report = rag_service.compact_index()
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    finally:
+        lock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="律师事务所RAG系统维护命令")
+    parser.add_argument("command", choices=["compact"], help="要执行的命令")
+    args = parser.parse_args()
+
+    if args.command == "compact":
+        compact()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""Prometheus文本格式的进程内指标
+
+不依赖prometheus_client：计数器和直方图各用一把锁保护，记录一次只是一次二分查找和几次加法。
+/metrics 接口调用render()输出 text/plain; version=0.0.4 格式。
+多个uvicorn worker部署时每个worker有各自的指标，由Prometheus按实例分别抓取。
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 耗时直方图的默认分桶（秒）：覆盖毫秒级的SQLite调用到分钟级的大文档入库
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+_REGISTRY: List["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"指标 {self.name} 的标签应为 {self.labelnames}，实际为 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        help_text = self.documentation.replace("\\", "\\\\").replace("\n", "\\n")
+        lines = [f"# HELP {self.name} {help_text}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> Iterable[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    """分桶直方图（输出累计桶、_sum和_count）"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 标签值 → [各桶计数（非累计，最后一个为+Inf）, 总和, 次数]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """记录代码块耗时（秒）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self) -> Iterable[str]:
+        with self._lock:
+            values = sorted((key, ([*entry[0]], entry[1], entry[2])) for key, entry in self._values.items())
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip([*self.buckets, float("inf")], counts):
+                cumulative += bucket_count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {count}"
+
+
+def render() -> str:
+    """所有已注册指标的Prometheus文本格式"""
+    return "\n".join(metric.render() for metric in _REGISTRY) + "\n"
+
+
+# 文档入库
+INGEST_STAGE_SECONDS = Histogram(
+    "rag_ingest_stage_seconds", "文档入库各阶段耗时：load（解析）、split、embed、store（写入向量库）、sqlite", ["stage"])
+INGEST_DOCUMENTS = Counter("rag_ingest_documents_total", "入库的文档数", ["status"])
+INGEST_CHUNKS = Counter("rag_ingest_chunks_total", "入库的文本块数")
+
+# 问答
+QUERY_STAGE_SECONDS = Histogram(
+    "rag_query_stage_seconds",
+    "问答各阶段耗时：embed、vector_search、keyword_search、rerank、retrieve、prompt_build、"
+    "llm_wait（等待并发名额）、llm_ttft（首token）、llm（生成总耗时）",
+    ["stage"])
+QUERY_SECONDS = Histogram("rag_query_seconds", "问答接口端到端耗时", ["endpoint"])
+QUERIES = Counter("rag_queries_total", "问答次数，按回答来源区分：article（条文原文）、cached、llm、empty（没有可检索的文档）", ["source"])
+PROMPT_TOKENS = Counter("rag_prompt_tokens_total", "发送给大模型的prompt token数（估算）")
+COMPLETION_TOKENS = Counter("rag_completion_tokens_total", "大模型生成的token数（估算）")
+
+# SQLite和错误
+SQLITE_SECONDS = Histogram("rag_sqlite_call_seconds", "API中文档库调用的耗时", ["method"])
+ERRORS = Counter("rag_errors_total", "出错次数", ["stage"])
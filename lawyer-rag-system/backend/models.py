@@ -11,14 +11,42 @@ class DocumentInfo(BaseModel):
 
 class QueryRequest(BaseModel):
     query: str = "买卖合同中，违约责任如何认定？"
+    # 检索过滤条件：category、document_id（字符串或列表）、upload_time_from/upload_time_to、year
     filters: Optional[Dict[str, Any]] = None
 
 class QueryResponse(BaseModel):
     answer: str
     sources: List[Dict[str, Any]]
+    cached: bool = False  # 是否命中语义缓存
+    prompt_tokens: int = 0  # 估算的prompt token数（未调用llm时为0）
 
 class UploadResponse(BaseModel):
     filename: str
     document_id: str
     message: str
-    status: str
\ No newline at end of file
+    status: str
+
+class DocumentStatus(BaseModel):
+    document_id: str
+    filename: str
+    status: str  # "processing", "completed", "failed"
+    error: Optional[str] = None
+    canonical_id: Optional[str] = None  # 重复上传时指向原始文档
+    chunk_count: Optional[int] = None
+    timings: Optional[Dict[str, float]] = None  # 入库各阶段耗时（秒）
+
+class DedupStats(BaseModel):
+    duplicate_documents: int
+    embeddings_saved: int
+    bytes_saved: int
+
+class PreviewPage(BaseModel):
+    page: int  # 页序号，从0开始
+    text: str
+
+class DocumentPreview(BaseModel):
+    document_id: str
+    filename: str
+    page_count: int
+    start: int
+    pages: List[PreviewPage]
@@ -0,0 +1,112 @@
+import sys
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+
+from langchain_core.documents import Document
+
+from sql_file import DocumentManager
+from document_loader import load_document
+from config import PREVIEW_CACHE_MB
+
+# 页面文本的zlib压缩级别（中文法律文本约压缩到原来的40%）
+COMPRESSION_LEVEL = 6
+
+
+def compress_pages(documents: List[Document]) -> List[Tuple[int, bytes]]:
+    """加载得到的页面 → (页序号, 压缩后的文本)，页序号从0开始，与文本块元数据中的page一致"""
+    return [(page, zlib.compress(document.page_content.encode("utf-8"), COMPRESSION_LEVEL))
+            for page, document in enumerate(documents)]
+
+
+class PreviewStore:
+    """文档预览的页面文本存储
+
+    入库时把解析出的每页文本压缩后写入SQLite的pages表，预览按页范围读取，
+    不再重新解析PDF；热门文档的页面文本缓存在内存中，超出PREVIEW_CACHE_MB时按LRU淘汰整篇文档。
+    缓存大小按页面字符串实际占用的内存（sys.getsizeof，中文每字2~4字节）计算，而不是字符数。
+    """
+
+    def __init__(self, document_manager: DocumentManager, cache_mb: int = PREVIEW_CACHE_MB):
+        self.document_manager = document_manager
+        self.max_bytes = cache_mb * 1024 * 1024
+
+        self._lock = threading.Lock()
+        # document_id → {"page_count": 页数, "pages": {页序号: 文本}}，按最近使用排序（最旧的在前）
+        self._documents: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    def save(self, document_id: str, documents: List[Document]) -> bool:
+        """保存文档的全部页面文本"""
+        saved = self.document_manager.save_pages(document_id, compress_pages(documents))
+        self.invalidate(document_id)
+        return saved
+
+    def rebuild(self, document_id: str, file_path: str) -> bool:
+        """为没有页面文本的旧文档重新解析一次文件并保存"""
+        return self.save(document_id, load_document(file_path))
+
+    def invalidate(self, document_id: str):
+        with self._lock:
+            entry = self._documents.pop(document_id, None)
+            if entry is not None:
+                self._bytes -= sum(sys.getsizeof(text) for text in entry["pages"].values())
+
+    def page_count(self, document_id: str) -> int:
+        with self._lock:
+            entry = self._documents.get(document_id)
+            if entry is not None:
+                return entry["page_count"]
+        return self.document_manager.count_pages(document_id)
+
+    def get_pages(self, document_id: str, start: int, count: int) -> Tuple[int, List[Dict[str, Any]]]:
+        """返回 (总页数, [start, start+count) 范围内的页面)，缺失的页一次范围查询读取"""
+        page_count = self.page_count(document_id)
+        end = min(start + count, page_count)
+        if start >= end:
+            return page_count, []
+
+        with self._lock:
+            entry = self._documents.get(document_id)
+            cached = dict(entry["pages"]) if entry is not None else {}
+            if entry is not None:
+                self._documents.move_to_end(document_id)
+        missing = [page for page in range(start, end) if page not in cached]
+        self.hits += (end - start) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            loaded = {page: zlib.decompress(text).decode("utf-8")
+                      for page, text in self.document_manager.get_pages(document_id, missing[0], missing[-1] + 1)}
+            cached.update(loaded)
+            self._remember(document_id, page_count, loaded)
+
+        return page_count, [{"page": page, "text": cached[page]} for page in range(start, end) if page in cached]
+
+    def _remember(self, document_id: str, page_count: int, pages: Dict[int, str]):
+        with self._lock:
+            entry = self._documents.setdefault(document_id, {"page_count": page_count, "pages": {}})
+            self._documents.move_to_end(document_id)
+            for page, text in pages.items():
+                if page not in entry["pages"]:
+                    entry["pages"][page] = text
+                    self._bytes += sys.getsizeof(text)
+            # 淘汰最久未使用的文档，刚读取的文档即使单独超出上限也保留
+            while self._bytes > self.max_bytes and len(self._documents) > 1:
+                _, evicted = self._documents.popitem(last=False)
+                self._bytes -= sum(sys.getsizeof(text) for text in evicted["pages"].values())
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "cached_documents": len(self._documents),
+            "cached_bytes": self._bytes,
+            "max_bytes": self.max_bytes
+        }
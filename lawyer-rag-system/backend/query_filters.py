@@ -0,0 +1,145 @@
+import re
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+# 只精确到年或月的时间，如 "2024"、"2024-06"
+_PARTIAL_DATE = re.compile(r"^(\d{4})(?:-(\d{1,2}))?$")
+
+
+def _as_list(value: Any, name: str) -> List[str]:
+    """字符串或字符串列表 → 去重排序后的列表"""
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, (list, tuple)) or not value or not all(isinstance(item, str) for item in value):
+        raise ValueError(f"过滤条件 {name} 必须是字符串或非空字符串列表")
+    return sorted(set(value))
+
+
+def _next_period(start: datetime, precision: str) -> datetime:
+    if precision == "year":
+        return start.replace(year=start.year + 1)
+    if precision == "month":
+        return start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+    return datetime.fromordinal(start.toordinal() + 1)
+
+
+def _parse_time(value: Any, name: str, end: bool = False) -> datetime:
+    """解析时间过滤条件，支持年份（2024）、年月（"2024-06"）、日期和ISO时间
+
+    end=True时，只精确到年/月/日的值取该区间的结束时刻（不含），
+    如 upload_time_to="2024" 表示截至2024年底。
+    """
+    text = str(value).strip()
+    match = _PARTIAL_DATE.match(text)
+    try:
+        if match:
+            precision = "month" if match.group(2) else "year"
+            parsed = datetime(int(match.group(1)), int(match.group(2) or 1), 1)
+        else:
+            parsed = datetime.fromisoformat(text)
+            precision = "day" if len(text) <= 10 else "time"
+    except ValueError:
+        raise ValueError(f"过滤条件 {name} 不是有效的时间：{value}")
+
+    # 上传时间按本地时间存储，带时区的值先换算成本地时间
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    if end and precision != "time":
+        parsed = _next_period(parsed, precision)
+    return parsed
+
+
+class QueryFilters:
+    """问答检索的过滤条件：类别、文档ID、上传时间范围
+
+    同一组条件分别下推到Chroma的where子句（chroma_where）、
+    SQLite查询（sql_conditions）和关键词检索。
+    """
+
+    KEYS = {"category", "document_id", "upload_time_from", "upload_time_to", "year"}
+
+    def __init__(self, categories: List[str] = None, document_ids: List[str] = None,
+                 upload_from: datetime = None, upload_to: datetime = None):
+        self.categories = categories
+        self.document_ids = document_ids
+        self.upload_from = upload_from  # 含
+        self.upload_to = upload_to  # 不含
+
+    @classmethod
+    def parse(cls, filters: Optional[Dict[str, Any]]) -> Optional["QueryFilters"]:
+        """解析QueryRequest.filters，没有过滤条件时返回None，条件无效时抛出ValueError
+
+        {"category": "contract", "year": 2024}
+        {"document_id": ["id1", "id2"], "upload_time_from": "2024-03", "upload_time_to": "2024-06-30"}
+        """
+        if not filters:
+            return None
+        unknown = set(filters) - cls.KEYS
+        if unknown:
+            raise ValueError(f"不支持的过滤条件：{', '.join(sorted(unknown))}")
+
+        result = cls()
+        if filters.get("category") is not None:
+            result.categories = _as_list(filters["category"], "category")
+        if filters.get("document_id") is not None:
+            result.document_ids = _as_list(filters["document_id"], "document_id")
+        if filters.get("year") is not None:
+            result.upload_from = _parse_time(filters["year"], "year")
+            result.upload_to = _parse_time(filters["year"], "year", end=True)
+        if filters.get("upload_time_from") is not None:
+            result.upload_from = _parse_time(filters["upload_time_from"], "upload_time_from")
+        if filters.get("upload_time_to") is not None:
+            result.upload_to = _parse_time(filters["upload_time_to"], "upload_time_to", end=True)
+
+        if result.upload_from and result.upload_to and result.upload_from >= result.upload_to:
+            raise ValueError("过滤条件的上传时间范围为空")
+        return None if result.is_empty() else result
+
+    def is_empty(self) -> bool:
+        return not (self.categories or self.document_ids or self.upload_from or self.upload_to)
+
+    def with_document_ids(self, document_ids: List[str]) -> "QueryFilters":
+        """替换文档ID条件（如把重复上传的ID换成原始文档ID）"""
+        return QueryFilters(self.categories, sorted(set(document_ids)), self.upload_from, self.upload_to)
+
+    def chroma_where(self) -> Optional[Dict[str, Any]]:
+        """Chroma元数据过滤条件（上传时间使用数值型的upload_ts元数据）"""
+        conditions = []
+        if self.categories:
+            conditions.append({"category": {"$in": self.categories}})
+        if self.document_ids:
+            conditions.append({"document_id": {"$in": self.document_ids}})
+        if self.upload_from:
+            conditions.append({"upload_ts": {"$gte": self.upload_from.timestamp()}})
+        if self.upload_to:
+            conditions.append({"upload_ts": {"$lt": self.upload_to.timestamp()}})
+        if not conditions:
+            return None
+        return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+    def sql_conditions(self, table: str = "") -> Tuple[List[str], List[Any]]:
+        """documents表上的SQL条件和参数，table为表别名"""
+        prefix = f"{table}." if table else ""
+        conditions, params = [], []
+        if self.categories:
+            conditions.append(f"{prefix}category IN ({', '.join('?' * len(self.categories))})")
+            params.extend(self.categories)
+        if self.document_ids:
+            conditions.append(f"{prefix}document_id IN ({', '.join('?' * len(self.document_ids))})")
+            params.extend(self.document_ids)
+        if self.upload_from:
+            conditions.append(f"{prefix}upload_time >= ?")
+            params.append(self.upload_from.isoformat())
+        if self.upload_to:
+            conditions.append(f"{prefix}upload_time < ?")
+            params.append(self.upload_to.isoformat())
+        return conditions, params
+
+    def to_dict(self) -> Dict[str, Any]:
+        """规范化后的条件，用作语义缓存作用域"""
+        return {
+            "category": self.categories,
+            "document_id": self.document_ids,
+            "upload_time_from": self.upload_from.isoformat() if self.upload_from else None,
+            "upload_time_to": self.upload_to.isoformat() if self.upload_to else None
+        }
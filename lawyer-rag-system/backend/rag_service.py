@@ -1,9 +1,15 @@
 from datetime import datetime
-from typing import Dict, Any
+from pathlib import Path
+from contextlib import aclosing, asynccontextmanager
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple
+import asyncio
+import hashlib
 import os
+import sqlite3
+import threading
+import time
 
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader
+from langchain_core.documents import Document
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from langchain.text_splitter import RecursiveCharacterTextSplitter
@@ -11,175 +17,972 @@ from langchain.chat_models import init_chat_model
 from langchain_chroma import Chroma
 
 from sql_file import DocumentManager
+from embedding_cache import EmbeddingCache, CachedEmbeddings
+from embedding_backend import build_embeddings
+from document_loader import load_document
+from timing import timed, format_timings
+from keyword_index import KeywordIndex, reciprocal_rank_fusion
+from file_lock import locked
+from semantic_cache import SemanticAnswerCache, make_scope
+from query_filters import QueryFilters
+from context_builder import ContextBuilder, PackedContext, estimate_tokens
+from reranker import build_reranker
+from preview_store import PreviewStore
+from metrics import (
+    INGEST_STAGE_SECONDS, INGEST_DOCUMENTS, INGEST_CHUNKS, QUERY_STAGE_SECONDS, QUERIES,
+    PROMPT_TOKENS, COMPLETION_TOKENS, ERRORS
+)
+from legal_chunker import LegalTextSplitter, find_article_reference, is_bare_article_lookup
+from config import (
+    EMBEDDING_CACHE_ENABLED, CHROMA_DIR, CHROMA_COLLECTION, CHROMA_RESET, UPLOADS_DIR,
+    HYBRID_RETRIEVAL, RETRIEVAL_SCORE_THRESHOLD, RRF_K, SEMANTIC_CACHE_ENABLED, LLM_MAX_CONCURRENCY,
+    RERANK_CANDIDATES, KEYWORD_INDEX_PATH, CORPUS_LOG_KEEP
+)
+
+# 单次写入Chroma的最大条数（低于Chroma默认的批量上限）
+VECTOR_INSERT_BATCH = 1000
+
+# 分页扫描Chroma元数据时每页的条数
+VECTOR_SCAN_PAGE = 5000
+
+# 关键词索引每次从语料变更日志读取的条数
+CORPUS_SYNC_BATCH = 1000
+
+# 分块大小和相邻块的重叠字符数
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 50
+
+
+def chunk_records(texts: List[Document]) -> List[Dict[str, Any]]:
+    """文本块 → chunks表的行：块序号、页码、页内字符偏移 [start, end) 和文本哈希"""
+    records = []
+    for text in texts:
+        start = text.metadata.get("start_index")
+        records.append({
+            "chunk_index": text.metadata["chunk_index"],
+            "page": text.metadata.get("page"),
+            "start_offset": start,
+            "end_offset": start + len(text.page_content) if start is not None else None,
+            "text_hash": hashlib.sha256(text.page_content.encode("utf-8")).hexdigest()
+        })
+    return records
+
+
+def directory_size(path: Path) -> int:
+    """目录（或文件）占用的字节数"""
+    if not path.exists():
+        return 0
+    if path.is_file():
+        return path.stat().st_size
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+def storage_sizes(document_db_path: Path) -> Dict[str, int]:
+    """向量库、文档库和上传目录的大小"""
+    return {
+        "vector_db_bytes": directory_size(CHROMA_DIR),
+        # WAL模式下尚未写回的数据在 -wal 文件中
+        "document_db_bytes": directory_size(Path(document_db_path)) + directory_size(Path(f"{document_db_path}-wal")),
+        "uploads_bytes": directory_size(UPLOADS_DIR)
+    }
+
+
+def vacuum_sqlite(db_path: Path):
+    """对SQLite数据库执行VACUUM，回收已删除数据占用的空间"""
+    if not Path(db_path).exists():
+        return
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+
+# 法律分析prompt（普通问答和流式问答共用）
+LEGAL_ANALYSIS_PROMPT = """               
+
+                你是一名资深法律专家，请基于以下法律文献回答问题：
+
+                {source_knowledge}
+
+                用户问题：{query}
+
+                请按以下结构回答：
+                1. **法律问题识别**: 明确争议焦点和适用法律领域
+                2. **法条依据**: 列出相关法律条文（包含条文编号和具体内容）
+                3. **判例参考**: 引用相关判例或司法解释
+                4. **法律分析**: 结合具体情况进行逻辑推理
+                5. **结论建议**: 提供明确的法律意见和操作建议
+                6. **风险提示**: 说明可能存在的法律风险
+
+                注意：如果涉及争议性问题，请说明不同观点。
+                """
+
+# 没有检索到任何文档时直接返回的回答（不调用llm）
+NO_MATCHING_DOCUMENTS_ANSWER = "没有符合过滤条件的文档，无法基于文档回答该问题。请调整过滤条件后重试。"
+NO_DOCUMENTS_ANSWER = "文档库中还没有可供检索的文档，请先上传相关法律文档。"
 
 # from langgraph.checkpoint.memory import MemorySaver
 # memory = MemorySaver()
 
 class SimpleRAGService:
-    def __init__(self):
-        # 初始化embedding模型
-        self.embed_model = HuggingFaceEmbeddings(
-            model_name="BAAI/bge-small-zh-v1.5",
-            model_kwargs={'device': 'cuda'}  
-        )
-         # 初始化llm模型
-        # self.llm = init_chat_model("ollama:qwen3:1.7b", temperature=0)
-        self.llm = init_chat_model("deepseek:deepseek-chat",api_key= os.getenv("DEEPSEEK_API_KEY"),temperature=0)
+    def __init__(self, reset_vector_db: bool = CHROMA_RESET, document_manager: DocumentManager = None):
+        # 初始化embedding模型（设备自动检测，后端和batch大小见config）
+        self.embed_model, self.embedding_model_id = build_embeddings()
+
+        # 分块向量缓存：重复上传、文档修订版本和重建索引时复用已有向量
+        self.embedding_cache = None
+        if EMBEDDING_CACHE_ENABLED:
+            self.embedding_cache = EmbeddingCache()
+            self.embed_model = CachedEmbeddings(self.embed_model, self.embedding_cache, self.embedding_model_id)
+
+        # llm模型在第一次问答时再初始化
+        self._llm = None
+        self._llm_lock = threading.Lock()
+
+        # 异步问答中同时进行的llm调用上限
+        self.llm_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+        self.llm_in_flight = 0
+        self.llm_waiting = 0
 
         # 清空已有的向量数据库（仅用于测试）
-        import shutil
-        shutil.rmtree("./chroma_db", ignore_errors=True)
+        if reset_vector_db:
+            import shutil
+            shutil.rmtree(CHROMA_DIR, ignore_errors=True)
 
-        # 初始化向量数据库
+        # 初始化向量数据库（打开已有的持久化集合）
         self.vector_db = Chroma(
-            collection_name="lawyer_documents",
+            collection_name=CHROMA_COLLECTION,
             embedding_function=self.embed_model,
-            persist_directory="./chroma_db"
+            persist_directory=str(CHROMA_DIR)
         )
         
         # 文本分割器
         self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=500,
-            chunk_overlap=50,
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP,
             separators=["\n\n", "\n", "。", "！", "？", "；", "，"],
             keep_separator = "end"
         )
+
+        # 按 编/章/节/条 结构分块，无条文结构的文档退回上面的分割器
+        self.legal_splitter = LegalTextSplitter(self.text_splitter, chunk_size=CHUNK_SIZE)
+
+        # 按token预算打包prompt上下文（合并相邻块、去掉重叠文本）
+        self.context_builder = ContextBuilder(max_overlap=CHUNK_OVERLAP)
+        self.prompt_template_tokens = estimate_tokens(LEGAL_ANALYSIS_PROMPT.format(source_knowledge="", query=""))
         
-        # 简单的文档存储，后续接入数据库
-        self.documents = {}
+        # 关键词倒排索引：就绪后由load_keyword_index在后台加载快照（加载完成前关键词检索不返回结果），
+        # 之后按语料变更日志增量更新；_corpus_lock保证变更按日志顺序应用
+        self.keyword_index: Optional[KeywordIndex] = None
+        self.keyword_index_path = KEYWORD_INDEX_PATH
+        self._corpus_lock = threading.RLock()
+        if reset_vector_db:
+            self.keyword_index_path.unlink(missing_ok=True)
+
+        # 可选的重排阶段（RERANKER_BACKEND=none时不启用）
+        self.reranker = build_reranker()
+
+        # 问答语义缓存
+        self.answer_cache = SemanticAnswerCache() if SEMANTIC_CACHE_ENABLED else None
+
+        # 初始化文档管理器（可与API共用同一个实例）
+        self.document_manager = document_manager or DocumentManager()
+        self.save_document = self.document_manager.save_document
+
+        # 语义缓存已按语料变更日志失效到的序号（缓存启动时为空，从当前最新序号开始）
+        self._answer_seq = self.document_manager.corpus_version()[1]
+        self._answer_sync_lock = threading.Lock()
 
-        # 初始化文档管理器
-        self.save_document = DocumentManager().save_document
+        # 文档预览的页面文本（入库时保存，热门文档缓存在内存中）
+        self.preview_store = PreviewStore(self.document_manager)
+
+    @property
+    def llm(self):
+        """首次使用时初始化llm模型"""
+        if self._llm is None:
+            with self._llm_lock:
+                if self._llm is None:
+                    # self._llm = init_chat_model("ollama:qwen3:1.7b", temperature=0)
+                    self._llm = init_chat_model("deepseek:deepseek-chat",api_key= os.getenv("DEEPSEEK_API_KEY"),temperature=0)
+        return self._llm
     
     def process_document(self, file_path: str, document_id : str, filename: str, category: str = "general") -> str:
         """处理上传的文档"""
         try:
-            # document_id = str(uuid.uuid4())
+            timings = {}
 
-            file_path_str = str(file_path)
-            
-            # 根据文件类型加载文档
-            if file_path_str.endswith('.pdf'):
-                loader = PyPDFLoader(file_path)
-            elif file_path_str.endswith('.docx'):
-                loader = Docx2txtLoader(file_path)
-            else:
-                raise ValueError("不支持的文件格式")
-            
-            
-            # 加载并分割文档
-            documents = loader.load()
-            texts = self.text_splitter.split_documents(documents)
-            
-            # 为每个文本块添加元数据
-            for i, text in enumerate(texts):
-                text.metadata.update({
-                    "document_id": document_id,
-                    "filename": filename,
-                    "category": category,
-                    "chunk_index": i,
-                    "upload_time": datetime.now().isoformat()
-                })
+            # 加载文档（大PDF按页段并行解析）
+            with timed(timings, "load", INGEST_STAGE_SECONDS):
+                documents = load_document(file_path)
+
+            # 分割文档并添加元数据
+            with timed(timings, "split", INGEST_STAGE_SECONDS):
+                texts, articles = self.split_documents(documents, document_id, filename, category)
+
+            # 重新入库的文档，之前基于它的缓存回答失效
+            self.invalidate_answers([document_id])
+
+            # 向量化
+            with timed(timings, "embed", INGEST_STAGE_SECONDS):
+                embeddings = self.embed_model.embed_documents([text.page_content for text in texts])
 
             # 添加到向量数据库
-            self.vector_db.add_documents(texts)
-            
-            # 保存文档信息到内存
-            self.documents[document_id] = {
-                "document_id": document_id,
-                "filename": filename,
-                "category": category,
-                "upload_time": datetime.now().isoformat(),
-                "status": "completed"
-            }
+            with timed(timings, "store", INGEST_STAGE_SECONDS):
+                self.add_chunks(document_id, texts, embeddings)
+
+            # 保存文本块、条文和页面文本到数据库
+            with timed(timings, "sqlite", INGEST_STAGE_SECONDS):
+                self.document_manager.save_chunks(document_id, chunk_records(texts))
+                self.document_manager.save_articles(document_id, articles)
+                self.preview_store.save(document_id, documents)
 
-            # 保存文档信息到数据库
+            # 各阶段计时结束后再保存文档信息，记录的耗时才包含sqlite阶段
             success = self.save_document(
                     document_id=document_id,
                     filename=filename,
                     category=category,
                     upload_time=datetime.now().isoformat(),
-                    status="completed"
+                    status="completed",
+                    chunk_count=len(texts),
+                    timings=timings
                 )
             if not success:
-                print(f"❌ 保存文档到数据库失败：{filename}（ID: {document_id}）")
-            else:
-                print(f"✅ 保存文档到数据库成功：{filename}（ID: {document_id}）")
+                # 由下面的异常处理计入失败，入库队列把文档标记为failed
+                raise Exception(f"保存文档到数据库失败：{filename}（ID: {document_id}）")
+            # 完成状态写入成功后才计入完成
+            INGEST_DOCUMENTS.inc(status="completed")
+            INGEST_CHUNKS.inc(len(texts))
+            print(f"✅ 保存文档到数据库成功：{filename}（ID: {document_id}）")
+            print(f"⏱ {filename}: {len(documents)} 页, {len(texts)} 块, {format_timings(timings)}")
 
             return document_id
             
         except Exception as e:
+            INGEST_DOCUMENTS.inc(status="failed")
+            ERRORS.inc(stage="ingest")
             raise Exception(f"文档处理失败: {str(e)}")
-        
-    # def enhanced_retrieval(self, query, k=5):
-        # from rank_bm25 import BM25Okapi
-        # from operator import itemgetter  
-        # import numpy as np        
-    #     # 准备语义检索
-    #     semantic_docs = self.vector_db.similarity_search(query, k=k*2)
-        
-    #     # 准备语义检索关键词检索
-    #     keyword_docs = bm25_search(query, k=k*2)
-        
-    #     # 准备语义检索混合排序
-    #     combined_results = rank_fusion(semantic_docs, keyword_docs)
-        
-    #     # 准备语义检索相关性过滤
-    #     filtered_results = filter_by_relevance_score(combined_results, threshold=0.7)
-        
-    #     return filtered_results[:k]
 
-    def query_documents(self, query: str, k: int = 3) -> Dict[str, Any]:
-        """文档问答"""
+    def split_documents(self, documents: List[Document], document_id: str,
+                        filename: str, category: str = "general") -> Tuple[List[Document], List[Dict[str, Any]]]:
+        """按法律条文结构分割文档，并为每个文本块添加元数据，返回 (文本块, 条文列表)"""
+        texts, articles = self.legal_splitter.split_documents(documents)
+
+        # 使用文档登记时的上传时间（而不是处理时间），按上传时间过滤时与文档库一致
+        document = self.document_manager.get_document(document_id)
+        upload_time = datetime.fromisoformat(document["upload_time"]) \
+            if document and document.get("upload_time") else datetime.now()
+        for i, text in enumerate(texts):
+            text.metadata.update({
+                "document_id": document_id,
+                "filename": filename,
+                "category": category,
+                "chunk_index": i,
+                "upload_time": upload_time.isoformat(),
+                "upload_ts": upload_time.timestamp()
+            })
+        return texts, articles
+
+    def add_chunks(self, document_id: str, texts: List[Document], embeddings: List[List[float]]):
+        """将文档已向量化的全部文本块写入向量数据库，块ID为 document_id:chunk_index
+
+        块ID是确定的，重新入库时按ID覆盖；新分块比上次少时，
+        序号超出的旧块先从向量库和关键词索引中删除，不再被检索到。
+        """
+        collection = self.vector_db._collection
+        stale = collection.get(
+            where={"$and": [{"document_id": document_id}, {"chunk_index": {"$gte": len(texts)}}]},
+            include=[]
+        )["ids"]
+        if stale:
+            collection.delete(ids=stale)
+
+        for start in range(0, len(texts), VECTOR_INSERT_BATCH):
+            batch = texts[start:start + VECTOR_INSERT_BATCH]
+            collection.upsert(
+                ids=[f"{document_id}:{text.metadata['chunk_index']}" for text in batch],
+                embeddings=embeddings[start:start + VECTOR_INSERT_BATCH],
+                documents=[text.page_content for text in batch],
+                # Chroma不接受None值的元数据
+                metadatas=[{key: value for key, value in text.metadata.items() if value is not None}
+                           for text in batch]
+            )
+        self.corpus_changed([document_id])
+
+
+    def indexed_document_ids(self) -> set:
+        """分页扫描向量库，返回已有向量的document_id集合"""
+        collection = self.vector_db._collection
+        document_ids = set()
+        offset = 0
+        while True:
+            page = collection.get(include=["metadatas"], limit=VECTOR_SCAN_PAGE, offset=offset)
+            metadatas = page["metadatas"] or []
+            for metadata in metadatas:
+                if metadata and metadata.get("document_id"):
+                    document_ids.add(metadata["document_id"])
+            if len(metadatas) < VECTOR_SCAN_PAGE:
+                return document_ids
+            offset += VECTOR_SCAN_PAGE
+
+    def reconcile_index(self, document_manager: DocumentManager,
+                        documents: List[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """校验文档库与向量库是否一致
+
+        返回需要重新向量化的文档（文档库中已完成或处理被中断、但向量库中没有向量），
+        并删除文档库中已不存在的文档残留在向量库中的向量。
+        documents为启动时（接受上传之前）记下的文档列表，只在其中查找需要重建的文档；
+        判断孤立向量时则在扫描向量库之后重新读取文档库，扫描期间新入库的文档不会被误删。
+        """
+        if documents is None:
+            documents = document_manager.get_indexable_documents()
+        indexed = self.indexed_document_ids()
+        known = {document["document_id"] for document in document_manager.get_indexable_documents()}
+
+        missing = [document for document in documents
+                   if document["status"] == "processing" or document["document_id"] not in indexed]
+
+        orphaned = list(indexed - known)
+        self.delete_vectors(orphaned)
+
+        report = {
+            "documents": len(known),
+            "indexed": len(indexed & known),
+            "missing": missing,
+            "orphaned": len(orphaned)
+        }
+        print(f"向量库对账：文档 {report['documents']}，已索引 {report['indexed']}，"
+              f"待重建 {len(missing)}，清理孤立文档向量 {len(orphaned)}")
+        return report
+
+    def backfill_filter_metadata(self) -> int:
+        """为旧版本写入的块补齐数值型upload_ts元数据（按上传时间过滤依赖该字段），返回更新的块数"""
+        collection = self.vector_db._collection
+        upload_times: Dict[str, Optional[str]] = {}
+        updated, offset = 0, 0
+        while True:
+            page = collection.get(include=["metadatas"], limit=VECTOR_SCAN_PAGE, offset=offset)
+            ids, metadatas = [], []
+            for chunk_id, metadata in zip(page["ids"], page["metadatas"]):
+                metadata = metadata or {}
+                if "upload_ts" in metadata:
+                    continue
+                document_id = metadata.get("document_id")
+                if document_id not in upload_times:
+                    document = self.document_manager.get_document(document_id) if document_id else None
+                    upload_times[document_id] = document["upload_time"] if document else None
+                upload_time = upload_times[document_id] or metadata.get("upload_time")
+                if not upload_time:
+                    continue
+                ids.append(chunk_id)
+                metadatas.append({**metadata, "upload_time": upload_time,
+                                  "upload_ts": datetime.fromisoformat(upload_time).timestamp()})
+            if ids:
+                collection.update(ids=ids, metadatas=metadatas)
+                updated += len(ids)
+            if len(page["ids"]) < VECTOR_SCAN_PAGE:
+                break
+            offset += VECTOR_SCAN_PAGE
+        if updated:
+            print(f"已为 {updated} 个块补齐upload_ts元数据")
+        return updated
+
+    def delete_vectors(self, document_ids: List[str]) -> int:
+        """按document_id元数据删除向量，返回删除的块数"""
+        collection = self.vector_db._collection
+        deleted = 0
+        for start in range(0, len(document_ids), VECTOR_INSERT_BATCH):
+            where = {"document_id": {"$in": document_ids[start:start + VECTOR_INSERT_BATCH]}}
+            ids = collection.get(where=where, include=[])["ids"]
+            if ids:
+                collection.delete(ids=ids)
+                deleted += len(ids)
+        if document_ids:
+            self.corpus_changed(document_ids)
+        return deleted
+
+    def reassign_vectors(self, old_document_id: str, new_document: Dict[str, Any]) -> int:
+        """把一个文档的向量转交给另一条文档记录（更新块元数据中的document_id、文件名和类别）"""
+        collection = self.vector_db._collection
+        page = collection.get(where={"document_id": old_document_id}, include=["metadatas"])
+        metadatas = [{**metadata,
+                      "document_id": new_document["document_id"],
+                      "filename": new_document["filename"],
+                      "category": new_document["category"],
+                      "upload_time": new_document["upload_time"],
+                      "upload_ts": datetime.fromisoformat(new_document["upload_time"]).timestamp()}
+                     for metadata in page["metadatas"]]
+        for start in range(0, len(page["ids"]), VECTOR_INSERT_BATCH):
+            collection.update(ids=page["ids"][start:start + VECTOR_INSERT_BATCH],
+                              metadatas=metadatas[start:start + VECTOR_INSERT_BATCH])
+        self.corpus_changed([old_document_id, new_document["document_id"]])
+        return len(page["ids"])
+
+    def delete_document(self, document_id: str) -> Optional[Dict[str, Any]]:
+        """删除文档：同时删除向量库中的块和上传目录中的文件
+
+        重复上传的记录只删除自身；原始文档仍被重复上传引用时，
+        向量和文件转交给最早的那条重复记录，而不是删除。文档不存在时返回None。
+        """
+        document = self.document_manager.get_document(document_id)
+        if document is None:
+            return None
+        if document["status"] == "processing":
+            raise ValueError("文档正在处理中，请稍后再删除")
+
+        report = {"document_id": document_id, "vectors_deleted": 0, "file_deleted": False, "promoted_to": None}
+        self.invalidate_answers([document_id, document.get("canonical_id")])
+        self.preview_store.invalidate(document_id)
+
+        if document.get("canonical_id"):
+            self.document_manager.delete_document(document_id)
+            return report
+
+        aliases = self.document_manager.get_aliases(document_id)
+        if aliases:
+            heir = aliases[0]
+            self.reassign_vectors(document_id, heir)
+            self.document_manager.promote_alias(document_id, heir["document_id"])
+            self.document_manager.delete_document(document_id)
+            report["promoted_to"] = heir["document_id"]
+            return report
+
+        report["vectors_deleted"] = self.delete_vectors([document_id])
+        self.document_manager.delete_document(document_id)
+
+        # 只删除上传目录中的文件，批量导入时引用的原始归档文件保持不动
+        file_path = document.get("file_path")
+        if file_path and Path(file_path).resolve().parent == UPLOADS_DIR.resolve():
+            Path(file_path).unlink(missing_ok=True)
+            report["file_deleted"] = True
+
+        print(f"🗑 删除文档：{document['filename']}（ID: {document_id}），向量 {report['vectors_deleted']} 块")
+        return report
+
+    def compact_index(self) -> Dict[str, Any]:
+        """压缩索引：清理孤立向量和上传目录中无主的文件，并对SQLite数据库执行VACUUM，返回前后大小"""
+        before = storage_sizes(self.document_manager.db_path)
+
+        known = {document["document_id"] for document in self.document_manager.get_indexable_documents()}
+        orphaned = list(self.indexed_document_ids() - known)
+        vectors_deleted = self.delete_vectors(orphaned)
+
+        files_deleted = 0
+        referenced = self.document_manager.get_referenced_files()
+        # 最近一小时内写入的文件可能是正在上传、尚未登记的文档，不做清理
+        cutoff = time.time() - 3600
+        if UPLOADS_DIR.exists():
+            for file_path in UPLOADS_DIR.iterdir():
+                if file_path.is_file() and file_path.stat().st_mtime < cutoff \
+                        and str(file_path.resolve()) not in referenced:
+                    file_path.unlink()
+                    files_deleted += 1
+
+        # 关键词索引去掉已删除的块（合并后写入快照），再清理快照已包含的旧语料变更
+        keyword_index_merged = self.keyword_index is not None
+        if keyword_index_merged:
+            self.keyword_index.merge()
+        else:
+            print("关键词索引尚未加载，跳过合并")
+        corpus_changes_trimmed = self.document_manager.trim_corpus_log(CORPUS_LOG_KEEP)
+
+        vacuum_sqlite(CHROMA_DIR / "chroma.sqlite3")
+        self.document_manager.vacuum()
+
+        after = storage_sizes(self.document_manager.db_path)
+        report = {
+            "orphaned_documents": len(orphaned),
+            "vectors_deleted": vectors_deleted,
+            "files_deleted": files_deleted,
+            "corpus_changes_trimmed": corpus_changes_trimmed,
+            "keyword_index_merged": keyword_index_merged,
+            "before": before,
+            "after": after
+        }
+        print(f"索引压缩完成：{report}")
+        return report
+
+    def invalidate_answers(self, document_ids: List[str]) -> int:
+        """文档重新上传或删除后，使引用了这些文档的缓存回答失效
+
+        同时记入语料变更日志，其他worker在查询缓存前按日志使各自缓存中的这些回答失效（见sync_answer_cache）。
+        """
+        document_ids = [document_id for document_id in document_ids if document_id]
+        if not document_ids:
+            return 0
+        self.document_manager.log_corpus_change(document_ids)
+        if self.answer_cache is None:
+            return 0
+        return self.answer_cache.invalidate_documents(document_ids)
+
+    def sync_answer_cache(self) -> int:
+        """按语料变更日志使缓存中引用了变更文档的回答失效（包括其他worker的入库和删除），返回失效条数"""
+        if self.answer_cache is None:
+            return 0
+        invalidated = 0
+        with self._answer_sync_lock:
+            while True:
+                changes = self.document_manager.get_corpus_changes(self._answer_seq, CORPUS_SYNC_BATCH)
+                if not changes:
+                    return invalidated
+                if changes[0][0] > self._answer_seq + 1:
+                    # 中间的变更已被清理，无法判断哪些回答失效
+                    self.answer_cache.clear()
+                else:
+                    invalidated += self.answer_cache.invalidate_documents(
+                        document_id for _, document_id in changes)
+                self._answer_seq = changes[-1][0]
+
+    def answer_cache_stats(self) -> Dict[str, Any]:
+        """问答语义缓存命中统计"""
+        if self.answer_cache is None:
+            return {"enabled": False}
+        return {"enabled": True, **self.answer_cache.stats()}
+
+    def embedding_cache_stats(self) -> Dict[str, Any]:
+        """向量缓存命中统计"""
+        if self.embedding_cache is None:
+            return {"enabled": False}
+        return {"enabled": True, **self.embedding_cache.stats()}
+
+    def corpus_changed(self, document_ids: List[str]):
+        """向量库中这些文档的块已写入、删除或转交：记入语料变更日志，再把关键词索引更新到最新"""
+        with self._corpus_lock:
+            self.document_manager.log_corpus_change(document_ids)
+            self.sync_corpus()
+
+    def sync_corpus(self) -> int:
+        """把语料变更日志中关键词索引尚未应用的变更（包括其他worker写入的）应用到索引，返回应用的条数
+
+        索引未加载时为0；索引落后到所需的变更已被清理时，在后台从向量库重建。
+        """
+        with self._corpus_lock:
+            if self.keyword_index is None:
+                return 0
+            try:
+                return self._apply_corpus_changes(self.keyword_index)
+            except ValueError as e:
+                print(f"{e}，在后台重建关键词索引")
+                self.keyword_index = None
+                threading.Thread(target=self.load_keyword_index, name="keyword-index", daemon=True).start()
+                return 0
+
+    def _apply_corpus_changes(self, index: KeywordIndex) -> int:
+        """按序号应用index.seq之后的语料变更：从向量库读取受影响文档当前的全部块，替换索引中该文档的块
+
+        每条变更只记录文档ID、应用时读取的是向量库的最新状态，因此重复应用或晚于后续写入应用都不会出错。
+        所需的变更已被清理时抛出ValueError。
+        """
+        collection = self.vector_db._collection
+        applied = 0
+        while True:
+            changes = self.document_manager.get_corpus_changes(index.seq, CORPUS_SYNC_BATCH)
+            if not changes:
+                return applied
+            if changes[0][0] > index.seq + 1:
+                raise ValueError(f"关键词索引落后（序号 {index.seq}），之后的语料变更已被清理")
+            for document_id in dict.fromkeys(document_id for _, document_id in changes):
+                page = collection.get(where={"document_id": document_id}, include=["documents"])
+                index.replace_document(document_id, zip(page["ids"], page["documents"]))
+            index.seq = changes[-1][0]
+            applied += len(changes)
+
+    def _build_keyword_index(self) -> KeywordIndex:
+        """从向量库分页读取所有文本块建立关键词索引，应用扫描期间的语料变更后写入快照"""
+        collection = self.vector_db._collection
+        # 扫描前的最新序号：扫描期间发生的变更在扫描后再应用一次
+        _, seq = self.document_manager.corpus_version()
+
+        def chunks():
+            offset = 0
+            while True:
+                page = collection.get(include=["documents", "metadatas"], limit=VECTOR_SCAN_PAGE, offset=offset)
+                for chunk_id, text, metadata in zip(page["ids"], page["documents"], page["metadatas"]):
+                    yield chunk_id, (metadata or {}).get("document_id", ""), text or ""
+                if len(page["ids"]) < VECTOR_SCAN_PAGE:
+                    return
+                offset += VECTOR_SCAN_PAGE
+
+        index = KeywordIndex.build(chunks(), snapshot_path=self.keyword_index_path)
+        index.seq = seq
+        self._apply_corpus_changes(index)
+        self.save_keyword_index(index)
+        return index
+
+    def _open_keyword_snapshot(self) -> Optional[KeywordIndex]:
+        """加载关键词索引快照并追上语料变更日志；没有快照、快照无法使用或与向量库不一致时返回None"""
+        path = self.keyword_index_path
+        if not path.exists():
+            return None
         try:
-            # 检索相关文档
-            # relevant_docs = self.vector_db.similarity_search_with_score(query, k=k)
-            relevant_docs = self.vector_db.similarity_search(query , k = k)
-            source_knowledge = "\n".join([x.page_content for x in relevant_docs])
+            index = KeywordIndex.load(path, snapshot_path=path)
+        except Exception as e:
+            print(f"关键词索引快照加载失败: {e}")
+            return None
 
-            # 构建prompt
-            prompt = ChatPromptTemplate.from_template( """               
+        first, last = self.document_manager.corpus_version()
+        if index.seq > last or index.seq + 1 < first:
+            # 快照比日志新（文档库被替换过），或快照之后的变更已被清理
+            print(f"关键词索引快照已过期（快照序号 {index.seq}，日志 {first}~{last}）")
+            return None
+        self._apply_corpus_changes(index)
 
-                你是一名资深法律专家，请基于以下法律文献回答问题：
+        chunks = self.vector_db._collection.count()
+        if len(index) != chunks:
+            print(f"关键词索引快照与向量库不一致（{len(index)} / {chunks} 块）")
+            return None
+        return index
 
-                {source_knowledge}
+    def load_keyword_index(self) -> int:
+        """加载关键词索引（服务就绪后在后台调用）：优先使用快照，否则从向量库重建并写入快照，返回块数"""
+        index = self._open_keyword_snapshot()
+        if index is None:
+            # 多个worker同时启动时只由一个重建，其余等待后直接加载它写入的快照
+            with locked("keyword-index"):
+                index = self._open_keyword_snapshot() or self._build_keyword_index()
+        with self._corpus_lock:
+            self._apply_corpus_changes(index)
+            self.keyword_index = index
+        print(f"关键词索引加载完成：{len(index)} 块")
+        return len(index)
 
-                用户问题：{query}
+    def save_keyword_index(self, index: KeywordIndex = None):
+        """把关键词索引（含增量段）写入快照，下次启动只需应用之后的语料变更"""
+        index = index or self.keyword_index
+        if index is None:
+            return
+        try:
+            self.keyword_index_path.parent.mkdir(parents=True, exist_ok=True)
+            index.save(self.keyword_index_path)
+        except Exception as e:
+            print(f"写入关键词索引快照失败: {e}")
 
-                请按以下结构回答：
-                1. **法律问题识别**: 明确争议焦点和适用法律领域
-                2. **法条依据**: 列出相关法律条文（包含条文编号和具体内容）
-                3. **判例参考**: 引用相关判例或司法解释
-                4. **法律分析**: 结合具体情况进行逻辑推理
-                5. **结论建议**: 提供明确的法律意见和操作建议
-                6. **风险提示**: 说明可能存在的法律风险
+    def _relevance_score(self, distance: float) -> float:
+        """把Chroma返回的距离换算成余弦相似度（向量已L2归一化）
 
-                注意：如果涉及争议性问题，请说明不同观点。
-                """)
+        l2空间下Chroma返回的是欧氏距离的平方d，余弦相似度为 1 - d/2；cosine和ip空间下距离为 1 - 余弦相似度。
+        """
+        space = (self.vector_db._collection.metadata or {}).get("hnsw:space", "l2")
+        if space == "l2":
+            return 1.0 - distance / 2
+        return 1.0 - distance
+
+    def vector_search(self, query: str, k: int, embedding: List[float] = None,
+                      where: Dict[str, Any] = None) -> List[Tuple[str, Document, float]]:
+        """语义检索，返回 (块ID, 文本块, 相关性得分)；已有问题向量时可直接传入，where为元数据过滤条件"""
+        if embedding is None:
+            embedding = self.embed_model.embed_query(query)
+        result = self.vector_db._collection.query(
+            query_embeddings=[embedding],
+            n_results=k,
+            where=where,
+            include=["documents", "metadatas", "distances"]
+        )
+        return [
+            (chunk_id, Document(page_content=text, metadata=metadata or {}), self._relevance_score(distance))
+            for chunk_id, text, metadata, distance in zip(
+                result["ids"][0], result["documents"][0], result["metadatas"][0], result["distances"][0])
+        ]
+
+    def retrieve(self, query: str, k: int = 3, embedding: List[float] = None,
+                 filters: QueryFilters = None, timings: Dict[str, float] = None) -> List[Document]:
+        """混合检索：语义检索 + BM25关键词检索，倒数排名融合
+
+        语义检索结果按相关性阈值（余弦相似度）过滤，全部低于阈值时仍保留最相近的块；
+        关键词检索命中的是条文编号、当事人名称等精确匹配，不受该阈值约束。过滤条件同时下推到两路检索中。
+        启用重排时先召回RERANK_CANDIDATES个候选块，重排后保留前k块，重排耗时记入timings["rerank"]。
+        """
+        candidates = max(k, RERANK_CANDIDATES) if self.reranker else k
+        if embedding is None:
+            with timed(timings, "embed", QUERY_STAGE_SECONDS):
+                embedding = self.embed_model.embed_query(query)
 
-            # 构建chain
-            chain = prompt | self.llm | StrOutputParser()
+        # 语义检索 + 相关性过滤
+        where = filters.chroma_where() if filters else None
+        with timed(timings, "vector_search", QUERY_STAGE_SECONDS):
+            hits = self.vector_search(query, candidates * 2, embedding, where)
+            vector_hits = [hit for hit in hits if hit[2] >= RETRIEVAL_SCORE_THRESHOLD]
+            if not vector_hits:
+                # 与原先只取前k块一致：关键词索引未加载或未启用混合检索时也不会以空的上下文提问
+                vector_hits = hits[:candidates]
+        if not HYBRID_RETRIEVAL:
+            return self._rerank(query, [document for _, document, _ in vector_hits[:candidates]], k, timings)
+
+        # 关键词检索（有过滤条件时只在符合条件的文档中检索）
+        with timed(timings, "keyword_search", QUERY_STAGE_SECONDS):
+            # 先应用其他worker的入库和删除
+            self.sync_corpus()
+            keyword_hits = []
+            if self.keyword_index is not None:
+                document_ids = self.document_manager.find_document_ids(filters) if filters else None
+                keyword_hits = self.keyword_index.search(query, candidates * 2, document_ids)
+
+        # 混合排序
+        fused = reciprocal_rank_fusion(
+            [[chunk_id for chunk_id, _, _ in vector_hits], [chunk_id for chunk_id, _ in keyword_hits]],
+            RRF_K
+        )[:candidates]
+
+        # 只由关键词检索命中的块需要回向量库取正文
+        documents = {chunk_id: document for chunk_id, document, _ in vector_hits}
+        missing = [chunk_id for chunk_id, _ in fused if chunk_id not in documents]
+        if missing:
+            page = self.vector_db._collection.get(ids=missing, include=["documents", "metadatas"])
+            for chunk_id, text, metadata in zip(page["ids"], page["documents"], page["metadatas"]):
+                documents[chunk_id] = Document(page_content=text, metadata=metadata or {})
+
+        return self._rerank(query, [documents[chunk_id] for chunk_id, _ in fused if chunk_id in documents],
+                            k, timings)
+
+    def _rerank(self, query: str, documents: List[Document], k: int,
+                timings: Dict[str, float] = None) -> List[Document]:
+        """未启用重排时直接取前k块"""
+        if self.reranker is None or len(documents) <= 1:
+            return documents[:k]
+        documents, elapsed = self.reranker.rerank(query, documents, k)
+        QUERY_STAGE_SECONDS.observe(elapsed, stage="rerank")
+        if timings is not None:
+            timings["rerank"] = elapsed
+        return documents
+
+    def rerank_stats(self) -> Dict[str, Any]:
+        """重排调用次数、得分缓存命中率和耗时分位数"""
+        if self.reranker is None:
+            return {"enabled": False}
+        return {"enabled": True, "candidates": RERANK_CANDIDATES, **self.reranker.stats()}
+
+    def lookup_articles(self, query: str, limit: int = 3, filters: QueryFilters = None) -> List[Document]:
+        """识别问题中的“第X章第X条”，直接从条文索引中取原文"""
+        reference = find_article_reference(query)
+        if reference is None:
+            return []
+        chapter, article = reference
+        rows = self.document_manager.find_articles(article, chapter, limit, filters)
+        return [
+            Document(page_content=row["text"], metadata={
+                "document_id": row["document_id"],
+                "filename": row["filename"],
+                "category": row["category"],
+                "chapter": row["chapter"],
+                "article": row["article"],
+                "page": row["page"]
+            })
+            for row in rows
+        ]
+
+    def _format_sources(self, documents: List[Document]) -> List[Dict[str, Any]]:
+        """整理来源信息
+
+        文件名、类别、页码和页内偏移按 (文档, 块序号) 一次查询chunks表得到，
+        没有记录的块（如条文直查结果、旧数据）退回使用向量库中的元数据。
+        """
+        keys = [(doc.metadata['document_id'], doc.metadata['chunk_index'])
+                for doc in documents if doc.metadata.get('chunk_index') is not None]
+        chunks = self.document_manager.get_chunks(keys)
+
+        sources = []
+        for doc in documents:
+            chunk = chunks.get((doc.metadata.get('document_id'), doc.metadata.get('chunk_index'))) or {}
+            sources.append({
+                "document_id": doc.metadata.get('document_id'),
+                "filename": chunk.get('filename') or doc.metadata.get('filename', '未知文档'),
+                "category": chunk.get('category') or doc.metadata.get('category', 'general'),
+                "chunk_index": doc.metadata.get('chunk_index'),
+                "page": chunk.get('page', doc.metadata.get('page')),
+                "start_offset": chunk.get('start_offset'),
+                "end_offset": chunk.get('end_offset'),
+                "preview": doc.page_content[:100] + "..."
+            })
+        return sources
+
+    def _build_chain(self):
+        """法律分析prompt | llm | 字符串输出"""
+        prompt = ChatPromptTemplate.from_template(LEGAL_ANALYSIS_PROMPT)
+        return prompt | self.llm | StrOutputParser()
+
+    @staticmethod
+    def _chain_inputs(query: str, context: PackedContext) -> Dict[str, str]:
+        return {
+            "source_knowledge": context.text,
+            "query": query
+        }
+
+    def _prompt_tokens(self, query: str, context: PackedContext) -> int:
+        """估算发送给llm的prompt token数（模板 + 上下文 + 问题）"""
+        return self.prompt_template_tokens + context.tokens + estimate_tokens(query)
+
+    @asynccontextmanager
+    async def _llm_slot(self):
+        """占用一个llm并发名额，名额用完时排队等待"""
+        self.llm_waiting += 1
+        try:
+            with timed(None, "llm_wait", QUERY_STAGE_SECONDS):
+                await self.llm_semaphore.acquire()
+        finally:
+            self.llm_waiting -= 1
+        self.llm_in_flight += 1
+        try:
+            yield
+        finally:
+            self.llm_in_flight -= 1
+            self.llm_semaphore.release()
+
+    async def _generate(self, chain, inputs: Dict[str, str]) -> AsyncIterator[str]:
+        """流式调用llm，记录首token延迟（llm_ttft）、生成总耗时（llm）和生成的token数"""
+        start = time.perf_counter()
+        first_token = True
+        parts = []
+        try:
+            async for token in chain.astream(inputs):
+                if first_token and token:
+                    QUERY_STAGE_SECONDS.observe(time.perf_counter() - start, stage="llm_ttft")
+                    first_token = False
+                parts.append(token)
+                yield token
+        finally:
+            QUERY_STAGE_SECONDS.observe(time.perf_counter() - start, stage="llm")
+            COMPLETION_TOKENS.inc(estimate_tokens("".join(parts)))
+
+    def llm_stats(self) -> Dict[str, int]:
+        """llm并发情况"""
+        return {
+            "max_concurrency": LLM_MAX_CONCURRENCY,
+            "in_flight": self.llm_in_flight,
+            "waiting": self.llm_waiting
+        }
+
+    def _resolve_filters(self, filters: Optional[QueryFilters]) -> Optional[QueryFilters]:
+        """重复上传的文档没有自己的向量，按文档ID过滤时换成其原始文档ID"""
+        if filters is None or not filters.document_ids:
+            return filters
+        return filters.with_document_ids(self.document_manager.resolve_canonical_ids(filters.document_ids))
+
+    def _prepare_query(self, query: str, k: int, filters: QueryFilters = None) -> Tuple[
+            Optional[Dict[str, Any]], PackedContext, Optional[List[float]], str]:
+        """检索阶段，返回 (无需调用llm的回答或None, 打包好的上下文, 问题向量, 缓存作用域)"""
+        filters = self._resolve_filters(filters)
+
+        # 条文直接查找：问题引用了具体条文时不做向量检索
+        article_docs = self.lookup_articles(query, filters=filters)
+        if article_docs and is_bare_article_lookup(query):
+            # 只询问条文原文时直接返回，不调用llm
+            answer = "\n\n".join(f"《{doc.metadata['filename']}》{doc.page_content}" for doc in article_docs)
+            result = {"answer": answer, "sources": self._format_sources(article_docs), "prompt_tokens": 0}
+            QUERIES.inc(source="article")
+            return result, PackedContext(documents=article_docs), None, ""
+
+        # 语义缓存：相近的问题直接返回之前的回答
+        timings = {}
+        embedding, scope = None, make_scope(k=k, filters=filters.to_dict() if filters else None)
+        if not article_docs and self.answer_cache is not None:
+            self.sync_answer_cache()
+            with timed(timings, "embed", QUERY_STAGE_SECONDS):
+                embedding = self.embed_model.embed_query(query)
+            cached = self.answer_cache.lookup(embedding, scope)
+            if cached is not None:
+                QUERIES.inc(source="cached")
+                return {**cached, "cached": True, "prompt_tokens": 0}, PackedContext(), embedding, scope
+
+        # 检索相关文档（各阶段耗时单独记录），按token预算打包成上下文
+        with timed(timings, "retrieve", QUERY_STAGE_SECONDS):
+            relevant_docs = article_docs or self.retrieve(query, k, embedding, filters, timings)
+        if not relevant_docs:
+            # 过滤条件排除了全部文档（或文档库为空）：没有可依据的内容，不调用llm
+            QUERIES.inc(source="empty")
+            answer = NO_MATCHING_DOCUMENTS_ANSWER if filters else NO_DOCUMENTS_ANSWER
+            return {"answer": answer, "sources": [], "prompt_tokens": 0}, PackedContext(), embedding, scope
+        with timed(timings, "prompt_build", QUERY_STAGE_SECONDS):
+            context = self.context_builder.build(relevant_docs)
+        QUERIES.inc(source="llm")
+        print(f"🧮 prompt约 {self._prompt_tokens(query, context)} tokens（上下文 {context.tokens}/"
+              f"{self.context_builder.token_budget}，{len(context.documents)}/{len(relevant_docs)} 块），"
+              f"{format_timings(timings)}")
+        return None, context, embedding, scope
+
+    def _finish_query(self, query: str, answer: str, context: PackedContext,
+                      embedding: Optional[List[float]], scope: str,
+                      sources: List[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """整理回答并写入语义缓存（sources为已整理好的来源，未传入时查询文档库整理）
+
+        没有引用任何文档的回答不缓存：缓存按引用的文档失效，这样的回答在新文档入库后不会失效。
+        """
+        result = {
+            "answer": answer,
+            "sources": sources if sources is not None else self._format_sources(context.documents),
+            "prompt_tokens": self._prompt_tokens(query, context)
+        }
+        PROMPT_TOKENS.inc(result["prompt_tokens"])
+        if embedding is not None and result["sources"]:
+            self.answer_cache.store(query, embedding, result, scope)
+        return result
+
+    def query_documents(self, query: str, k: int = 3, filters: QueryFilters = None) -> Dict[str, Any]:
+        """文档问答"""
+        try:
+            result, context, embedding, scope = self._prepare_query(query, k, filters)
+            if result is not None:
+                return result
 
             # 生成回答
-            response = chain.invoke({
-                "source_knowledge": source_knowledge,
-                "query": query
-            })   
-
-            # 整理来源信息
-            sources = []
-            for doc in relevant_docs:
-                sources.append({
-                    "document_id": doc.metadata.get('document_id'),
-                    "filename": doc.metadata.get('filename', '未知文档'),
-                    "category": doc.metadata.get('category', 'general'),
-                    "preview": doc.page_content[:100] + "..."
-                })
-            
-            return {
-                "answer": response,
-                "sources": sources
-            }
+            with timed(None, "llm", QUERY_STAGE_SECONDS):
+                response = self._build_chain().invoke(self._chain_inputs(query, context))
+            COMPLETION_TOKENS.inc(estimate_tokens(response))
+            return self._finish_query(query, response, context, embedding, scope)
+        except Exception as e:
+            ERRORS.inc(stage="query")
+            raise Exception(f"查询失败: {str(e)}")
+
+    async def aquery_documents(self, query: str, k: int = 3, filters: QueryFilters = None) -> Dict[str, Any]:
+        """异步文档问答
+
+        向量检索、embedding等阻塞调用在线程池中执行，llm调用受LLM_MAX_CONCURRENCY约束；
+        任务被取消（如客户端断开）时，上游llm请求随之取消。
+        """
+        try:
+            result, context, embedding, scope = await asyncio.to_thread(
+                self._prepare_query, query, k, filters)
+            if result is not None:
+                return result
+
+            chain = await asyncio.to_thread(self._build_chain)
+            async with self._llm_slot():
+                # 以流式调用收集完整回答，才能记录首token延迟
+                async with aclosing(self._generate(chain, self._chain_inputs(query, context))) as tokens:
+                    response = "".join([token async for token in tokens])
+            return await asyncio.to_thread(self._finish_query, query, response, context, embedding, scope)
         except Exception as e:
+            ERRORS.inc(stage="query")
             raise Exception(f"查询失败: {str(e)}")
-    
\ No newline at end of file
+
+    async def stream_query(self, query: str, k: int = 3,
+                           filters: QueryFilters = None) -> AsyncIterator[Tuple[str, Any]]:
+        """流式文档问答
+
+        检索完成后先产出 ("sources", 来源列表)，再逐段产出 ("token", 文本)，
+        最后产出 ("done", {"cached": ..., "prompt_tokens": ...})。检索在线程池中执行，不阻塞事件循环；
+        llm调用与aquery_documents共用并发上限。
+        """
+        result, context, embedding, scope = await asyncio.to_thread(
+            self._prepare_query, query, k, filters)
+        if result is not None:
+            yield "sources", result["sources"]
+            yield "token", result["answer"]
+            yield "done", {"cached": result.get("cached", False), "prompt_tokens": 0}
+            return
+
+        # 来源的文件名、页码查询文档库，在线程池中进行
+        sources = await asyncio.to_thread(self._format_sources, context.documents)
+        yield "sources", sources
+
+        chain = await asyncio.to_thread(self._build_chain)
+        parts = []
+        async with self._llm_slot():
+            async with aclosing(self._generate(chain, self._chain_inputs(query, context))) as tokens:
+                async for token in tokens:
+                    parts.append(token)
+                    yield "token", token
+
+        # 完整生成后才写入缓存，客户端中途断开时不缓存残缺回答
+        result = await asyncio.to_thread(self._finish_query, query, "".join(parts), context, embedding, scope,
+                                         sources)
+        yield "done", {"cached": False, "prompt_tokens": result["prompt_tokens"]}
@@ -0,0 +1,153 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from embedding_cache import normalize_text
+from config import (
+    RERANKER_BACKEND, RERANKER_MODEL_NAME, RERANK_BATCH_SIZE, RERANK_CACHE_MAX_ENTRIES
+)
+
+# 统计重排耗时分位数时保留的最近样本数
+LATENCY_SAMPLES = 1000
+
+
+class CrossEncoderScorer:
+    """CPU上运行的cross-encoder（sentence-transformers CrossEncoder），对 (问题, 文本块) 打相关性分"""
+
+    def __init__(self, model_name: str = RERANKER_MODEL_NAME, max_length: int = 512):
+        from sentence_transformers import CrossEncoder
+        self.model_id = model_name
+        self.model = CrossEncoder(model_name, device="cpu", max_length=max_length)
+
+    def score(self, pairs: List[Tuple[str, str]], batch_size: int) -> List[float]:
+        scores = self.model.predict(pairs, batch_size=batch_size, show_progress_bar=False)
+        return [float(score) for score in scores]
+
+
+class OverlapScorer:
+    """确定性的本地替身模型：按问题与文本块的字二元组重合比例打分
+
+    不依赖torch和模型文件，供测试和无模型环境使用。
+    """
+
+    model_id = "overlap"
+
+    @staticmethod
+    def _bigrams(text: str) -> set:
+        text = normalize_text(text)
+        return {text[i:i + 2] for i in range(len(text) - 1)} or set(text)
+
+    def score(self, pairs: List[Tuple[str, str]], batch_size: int) -> List[float]:
+        scores = []
+        for query, text in pairs:
+            query_grams = self._bigrams(query)
+            scores.append(len(query_grams & self._bigrams(text)) / len(query_grams) if query_grams else 0.0)
+        return scores
+
+
+class Reranker:
+    """重排阶段：对检索到的候选块按批打分，保留得分最高的k块
+
+    (问题, 文本块) 的得分按内容哈希缓存（LRU），重复的问题和热门文本块不再重新计算；
+    单独记录每次重排的耗时，便于按p95调整候选数。
+    """
+
+    def __init__(self, scorer, batch_size: int = RERANK_BATCH_SIZE,
+                 cache_max_entries: int = RERANK_CACHE_MAX_ENTRIES):
+        self.scorer = scorer
+        self.batch_size = batch_size
+        self.cache_max_entries = cache_max_entries
+
+        self._cache: "OrderedDict[str, float]" = OrderedDict()
+        # 缓存和下面的统计计数共用一把锁（重排在多个线程中并发进行）
+        self._cache_lock = threading.Lock()
+        # 多个请求同时打分会互相抢占CPU，模型调用串行进行
+        self._model_lock = threading.Lock()
+
+        self.calls = 0
+        self.pairs_scored = 0
+        self.cache_hits = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    def _key(self, query: str, text: str) -> str:
+        digest = hashlib.sha256(f"{normalize_text(query)}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+        return f"{self.scorer.model_id}:{digest}"
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        """为每个文本块打分，已缓存的直接取用，其余按batch_size分批送入模型"""
+        keys = [self._key(query, text) for text in texts]
+        scores: List[Optional[float]] = [None] * len(texts)
+        with self._cache_lock:
+            for i, key in enumerate(keys):
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    scores[i] = self._cache[key]
+            missing = [i for i, score in enumerate(scores) if score is None]
+            self.cache_hits += len(texts) - len(missing)
+
+        if missing:
+            with self._model_lock:
+                computed = self.scorer.score([(query, texts[i]) for i in missing], self.batch_size)
+            with self._cache_lock:
+                self.pairs_scored += len(missing)
+                for i, score in zip(missing, computed):
+                    scores[i] = score
+                    self._cache[keys[i]] = score
+                while len(self._cache) > self.cache_max_entries:
+                    self._cache.popitem(last=False)
+        return scores
+
+    def rerank(self, query: str, documents: List[Document], k: int) -> Tuple[List[Document], float]:
+        """返回 (得分最高的k块, 重排耗时秒数)"""
+        start = time.perf_counter()
+        scores = self.score(query, [document.page_content for document in documents])
+        ranked = sorted(zip(documents, scores), key=lambda item: item[1], reverse=True)[:k]
+        elapsed = time.perf_counter() - start
+
+        with self._cache_lock:
+            self.calls += 1
+            self.latencies.append(elapsed)
+        for document, score in ranked:
+            document.metadata["rerank_score"] = score
+        return [document for document, _ in ranked], elapsed
+
+    def stats(self) -> Dict[str, Any]:
+        """重排调用次数、缓存命中和耗时分位数（毫秒）"""
+        with self._cache_lock:
+            latencies = sorted(self.latencies)
+            calls, pairs_scored, cache_hits = self.calls, self.pairs_scored, self.cache_hits
+            cache_entries = len(self._cache)
+
+        def percentile(p: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+
+        total = pairs_scored + cache_hits
+        return {
+            "model": self.scorer.model_id,
+            "batch_size": self.batch_size,
+            "calls": calls,
+            "pairs_scored": pairs_scored,
+            "cache_hits": cache_hits,
+            "cache_hit_rate": cache_hits / total if total else 0.0,
+            "cache_entries": cache_entries,
+            "latency_p50_ms": percentile(0.5),
+            "latency_p95_ms": percentile(0.95)
+        }
+
+
+def build_reranker(backend: str = RERANKER_BACKEND) -> Optional[Reranker]:
+    """按配置构建重排器，未启用时返回None"""
+    if backend == "none":
+        return None
+    if backend == "overlap":
+        return Reranker(OverlapScorer())
+    if backend == "cross-encoder":
+        print(f"重排模型 {RERANKER_MODEL_NAME} 运行于 cpu，batch_size={RERANK_BATCH_SIZE}")
+        return Reranker(CrossEncoderScorer())
+    raise ValueError(f"不支持的重排后端: {backend}")
@@ -0,0 +1,128 @@
+import copy
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from config import SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_TTL, SEMANTIC_CACHE_MAX_ENTRIES
+
+
+def make_scope(**params) -> str:
+    """把影响答案的检索参数（k、过滤条件等）序列化成缓存作用域，只有作用域相同的问题才会互相命中"""
+    return json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+
+
+class SemanticAnswerCache:
+    """问答语义缓存
+
+    问题向量与已缓存问题的余弦相似度超过阈值时直接返回之前的回答。
+    条目按TTL过期、超出容量时按LRU淘汰；被引用的文档重新上传或删除时相关条目失效。
+    所有问题向量存放在一个预分配的矩阵中，查找只需一次矩阵乘法。
+    """
+
+    def __init__(self, threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 ttl: float = SEMANTIC_CACHE_TTL,
+                 max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._matrix: Optional[np.ndarray] = None
+        self._free_slots: List[int] = list(range(max_entries - 1, -1, -1))
+        # slot → 条目，按最近使用排序（最旧的在前）
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, embedding: List[float], scope: str) -> Optional[Dict[str, Any]]:
+        """查找语义相近的已缓存回答，未命中返回None"""
+        with self._lock:
+            if self._matrix is None or not self._entries:
+                self.misses += 1
+                return None
+
+            scores = self._matrix @ self._normalize(embedding)
+            now = time.time()
+            for slot in np.argsort(-scores):
+                if scores[slot] < self.threshold:
+                    break
+                entry = self._entries.get(int(slot))
+                if entry is None or entry["scope"] != scope:
+                    continue
+                if now - entry["created"] > self.ttl:
+                    self._remove(int(slot))
+                    continue
+                self._entries.move_to_end(int(slot))
+                self.hits += 1
+                return copy.deepcopy(entry["response"])
+
+            self.misses += 1
+            return None
+
+    def store(self, query: str, embedding: List[float], response: Dict[str, Any], scope: str):
+        """缓存一次回答，记录其引用的文档以便失效"""
+        vector = self._normalize(embedding)
+        document_ids = {source.get("document_id") for source in response.get("sources", [])}
+        with self._lock:
+            if self._matrix is None:
+                self._matrix = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+            if not self._free_slots:
+                # 淘汰最久未使用的条目
+                self._remove(next(iter(self._entries)))
+
+            slot = self._free_slots.pop()
+            self._matrix[slot] = vector
+            self._entries[slot] = {
+                "query": query,
+                "scope": scope,
+                "response": copy.deepcopy(response),
+                "document_ids": document_ids,
+                "created": time.time()
+            }
+
+    def _remove(self, slot: int):
+        self._entries.pop(slot, None)
+        self._matrix[slot] = 0.0
+        self._free_slots.append(slot)
+
+    def invalidate_documents(self, document_ids: Iterable[str]) -> int:
+        """使引用了这些文档的缓存条目失效，返回失效条数"""
+        document_ids = set(document_ids)
+        with self._lock:
+            stale = [slot for slot, entry in self._entries.items() if entry["document_ids"] & document_ids]
+            for slot in stale:
+                self._remove(slot)
+            self.invalidations += len(stale)
+            return len(stale)
+
+    def clear(self):
+        with self._lock:
+            for slot in list(self._entries):
+                self._remove(slot)
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存命中统计"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "invalidations": self.invalidations,
+                "threshold": self.threshold,
+                "ttl": self.ttl
+            }
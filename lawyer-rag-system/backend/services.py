@@ -0,0 +1,107 @@
+import threading
+import time
+from typing import IO, Dict, Any, List, Optional
+
+import file_lock
+from ingest_queue import IngestionQueue
+from sql_file import DocumentManager
+from timing import timed, format_timings
+
+# 进程启动（本模块被导入）的时间，用于计算就绪耗时
+_PROCESS_STARTED = time.perf_counter()
+
+
+class ServiceRegistry:
+    """在后台线程中加载重量级组件（embedding模型、LLM、向量库），记录启动各阶段耗时
+
+    加载完成前API进程已可响应健康检查和不依赖模型的接口。
+    """
+
+    def __init__(self, document_manager: DocumentManager):
+        self.document_manager = document_manager
+        self.rag_service = None
+        self.ingest_queue: Optional[IngestionQueue] = None
+
+        # 多个worker部署时只有取得该文件锁的worker执行启动对账和元数据补齐（进程退出时释放）
+        self._leader_lock: Optional[IO] = None
+
+        self.ready = threading.Event()
+        self.error: Optional[str] = None
+        self.timings: Dict[str, float] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """启动后台加载线程"""
+        self._thread = threading.Thread(target=self._load, name="service-loader", daemon=True)
+        self._thread.start()
+
+    def _load(self):
+        try:
+            # langchain/chroma/torch的导入本身就很耗时，放在后台线程中进行
+            with timed(self.timings, "import"):
+                from rag_service import SimpleRAGService
+
+            with timed(self.timings, "rag_service"):
+                rag_service = SimpleRAGService(document_manager=self.document_manager)
+
+            self.rag_service = rag_service
+            self.ingest_queue = IngestionQueue(rag_service, self.document_manager)
+            # 就绪之前记下待对账的文档：就绪后新上传的文档已由上传接口提交处理，对账不再重复提交
+            documents = self.document_manager.get_indexable_documents()
+            self.timings["ready_after"] = time.perf_counter() - _PROCESS_STARTED
+            self.ready.set()
+            print(f"✅ 服务加载完成：{format_timings(self.timings)}")
+
+            # 关键词索引在就绪之后加载（有快照时只需内存映射并应用之后的语料变更），加载完成前只做语义检索
+            with timed(self.timings, "keyword_index"):
+                self.load_keyword_index()
+
+            self._leader_lock = file_lock.try_acquire("reconcile")
+            if self._leader_lock is None:
+                print("向量库对账由其他worker负责，本进程跳过")
+                return
+            with timed(self.timings, "reconcile"):
+                self.reconcile_index(documents)
+
+        except Exception as e:
+            self.error = str(e)
+            print(f"❌ 服务加载失败: {e}")
+
+    def load_keyword_index(self):
+        """加载关键词索引，失败时问答只使用语义检索"""
+        try:
+            self.rag_service.load_keyword_index()
+        except Exception as e:
+            print(f"关键词索引加载失败: {e}")
+
+    def reconcile_index(self, documents: List[Dict[str, Any]] = None):
+        """校验文档库与向量库是否一致，只重新向量化缺失的文档（documents为就绪前记下的文档列表）"""
+        try:
+            self.rag_service.backfill_filter_metadata()
+            report = self.rag_service.reconcile_index(self.document_manager, documents)
+            for document in report["missing"]:
+                self.ingest_queue.resubmit(document)
+        except Exception as e:
+            print(f"向量库对账失败: {e}")
+
+    def status(self) -> Dict[str, Any]:
+        """就绪状态及启动耗时"""
+        return {
+            "ready": self.ready.is_set(),
+            "error": self.error,
+            "keyword_index_ready": self.rag_service is not None and self.rag_service.keyword_index is not None,
+            "startup_timings": dict(self.timings)
+        }
+
+    def shutdown(self):
+        # 只等待正在处理的文档；排队中的文档保持processing状态，下次启动时由对账重新入库，
+        # 积压较多时也不会拖到进程管理器强制结束而来不及保存下面的快照
+        if self.ingest_queue is not None:
+            cancelled = self.ingest_queue.shutdown(wait=True, cancel_pending=True)
+            if cancelled:
+                print(f"{cancelled} 个排队中的文档未开始入库，下次启动时重新入库")
+        # 保存关键词索引快照，下次启动只需应用之后的语料变更
+        if self.rag_service is not None:
+            self.rag_service.save_keyword_index()
+        if self._leader_lock is not None:
+            self._leader_lock.close()
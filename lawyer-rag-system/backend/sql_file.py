@@ -1,12 +1,30 @@
-import sqlite3
+import asyncio
+import functools
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Tuple
 import json
 from pathlib import Path
 
+from db_pool import SQLitePool
+from query_filters import QueryFilters
+from metrics import SQLITE_SECONDS
+from config import SQLITE_POOL_SIZE
+
 class DocumentManager:
 
+    # 在旧版数据库上需要补齐的列
+    EXTRA_COLUMNS = {
+        "file_path": "TEXT",
+        "error": "TEXT",
+        "content_hash": "TEXT",
+        "file_size": "INTEGER",
+        "chunk_count": "INTEGER",
+        "canonical_id": "TEXT",
+        "timings": "TEXT",
+    }
+
     def __init__(self, db_path: str = None):
         """初始化文档管理器"""
         if db_path is None:
@@ -17,11 +35,14 @@ class DocumentManager:
         self.db_path = db_path
         os.makedirs(self.db_path.parent, exist_ok=True)
 
+        # 线程本地连接（WAL、busy_timeout），各方法不再每次新建连接
+        self.pool = SQLitePool(self.db_path)
+
         self.init_database()
 
     def init_database(self):
         """初始化数据库表"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self.pool.connect() as conn:
             cursor = conn.cursor()
             
             # 创建文档表
@@ -31,10 +52,76 @@ class DocumentManager:
                     filename TEXT,
                     category TEXT,
                     upload_time TEXT,
-                    status TEXT
+                    status TEXT,
+                    file_path TEXT,
+                    error TEXT,
+                    content_hash TEXT,
+                    file_size INTEGER,
+                    chunk_count INTEGER,
+                    canonical_id TEXT,
+                    timings TEXT
                 );
             ''')
+
+            # 旧数据库升级：补齐缺失的列
+            cursor.execute("PRAGMA table_info(documents)")
+            existing_columns = {row[1] for row in cursor.fetchall()}
+            for column, column_type in self.EXTRA_COLUMNS.items():
+                if column not in existing_columns:
+                    cursor.execute(f"ALTER TABLE documents ADD COLUMN {column} {column_type}")
             
+            # 创建条文表：(文档, 章, 条) → 原文，用于“第X章第X条”的直接查找
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS articles (
+                    document_id TEXT,
+                    part INTEGER,
+                    chapter INTEGER,
+                    section INTEGER,
+                    article INTEGER,
+                    page INTEGER,
+                    text TEXT
+                );
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_articles_lookup ON articles(article, chapter)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_articles_document ON articles(document_id)
+            ''')
+
+            # 创建文本块表：(文档, 块序号) → 页码、页内字符偏移、文本哈希，与向量库中的块一一对应
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS chunks (
+                    document_id TEXT,
+                    chunk_index INTEGER,
+                    page INTEGER,
+                    start_offset INTEGER,
+                    end_offset INTEGER,
+                    text_hash TEXT,
+                    PRIMARY KEY (document_id, chunk_index)
+                );
+            ''')
+
+            # 创建页面文本表：(文档, 页序号) → 压缩后的页面文本，用于文档预览
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS pages (
+                    document_id TEXT,
+                    page INTEGER,
+                    text BLOB,
+                    PRIMARY KEY (document_id, page)
+                );
+            ''')
+
+            # 创建语料变更日志：每次写入、删除或转交向量库中的块后记下受影响的文档，
+            # 关键词索引据此从快照追上向量库的最新状态（seq单调递增，不复用）
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS corpus_log (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    document_id TEXT,
+                    created TEXT
+                );
+            ''')
+
             # 创建索引以提高查询性能
             cursor.execute('''
                 CREATE INDEX IF NOT EXISTS idx_category ON documents(category)
@@ -45,6 +132,23 @@ class DocumentManager:
             cursor.execute('''
                 CREATE INDEX IF NOT EXISTS idx_upload_time ON documents(upload_time)
             ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_content_hash ON documents(content_hash)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_canonical_id ON documents(canonical_id)
+            ''')
+
+            # 文档列表按 (upload_time, document_id) 键集分页，带类别/状态筛选时走对应的复合索引
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_listing ON documents(upload_time, document_id)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_listing_category ON documents(category, upload_time, document_id)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_listing_status ON documents(status, upload_time, document_id)
+            ''')
             
             conn.commit()
     
@@ -52,18 +156,40 @@ class DocumentManager:
                         filename: str, 
                         category: str = "general", 
                         upload_time: str = None, 
-                        status: str = None) -> bool:
-        """保存文档信息到数据库"""
+                        status: str = None,
+                        file_path: str = None,
+                        error: str = None,
+                        content_hash: str = None,
+                        file_size: int = None,
+                        chunk_count: int = None,
+                        canonical_id: str = None,
+                        timings: Dict[str, float] = None) -> bool:
+        """保存文档信息到数据库（已存在时保留首次上传时间和文件路径）"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.pool.connect() as conn:
                 cursor = conn.cursor()
 
                 cursor.execute('''
-                    INSERT OR REPLACE INTO documents 
-                    (document_id, filename, category, upload_time, status)
-                    VALUES (?, ?, ?, ?, ?)
+                    INSERT INTO documents 
+                    (document_id, filename, category, upload_time, status, file_path, error,
+                     content_hash, file_size, chunk_count, canonical_id, timings)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(document_id) DO UPDATE SET
+                        filename = excluded.filename,
+                        category = excluded.category,
+                        upload_time = COALESCE(documents.upload_time, excluded.upload_time),
+                        status = COALESCE(excluded.status, documents.status),
+                        file_path = COALESCE(excluded.file_path, documents.file_path),
+                        error = excluded.error,
+                        content_hash = COALESCE(excluded.content_hash, documents.content_hash),
+                        file_size = COALESCE(excluded.file_size, documents.file_size),
+                        chunk_count = COALESCE(excluded.chunk_count, documents.chunk_count),
+                        canonical_id = COALESCE(excluded.canonical_id, documents.canonical_id),
+                        timings = COALESCE(excluded.timings, documents.timings)
                 ''', (
-                    document_id, filename, category, upload_time, status
+                    document_id, filename, category, upload_time, status, file_path, error,
+                    content_hash, file_size, chunk_count, canonical_id,
+                    json.dumps(timings) if timings is not None else None
                 ))
                 
                 conn.commit()
@@ -72,12 +198,299 @@ class DocumentManager:
         except Exception as e:
             print(f"保存文档信息时出错: {e}")
             return False
-    
+
+    def update_status(self, document_id: str, status: str, error: str = None) -> bool:
+        """更新文档处理状态（同时更新关联到该文档的重复上传记录）"""
+        try:
+            with self.pool.connect() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute('''
+                    UPDATE documents SET status = ?, error = ?
+                    WHERE document_id = ? OR canonical_id = ?
+                ''', (status, error, document_id, document_id))
+
+                conn.commit()
+                return cursor.rowcount > 0
+
+        except Exception as e:
+            print(f"更新文档状态时出错: {e}")
+            return False
+
+    def claim_document(self, document_id: str, expected_status: str) -> bool:
+        """仅当文档仍处于expected_status时把它标记为processing，返回是否成功
+
+        用于重新提交对账发现的文档：期间文档可能已被其他worker处理完或删除，此时不再提交。
+        """
+        try:
+            with self.pool.connect() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute('''
+                    UPDATE documents SET status = 'processing', error = NULL
+                    WHERE document_id = ? AND status = ?
+                ''', (document_id, expected_status))
+
+                conn.commit()
+                return cursor.rowcount > 0
+
+        except Exception as e:
+            print(f"更新文档状态时出错: {e}")
+            return False
+
+    def find_by_content_hash(self, content_hash: str) -> Optional[Dict]:
+        """按文件内容哈希查找已入库（或正在入库）的原始文档"""
+        try:
+            with self.pool.connect() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute('''
+                    SELECT * FROM documents
+                    WHERE content_hash = ? AND canonical_id IS NULL
+                      AND status IN ('processing', 'completed')
+                    ORDER BY upload_time ASC LIMIT 1
+                ''', (content_hash,))
+
+                row = cursor.fetchone()
+                return dict(row) if row else None
+
+        except Exception as e:
+            print(f"按内容哈希查询文档时出错: {e}")
+            return None
+
+    def link_duplicate(self, document_id: str, filename: str, category: str,
+                       canonical: Dict, file_size: int = None) -> bool:
+        """登记一次重复上传：复用原始文档的文件和向量，不再重新向量化"""
+        return self.save_document(
+            document_id=document_id,
+            filename=filename,
+            category=category,
+            upload_time=datetime.now().isoformat(),
+            status=canonical['status'],
+            file_path=canonical['file_path'],
+            content_hash=canonical['content_hash'],
+            file_size=file_size,
+            chunk_count=0,
+            canonical_id=canonical['document_id']
+        )
+
+    def get_indexable_documents(self) -> List[Dict]:
+        """获取应当在向量库中有向量的文档（已完成或处理中的原始文档，不含重复上传）"""
+        try:
+            with self.pool.connect() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute('''
+                    SELECT document_id, filename, category, status, file_path FROM documents
+                    WHERE canonical_id IS NULL AND status IN ('processing', 'completed')
+                ''')
+                return [dict(row) for row in cursor.fetchall()]
+
+        except Exception as e:
+            print(f"获取待对账文档时出错: {e}")
+            return []
+
+    def save_articles(self, document_id: str, articles: List[Dict]) -> bool:
+        """在一个事务中写入文档的全部条文（先清除旧的）"""
+        try:
+            with self.pool.connect() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute("DELETE FROM articles WHERE document_id = ?", (document_id,))
+                cursor.executemany('''
+                    INSERT INTO articles (document_id, part, chapter, section, article, page, text)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', [
+                    (document_id, a.get("part"), a.get("chapter"), a.get("section"),
+                     a["article"], a.get("page"), a["text"])
+                    for a in articles
+                ])
+
+                conn.commit()
+                return True
+
+        except Exception as e:
+            print(f"保存条文索引时出错: {e}")
+            return False
+
+    def save_chunks(self, document_id: str, chunks: List[Dict]) -> bool:
+        """在一个事务中写入文档的全部文本块信息（先清除旧的）"""
+        try:
+            with self.pool.connect() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute("DELETE FROM chunks WHERE document_id = ?", (document_id,))
+                cursor.executemany('''
+                    INSERT INTO chunks (document_id, chunk_index, page, start_offset, end_offset, text_hash)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', [
+                    (document_id, c["chunk_index"], c.get("page"), c.get("start_offset"),
+                     c.get("end_offset"), c.get("text_hash"))
+                    for c in chunks
+                ])
+
+                conn.commit()
+                return True
+
+        except Exception as e:
+            print(f"保存文本块信息时出错: {e}")
+            return False
+
+    def get_chunks(self, keys: List[Tuple[str, int]]) -> Dict[Tuple[str, int], Dict]:
+        """按 (文档, 块序号) 批量查询文本块信息及所属文档的文件名、类别（一次主键查询）"""
+        if not keys:
+            return {}
+        try:
+            with self.pool.connect() as conn:
+                cursor = conn.cursor()
+
+                # 以常量表驱动连接，每个键走一次主键查找（row-value IN 写法会全表扫描chunks）
+                cursor.execute(f'''
+                    WITH wanted(document_id, chunk_index) AS (VALUES {', '.join(['(?, ?)'] * len(keys))})
+                    SELECT c.document_id, c.chunk_index, c.page, c.start_offset, c.end_offset,
+                           c.text_hash, d.filename, d.category
+                    FROM wanted w
+                    JOIN chunks c ON c.document_id = w.document_id AND c.chunk_index = w.chunk_index
+                    JOIN documents d ON c.document_id = d.document_id
+                ''', [value for key in keys for value in key])
+                return {(row["document_id"], row["chunk_index"]): dict(row) for row in cursor.fetchall()}
+
+        except Exception as e:
+            print(f"查询文本块信息时出错: {e}")
+            return {}
+
+    def save_pages(self, document_id: str, pages: List[Tuple[int, bytes]]) -> bool:
+        """在一个事务中写入文档的全部页面文本（先清除旧的）"""
+        try:
+            with self.pool.connect() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute("DELETE FROM pages WHERE document_id = ?", (document_id,))
+                cursor.executemany(
+                    "INSERT INTO pages (document_id, page, text) VALUES (?, ?, ?)",
+                    [(document_id, page, text) for page, text in pages]
+                )
+
+                conn.commit()
+                return True
+
+        except Exception as e:
+            print(f"保存页面文本时出错: {e}")
+            return False
+
+    def get_pages(self, document_id: str, start: int, end: int) -> List[Tuple[int, bytes]]:
+        """读取 [start, end) 范围内的页面文本（主键范围查询）"""
+        with self.pool.connect() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                SELECT page, text FROM pages
+                WHERE document_id = ? AND page >= ? AND page < ?
+                ORDER BY page
+            ''', (document_id, start, end))
+            return [(row[0], row[1]) for row in cursor.fetchall()]
+
+    def count_pages(self, document_id: str) -> int:
+        """文档已保存的页数"""
+        with self.pool.connect() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute("SELECT COUNT(*) FROM pages WHERE document_id = ?", (document_id,))
+            return cursor.fetchone()[0]
+
+    def find_articles(self, article: int, chapter: int = None, limit: int = 5,
+                      filters: QueryFilters = None) -> List[Dict]:
+        """按 (章, 条) 查找已入库文档中的条文原文，章号不匹配时退回只按条号查找"""
+        try:
+            with self.pool.connect() as conn:
+                cursor = conn.cursor()
+
+                query = '''
+                    SELECT a.document_id, a.chapter, a.article, a.page, a.text, d.filename, d.category
+                    FROM articles a JOIN documents d ON a.document_id = d.document_id
+                    WHERE a.article = ? AND d.status = 'completed'
+                '''
+                params = [article]
+                if filters is not None:
+                    conditions, filter_params = filters.sql_conditions("d")
+                    query += "".join(f" AND {condition}" for condition in conditions)
+                    params.extend(filter_params)
+
+                rows = []
+                if chapter is not None:
+                    cursor.execute(query + " AND a.chapter = ? LIMIT ?", (*params, chapter, limit))
+                    rows = cursor.fetchall()
+                if not rows:
+                    cursor.execute(query + " LIMIT ?", (*params, limit))
+                    rows = cursor.fetchall()
+                return [dict(row) for row in rows]
+
+        except Exception as e:
+            print(f"查找条文时出错: {e}")
+            return []
+
+    def find_document_ids(self, filters: QueryFilters) -> List[str]:
+        """按过滤条件查找持有向量的原始文档ID（走category、upload_time索引）"""
+        try:
+            with self.pool.connect() as conn:
+                cursor = conn.cursor()
+
+                conditions, params = filters.sql_conditions()
+                query = "SELECT document_id FROM documents WHERE canonical_id IS NULL"
+                query += "".join(f" AND {condition}" for condition in conditions)
+                cursor.execute(query, params)
+                return [row[0] for row in cursor.fetchall()]
+
+        except Exception as e:
+            print(f"按条件查找文档时出错: {e}")
+            return []
+
+    def resolve_canonical_ids(self, document_ids: List[str]) -> List[str]:
+        """把重复上传的文档ID换成其原始文档ID（向量归属于原始文档）"""
+        try:
+            with self.pool.connect() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute(f'''
+                    SELECT document_id, canonical_id FROM documents
+                    WHERE document_id IN ({', '.join('?' * len(document_ids))})
+                ''', document_ids)
+                canonical = {document_id: canonical_id for document_id, canonical_id in cursor.fetchall()}
+                return sorted({canonical.get(document_id) or document_id for document_id in document_ids})
+
+        except Exception as e:
+            print(f"解析原始文档ID时出错: {e}")
+            return list(document_ids)
+
+    def get_dedup_stats(self) -> Dict:
+        """统计内容去重节省的向量和存储空间"""
+        try:
+            with self.pool.connect() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute('''
+                    SELECT COUNT(*),
+                           COALESCE(SUM(c.chunk_count), 0),
+                           COALESCE(SUM(d.file_size), 0)
+                    FROM documents d
+                    JOIN documents c ON d.canonical_id = c.document_id
+                ''')
+                duplicates, embeddings_saved, bytes_saved = cursor.fetchone()
+
+                return {
+                    "duplicate_documents": duplicates,
+                    "embeddings_saved": embeddings_saved,
+                    "bytes_saved": bytes_saved
+                }
+
+        except Exception as e:
+            print(f"统计去重信息时出错: {e}")
+            return {"duplicate_documents": 0, "embeddings_saved": 0, "bytes_saved": 0}
+
     def get_document(self, document_id: str) -> Optional[Dict]:
         """获取单个文档信息"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row  # 使结果可以通过列名访问
+            with self.pool.connect() as conn:
                 cursor = conn.cursor()
                 
                 cursor.execute('''
@@ -87,9 +500,9 @@ class DocumentManager:
                 row = cursor.fetchone()
                 if row:
                     doc = dict(row)
-                    # 解析 metadata JSON
-                    if doc['metadata']:
-                        doc['metadata'] = json.loads(doc['metadata'])
+                    # 解析各阶段耗时 JSON
+                    if doc.get('timings'):
+                        doc['timings'] = json.loads(doc['timings'])
                     return doc
                 return None
                 
@@ -100,8 +513,7 @@ class DocumentManager:
     def get_all_documents(self, category: str = None, status: str = None) -> List[Dict]:
         """获取所有文档信息"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
+            with self.pool.connect() as conn:
                 cursor = conn.cursor()
                 
                 # 构建查询条件
@@ -143,23 +555,223 @@ class DocumentManager:
             print(f"获取文档列表时出错: {e}")
             return []
     
+    def list_documents(self, limit: int, after: Tuple[str, str] = None, category: str = None,
+                       status: str = None) -> Tuple[List[Dict], Optional[Tuple[str, str]]]:
+        """分页获取文档列表（按上传时间降序）
+
+        按 (upload_time, document_id) 键集分页：after为上一页最后一条的键，
+        每页只读取limit+1行索引，与翻到第几页无关。返回 (本页文档, 下一页的键或None)。
+        """
+        with self.pool.connect() as conn:
+            cursor = conn.cursor()
+
+            query = "SELECT document_id, filename, category, upload_time, status FROM documents"
+            conditions = []
+            params = []
+
+            if category:
+                conditions.append("category = ?")
+                params.append(category)
+
+            if status:
+                conditions.append("status = ?")
+                params.append(status)
+
+            if after is not None:
+                conditions.append("(upload_time, document_id) < (?, ?)")
+                params.extend(after)
+
+            if conditions:
+                query += " WHERE " + " AND ".join(conditions)
+
+            query += " ORDER BY upload_time DESC, document_id DESC LIMIT ?"
+            params.append(limit + 1)
+
+            cursor.execute(query, params)
+            documents = [dict(row) for row in cursor.fetchall()]
+
+            next_key = None
+            if len(documents) > limit:
+                documents = documents[:limit]
+                next_key = (documents[-1]['upload_time'], documents[-1]['document_id'])
+            return documents, next_key
+
+    def count_documents(self, category: str = None, status: str = None) -> int:
+        """按筛选条件统计文档数（只扫描索引）"""
+        with self.pool.connect() as conn:
+            cursor = conn.cursor()
+
+            query = "SELECT COUNT(*) FROM documents"
+            conditions = []
+            params = []
+
+            if category:
+                conditions.append("category = ?")
+                params.append(category)
+
+            if status:
+                conditions.append("status = ?")
+                params.append(status)
+
+            if conditions:
+                query += " WHERE " + " AND ".join(conditions)
+
+            cursor.execute(query, params)
+            return cursor.fetchone()[0]
+
     def delete_document(self, document_id: str) -> bool:
         """删除文档记录"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.pool.connect() as conn:
                 cursor = conn.cursor()
                 
                 cursor.execute('''
                     DELETE FROM documents WHERE document_id = ?
                 ''', (document_id,))
+                deleted = cursor.rowcount > 0
+                cursor.execute("DELETE FROM articles WHERE document_id = ?", (document_id,))
+                cursor.execute("DELETE FROM chunks WHERE document_id = ?", (document_id,))
+                cursor.execute("DELETE FROM pages WHERE document_id = ?", (document_id,))
                 
                 conn.commit()
-                return cursor.rowcount > 0
+                return deleted
                 
         except Exception as e:
             print(f"删除文档记录时出错: {e}")
             return False
     
+    def get_aliases(self, document_id: str) -> List[Dict]:
+        """获取关联到某个原始文档的重复上传记录（按上传时间升序）"""
+        try:
+            with self.pool.connect() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute('''
+                    SELECT * FROM documents WHERE canonical_id = ? ORDER BY upload_time ASC
+                ''', (document_id,))
+                return [dict(row) for row in cursor.fetchall()]
+
+        except Exception as e:
+            print(f"获取重复上传记录时出错: {e}")
+            return []
+
+    def promote_alias(self, document_id: str, heir_id: str) -> bool:
+        """原始文档删除前，把向量和文件的归属转交给一条重复上传记录"""
+        try:
+            with self.pool.connect() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute('''
+                    UPDATE documents SET canonical_id = NULL,
+                        chunk_count = (SELECT chunk_count FROM documents WHERE document_id = ?)
+                    WHERE document_id = ?
+                ''', (document_id, heir_id))
+                cursor.execute('''
+                    UPDATE documents SET canonical_id = ? WHERE canonical_id = ?
+                ''', (heir_id, document_id))
+                cursor.execute('''
+                    UPDATE articles SET document_id = ? WHERE document_id = ?
+                ''', (heir_id, document_id))
+                cursor.execute('''
+                    UPDATE chunks SET document_id = ? WHERE document_id = ?
+                ''', (heir_id, document_id))
+                cursor.execute('''
+                    UPDATE pages SET document_id = ? WHERE document_id = ?
+                ''', (heir_id, document_id))
+
+                conn.commit()
+                return True
+
+        except Exception as e:
+            print(f"转交文档归属时出错: {e}")
+            return False
+
+    def log_corpus_change(self, document_ids: List[str]) -> int:
+        """记录这些文档在向量库中的块已改变，返回最后一条的序号
+
+        出错时直接抛出异常：漏记的变更会让关键词索引与向量库不一致。
+        """
+        with self.pool.connect() as conn:
+            cursor = conn.cursor()
+
+            created = datetime.now().isoformat()
+            seq = 0
+            for document_id in document_ids:
+                cursor.execute('''
+                    INSERT INTO corpus_log (document_id, created) VALUES (?, ?)
+                ''', (document_id, created))
+                seq = cursor.lastrowid
+
+            conn.commit()
+            return seq
+
+    def get_corpus_changes(self, after_seq: int, limit: int = 1000) -> List[Tuple[int, str]]:
+        """序号大于after_seq的语料变更 (seq, document_id)，按序号升序，出错时直接抛出异常"""
+        with self.pool.connect() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                SELECT seq, document_id FROM corpus_log WHERE seq > ? ORDER BY seq LIMIT ?
+            ''', (after_seq, limit))
+            return [(row[0], row[1]) for row in cursor.fetchall()]
+
+    def corpus_version(self) -> Tuple[int, int]:
+        """语料变更日志的 (最早保留的序号, 最新序号)，出错时直接抛出异常
+
+        日志被清空时最新序号取自sqlite_sequence（AUTOINCREMENT的序号不会回退）。
+        """
+        with self.pool.connect() as conn:
+            cursor = conn.cursor()
+
+            first, last = cursor.execute("SELECT MIN(seq), MAX(seq) FROM corpus_log").fetchone()
+            if last is None:
+                row = cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'corpus_log'").fetchone()
+                last = row[0] if row else 0
+                first = last + 1
+            return first, last
+
+    def trim_corpus_log(self, keep: int) -> int:
+        """只保留最新的keep条语料变更，返回删除的条数"""
+        try:
+            with self.pool.connect() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute('''
+                    DELETE FROM corpus_log WHERE seq <= (SELECT MAX(seq) FROM corpus_log) - ?
+                ''', (keep,))
+
+                conn.commit()
+                return cursor.rowcount
+
+        except Exception as e:
+            print(f"清理语料变更日志时出错: {e}")
+            return 0
+
+    def get_referenced_files(self) -> set:
+        """所有文档记录引用的文件路径（绝对路径）
+
+        用于清理无主文件，查询出错时直接抛出异常，避免误删文件。
+        """
+        with self.pool.connect() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                SELECT DISTINCT file_path FROM documents WHERE file_path IS NOT NULL
+            ''')
+            return {str(Path(row[0]).resolve()) for row in cursor.fetchall()}
+
+    def vacuum(self):
+        """回收已删除记录占用的空间"""
+        conn = self.pool.connection()
+        conn.commit()
+        conn.execute("VACUUM")
+        # 把WAL写回主库并截断，释放 -wal 文件占用的空间
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        """关闭所有连接"""
+        self.pool.close_all()
+
     def get_documents_by_document_id(self, document_id: str) -> List[Dict]:
         """根据document_id获取文档"""
         return self.get_all_documents(document_id=document_id)
@@ -174,4 +786,34 @@ class DocumentManager:
     
     def get_documents_by_upload_time(self, upload_time: str) -> List[Dict]:
         """根据时间获取文档"""
-        return self.get_all_documents(upload_time=upload_time)
\ No newline at end of file
+        return self.get_all_documents(upload_time=upload_time)
+
+
+class AsyncDocumentManager:
+    """DocumentManager的异步接口，供FastAPI的async接口使用
+
+    方法调用在专用的小线程池中执行，不阻塞事件循环；每个线程复用自己的SQLite连接，
+    连接数因此固定为线程数。每次调用的耗时按方法名记入rag_sqlite_call_seconds。用法与DocumentManager相同，只是需要await：
+    `documents = await async_manager.list_documents(100)`
+    """
+
+    def __init__(self, manager: DocumentManager, max_workers: int = SQLITE_POOL_SIZE):
+        self.manager = manager
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sqlite")
+
+    def __getattr__(self, name):
+        method = getattr(self.manager, name)
+        if not callable(method):
+            return method
+
+        def timed_method(*args, **kwargs):
+            with SQLITE_SECONDS.time(method=name):
+                return method(*args, **kwargs)
+
+        async def call(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(timed_method, *args, **kwargs))
+        return call
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,27 @@
+import gc
+import threading
+
+from db_pool import SQLitePool
+
+
+def test_connections_closed_when_threads_exit(tmp_path):
+    pool = SQLitePool(tmp_path / "pool.db")
+    with pool.connect() as conn:
+        conn.execute("CREATE TABLE t (x INTEGER)")
+
+    def work(i):
+        with pool.connect() as conn:
+            conn.execute("INSERT INTO t VALUES (?)", (i,))
+
+    # 模拟线程池回收空闲线程再新建：每个线程用完即退出
+    for i in range(50):
+        thread = threading.Thread(target=work, args=(i,))
+        thread.start()
+        thread.join()
+    gc.collect()
+
+    # 只剩主线程的连接
+    assert len(pool._connections) == 1
+    assert pool.connection().execute("SELECT COUNT(*) FROM t").fetchone()[0] == 50
+    pool.close_all()
+    assert pool._connections == []
@@ -0,0 +1,30 @@
+from pathlib import Path
+
+import pytest
+
+import document_loader
+
+SAMPLE_PDF = Path(__file__).parent / "data" / "sample.pdf"
+
+
+@pytest.fixture
+def small_page_ranges(monkeypatch):
+    """把页段调小，让样例PDF走并行解析路径；测试结束后关闭解析进程池"""
+    monkeypatch.setattr(document_loader, "PDF_PARSE_WORKERS", 2)
+    monkeypatch.setattr(document_loader, "PDF_PAGES_PER_TASK", 10)
+    yield
+    with document_loader._pool_lock:
+        if document_loader._pool is not None:
+            document_loader._pool.shutdown()
+            document_loader._pool = None
+
+
+def test_parallel_pdf_matches_serial_loader(small_page_ranges):
+    serial = document_loader.load_pdf(str(SAMPLE_PDF), parallel=False)
+    parallel = document_loader.load_pdf(str(SAMPLE_PDF), parallel=True)
+
+    assert len(serial) > document_loader.PDF_PAGES_PER_TASK
+    assert len(parallel) == len(serial)
+    for page, (expected, actual) in enumerate(zip(serial, parallel)):
+        assert actual.page_content == expected.page_content, f"第 {page} 页文本不一致"
+        assert actual.metadata == expected.metadata, f"第 {page} 页元数据不一致"
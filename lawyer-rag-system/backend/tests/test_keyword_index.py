@@ -0,0 +1,117 @@
+import math
+import random
+import threading
+from collections import Counter
+
+import pytest
+
+import keyword_index
+from keyword_index import BM25_B, BM25_K1, KeywordIndex, tokenize
+
+CHARACTERS = [chr(0x4E00 + i) for i in range(200)]
+
+
+def make_text(rng: random.Random, length: int = 60) -> str:
+    # 按1/rank的频率取字，既有出现在几乎所有块中的常见词，也有只出现几次的罕见词
+    return "".join(rng.choices(CHARACTERS, weights=[1 / (i + 1) for i in range(len(CHARACTERS))], k=length))
+
+
+def brute_force(chunks: dict, query: str, k: int, frozen_average: float = None) -> list:
+    """对全部块逐个计算BM25得分（块总数和文档频率包含已删除的块，与索引一致）"""
+    tokenized = {chunk_id: Counter(tokenize(text)) for chunk_id, (text, _) in chunks.items()}
+    live = {chunk_id for chunk_id, (_, deleted) in chunks.items() if not deleted}
+    average = frozen_average or sum(sum(tokenized[chunk_id].values()) for chunk_id in live) / len(live)
+    scores = {}
+    for term in set(tokenize(query)):
+        df = sum(1 for terms in tokenized.values() if term in terms)
+        if not df:
+            continue
+        idf = math.log(1 + (len(chunks) - df + 0.5) / (df + 0.5))
+        for chunk_id in live:
+            tf = tokenized[chunk_id][term]
+            if tf:
+                norm = 1 - BM25_B + BM25_B * sum(tokenized[chunk_id].values()) / average
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * norm)
+    return sorted(scores.values(), reverse=True)[:k]
+
+
+@pytest.fixture(params=["ordered", "max_score"])
+def search_path(request, monkeypatch):
+    """ordered：只按影响分顺序读取直到可以提前结束；max_score：第一轮之后直接改用MaxScore"""
+    monkeypatch.setattr(keyword_index, "INITIAL_DEPTH", 4)
+    monkeypatch.setattr(keyword_index, "ORDERED_READ_RATIO", 2.0 if request.param == "ordered" else 0.0)
+    return request.param
+
+
+def assert_matches(index: KeywordIndex, chunks: dict, queries: list, k: int = 10):
+    average = index.average_length if len(index.base) else None
+    for query in queries:
+        expected = brute_force(chunks, query, k, average)
+        actual = [score for _, score in index.search(query, k)]
+        assert actual == pytest.approx(expected, rel=1e-9), f"查询 {query!r} 的前{k}名得分不一致"
+
+
+def test_search_matches_brute_force(search_path, tmp_path):
+    rng = random.Random(0)
+    chunks = {f"d{i // 10}:{i}": (make_text(rng), False) for i in range(500)}
+    index = KeywordIndex.build(((chunk_id, chunk_id.split(":")[0], text)
+                                for chunk_id, (text, _) in chunks.items()), auto_merge=False)
+    queries = [make_text(rng, rng.randint(2, 20)) for _ in range(30)]
+    assert_matches(index, chunks, queries)
+
+    # 增量段中的新块和已删除的块
+    for i in range(500, 560):
+        text = make_text(rng)
+        chunks[f"d{i // 10}:{i}"] = (text, False)
+        index.add(f"d{i // 10}:{i}", f"d{i // 10}", text)
+    for chunk_id in [chunk_id for chunk_id in chunks if chunk_id.startswith("d3:")]:
+        chunks[chunk_id] = (chunks[chunk_id][0], True)
+    index.remove_document("d3")
+    assert_matches(index, chunks, queries)
+
+    # 快照加载后结果不变；合并后去掉已删除的块，平均块长度重新确定
+    index.save(tmp_path / "keyword_index.bin")
+    loaded = KeywordIndex.load(tmp_path / "keyword_index.bin", auto_merge=False)
+    assert [loaded.search(query, 10) for query in queries] == [index.search(query, 10) for query in queries]
+    loaded.merge()
+    chunks = {chunk_id: value for chunk_id, value in chunks.items() if not value[1]}
+    assert len(loaded.delta) == 0 and len(loaded) == len(chunks)
+    assert_matches(loaded, chunks, queries)
+
+
+def test_concurrent_search_and_writes():
+    # 查询不持有索引锁：与写入、后台合并并发进行时不出错，写入结束后结果与逐块计算一致
+    rng = random.Random(1)
+    chunks = {f"d{i // 10}:{i}": (make_text(rng), False) for i in range(300)}
+    index = KeywordIndex.build(((chunk_id, chunk_id.split(":")[0], text)
+                                for chunk_id, (text, _) in chunks.items()), auto_merge=False)
+    queries = [make_text(rng, rng.randint(2, 20)) for _ in range(20)]
+    errors = []
+
+    def reader():
+        try:
+            for _ in range(5):
+                for query in queries:
+                    index.search(query, 10)
+        except Exception as e:
+            errors.append(e)
+
+    readers = [threading.Thread(target=reader) for _ in range(3)]
+    for thread in readers:
+        thread.start()
+    for i in range(300, 400):
+        text = make_text(rng)
+        chunks[f"d{i // 10}:{i}"] = (text, False)
+        index.add(f"d{i // 10}:{i}", f"d{i // 10}", text)
+        if i % 25 == 0:
+            index.merge()
+    for chunk_id in [chunk_id for chunk_id in chunks if chunk_id.startswith("d5:")]:
+        chunks[chunk_id] = (chunks[chunk_id][0], True)
+    index.remove_document("d5")
+    for thread in readers:
+        thread.join()
+
+    assert not errors
+    index.merge()
+    chunks = {chunk_id: value for chunk_id, value in chunks.items() if not value[1]}
+    assert_matches(index, chunks, queries)
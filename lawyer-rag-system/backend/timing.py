@@ -0,0 +1,27 @@
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from metrics import Histogram
+
+
+@contextmanager
+def timed(timings: Optional[Dict[str, float]], stage: str, histogram: Histogram = None):
+    """记录代码块耗时（秒）到timings[stage]，同名阶段累加
+
+    传入histogram时同时以stage为标签记录到直方图（/metrics）；timings为None时只记录直方图。
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+        if histogram is not None:
+            histogram.observe(elapsed, stage=stage)
+
+
+def format_timings(timings: Dict[str, float]) -> str:
+    """把耗时字典格式化成便于打印的一行文本"""
+    return ", ".join(f"{stage}={seconds * 1000:.0f}ms" for stage, seconds in timings.items())
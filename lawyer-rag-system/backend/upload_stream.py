@@ -0,0 +1,176 @@
+"""上传请求体的流式解析
+
+multipart/form-data中的文件部分边接收边写入上传目录并计算SHA-256，
+不经过Starlette为UploadFile准备的临时文件，文件只写一次磁盘。
+"""
+import codecs
+import hashlib
+import os
+from pathlib import Path
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from python_multipart import MultipartParser
+from python_multipart.exceptions import FormParserError
+from python_multipart.multipart import parse_options_header
+from starlette.concurrency import run_in_threadpool
+
+from config import MAX_UPLOAD_BYTES, MAX_UPLOAD_MB
+
+# 普通表单字段（如category）的最大字节数
+MAX_FIELD_BYTES = 64 * 1024
+
+
+class UploadedFile:
+    """已写入磁盘的上传文件"""
+
+    def __init__(self, filename: str, file_path: Path, size: int, content_hash: str):
+        self.filename = filename
+        self.file_path = file_path
+        self.size = size
+        self.content_hash = content_hash
+
+
+class MultipartUpload:
+    """解析只含一个文件字段的multipart请求体
+
+    target(文件名)在文件部分的头部到达时调用，返回写入路径（可在其中校验文件类型并抛出HTTPException）；
+    数据先写入 路径.part，完整接收后再改名，出错或客户端断开时删除。
+    python_multipart的回调是同步的，回调只记录数据，写盘在线程池中进行，不阻塞事件循环。
+    """
+
+    def __init__(self, content_type: str, file_field: str, target: Callable[[str], Path]):
+        self.content_type = content_type
+        self.file_field = file_field
+        self.target = target
+
+        self.fields: Dict[str, str] = {}
+        self.file: Optional[UploadedFile] = None
+
+        self._charset = "utf-8"
+        self._header_name = b""
+        self._header_value = b""
+        self._disposition = b""
+        self._field_name: Optional[str] = None
+        self._field_data = bytearray()
+        self._is_file = False
+
+        self._out = None
+        self._tmp_path: Optional[Path] = None
+        self._sha256 = None
+        self._size = 0
+        self._target: Optional[Tuple[str, Path]] = None
+        # 本次write()产生、尚未写盘的文件数据，以及已接收完毕的文件
+        self._pending: List[bytes] = []
+        self._finished: List[Tuple[str, Path]] = []
+
+    def _decode(self, value: bytes) -> str:
+        try:
+            return value.decode(self._charset)
+        except UnicodeDecodeError:
+            return value.decode("latin-1")
+
+    def on_part_begin(self):
+        self._disposition = b""
+        self._field_name = None
+        self._field_data = bytearray()
+        self._is_file = False
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        if self._header_name.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._disposition)
+        if b"name" not in options:
+            raise HTTPException(status_code=400, detail="表单字段缺少name")
+        self._field_name = self._decode(options[b"name"])
+        if b"filename" not in options:
+            return
+        if self._field_name != self.file_field or self._tmp_path is not None:
+            raise HTTPException(status_code=400, detail=f"只能在{self.file_field}字段中上传一个文件")
+
+        self._is_file = True
+        filename = self._decode(options[b"filename"])
+        file_path = self.target(filename)
+        self._tmp_path = file_path.with_name(file_path.name + ".part")
+        self._out = open(self._tmp_path, "wb")
+        self._sha256 = hashlib.sha256()
+        self._target = (filename, file_path)
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if self._is_file:
+            chunk = data[start:end]
+            self._size += len(chunk)
+            if self._size > MAX_UPLOAD_BYTES:
+                raise HTTPException(status_code=413, detail=f"文件大小超过限制（{MAX_UPLOAD_MB}MB）")
+            self._sha256.update(chunk)
+            self._pending.append(chunk)
+        else:
+            if len(self._field_data) + end - start > MAX_FIELD_BYTES:
+                raise HTTPException(status_code=400, detail=f"表单字段 {self._field_name} 过长")
+            self._field_data.extend(data[start:end])
+
+    def on_part_end(self):
+        if self._is_file:
+            self._finished.append(self._target)
+        else:
+            self.fields[self._field_name] = self._decode(bytes(self._field_data))
+
+    async def _flush(self):
+        if self._pending:
+            data, self._pending = b"".join(self._pending), []
+            await run_in_threadpool(self._out.write, data)
+        for filename, file_path in self._finished:
+            self._out.close()
+            os.replace(self._tmp_path, file_path)
+            self.file = UploadedFile(filename, file_path, self._size, self._sha256.hexdigest())
+        self._finished = []
+
+    async def parse(self, stream: AsyncIterator[bytes]) -> "MultipartUpload":
+        """读取并解析请求体，返回self（fields为普通字段，file为写入磁盘的文件）"""
+        _, params = parse_options_header(self.content_type)
+        charset = params.get(b"charset", b"utf-8").decode("latin-1")
+        try:
+            self._charset = codecs.lookup(charset).name
+        except LookupError:
+            self._charset = "latin-1"
+        if b"boundary" not in params:
+            raise HTTPException(status_code=400, detail="请求体不是multipart/form-data")
+
+        parser = MultipartParser(params[b"boundary"], {
+            "on_part_begin": self.on_part_begin,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+        })
+        try:
+            async for chunk in stream:
+                parser.write(chunk)
+                await self._flush()
+            parser.finalize()
+            await self._flush()
+        except BaseException as e:
+            if self._out is not None:
+                self._out.close()
+            if self._tmp_path is not None:
+                self._tmp_path.unlink(missing_ok=True)
+            if self.file is not None:
+                self.file.file_path.unlink(missing_ok=True)
+            if isinstance(e, FormParserError):
+                raise HTTPException(status_code=400, detail="无效的multipart请求体") from e
+            raise
+        if self.file is None:
+            raise HTTPException(status_code=422, detail=f"缺少文件字段 {self.file_field}")
+        return self